@@ -4,17 +4,31 @@
 提供簡潔美觀的網頁介面來生成和上傳 FHIR 資料
 """
 
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, Response
 import json
 import os
 from datetime import datetime
 from pathlib import Path
+import random
 import threading
 import time
-from generate_TW_patients import TWFHIRGeneratorFixed
+from generate_TW_patients import TWFHIRGeneratorFixed, MEDICATION_MODES, default_reference_time
+from id_generator import ID_STRATEGIES
+from fhir_search import SearchError, get_local_fhir_store, operation_outcome
+from timing import Profiler, StageTimer
+from metrics import ACTIVE_JOBS, BYTES_WRITTEN, QUEUE_DEPTH, REGISTRY
+from generation_cache import GenerationCache, cache_key
+from records import PatientBatch
 
 app = Flask(__name__)
 
+# 指定種子的生成請求使用的結果快取
+generation_cache = GenerationCache()
+
+# 生成器使用全域 random；指定種子的批量任務在持有此鎖時重設亂數並生成一位病人，
+# 其他請求執行緒的生成也需持有此鎖，才不會打亂種子決定的亂數序列
+generation_lock = threading.Lock()
+
 # 全域變數來追蹤生成狀態
 generation_status = {
     'is_running': False,
@@ -142,6 +156,9 @@ def generate_data():
         num_observations = int(request.form.get('num_observations', 3))
         num_medications = int(request.form.get('num_medications', 2))
         num_encounters = int(request.form.get('num_encounters', 1))  # 新增就診記錄數量
+        medication_mode = request.form.get('medication_mode', 'reference')
+        id_strategy = request.form.get('id_strategy', 'uuid4')
+        seed = request.form.get('seed', type=int)
         server_choice = request.form.get('server_choice', 'none')
         custom_server = request.form.get('custom_server', '')
         
@@ -156,6 +173,10 @@ def generate_data():
             return jsonify({'error': '藥物數量必須在 0-20 之間'}), 400
         if num_encounters < 0 or num_encounters > 10:
             return jsonify({'error': '就診記錄數量必須在 0-10 之間'}), 400
+        if medication_mode not in MEDICATION_MODES:
+            return jsonify({'error': f'不支援的藥物輸出模式: {medication_mode}'}), 400
+        if id_strategy not in ID_STRATEGIES:
+            return jsonify({'error': f'不支援的 ID 策略: {id_strategy}'}), 400
         
         # 重置狀態
         generation_status = {
@@ -168,8 +189,8 @@ def generate_data():
         
         # 在背景執行緒中執行生成任務
         thread = threading.Thread(
-            target=generate_data_background,
-            args=(num_patients, num_conditions, num_observations, num_medications, num_encounters, server_choice, custom_server)
+            target=run_generation_job,
+            args=(num_patients, num_conditions, num_observations, num_medications, num_encounters, server_choice, custom_server, medication_mode, id_strategy, seed)
         )
         thread.daemon = True
         thread.start()
@@ -181,29 +202,17 @@ def generate_data():
     except Exception as e:
         return jsonify({'error': f'發生錯誤: {str(e)}'}), 500
 
-def generate_data_background(num_patients, num_conditions, num_observations, num_medications, num_encounters, server_choice, custom_server):
+def generate_data_background(num_patients, num_conditions, num_observations, num_medications, num_encounters, server_choice, custom_server, medication_mode='reference', id_strategy='uuid4', seed=None):
     """背景執行緒中執行資料生成"""
     global generation_status
     
+    timer = StageTimer()
+    
     try:
-        generator = TWFHIRGeneratorFixed()
-        
-        # 步驟 1: 生成資料
-        generation_status['current_step'] = f'生成 {num_patients} 個病人資料...'
-        generation_status['progress'] = 10
-        
-        all_patient_data = []
-        for i in range(num_patients):
-            generation_status['current_step'] = f'生成第 {i+1}/{num_patients} 個病人...'
-            generation_status['progress'] = 10 + (i / num_patients) * 40
-            
-            patient_data = generator.generate_complete_patient_data(num_conditions, num_observations, num_medications, num_encounters)
-            all_patient_data.append(patient_data)
-            time.sleep(0.1)  # 模擬處理時間
-        
-        # 步驟 2: 儲存檔案
-        generation_status['current_step'] = '儲存資料到檔案...'
-        generation_status['progress'] = 50
+        # 指定種子時以今天 00:00 為基準時間，同一天相同請求的輸出相同
+        reference_time = default_reference_time(seed) if seed is not None else None
+        generator = TWFHIRGeneratorFixed(medication_mode=medication_mode, id_strategy=id_strategy, seed=seed,
+                                         timer=timer, reference_time=reference_time)
         
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         output_dir = Path("output/complete_patients_fixed")
@@ -212,19 +221,68 @@ def generate_data_background(num_patients, num_conditions, num_observations, num
         filename = f"tw_complete_patients_fixed_{timestamp}.json"
         filepath = output_dir / filename
         
-        save_data = []
-        for data in all_patient_data:
-            save_data.append({
-                "patient": data["patient"],
-                "encounters": data["encounters"],
-                "conditions": data["conditions"],
-                "observations": data["observations"],
-                "medications": data["medications"],
-                "medication_requests": data["medication_requests"]
-            })
+        # 指定種子且使用可重現 ID 時先查詢快取，相同請求直接取回先前的檔案
+        # （uuid4 / uuid7 的 ID 與種子無關，輸出不可重現，不使用快取）
+        cache_entry = key = None
+        if seed is not None and id_strategy == 'deterministic':
+            key = cache_key({
+                'mode': 'web',
+                'num_patients': num_patients,
+                'num_conditions': num_conditions,
+                'num_observations': num_observations,
+                'num_medications': num_medications,
+                'num_encounters': num_encounters,
+                'medication_mode': medication_mode,
+                'id_strategy': id_strategy,
+                'reference_time': reference_time.isoformat()
+            }, seed)
+            cache_entry = generation_cache.get(key)
+        
+        if cache_entry is not None:
+            generation_status['current_step'] = '由快取取回資料...'
+            generation_status['progress'] = 50
+            with timer.span('cache'):
+                generation_cache.restore(cache_entry, 'data', filepath)
+            upload_source = []
+            if server_choice != 'none':
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    upload_source = json.load(f)
+            num_medication_resources = cache_entry['meta']['num_medications']
+        else:
+            # 步驟 1: 生成資料
+            generation_status['current_step'] = f'生成 {num_patients} 個病人資料...'
+            generation_status['progress'] = 10
+            
+            # 以精簡記錄保存，寫檔與上傳時才逐一還原成 dict
+            all_patient_data = PatientBatch()
+            QUEUE_DEPTH.inc(num_patients)
+            for i in range(num_patients):
+                generation_status['current_step'] = f'生成第 {i+1}/{num_patients} 個病人...'
+                generation_status['progress'] = 10 + (i / num_patients) * 40
+                
+                with timer.span('generation'), generation_lock:
+                    # 每位病人以 (種子, 序號) 重設亂數，結果與其他請求執行緒無關
+                    if seed is not None:
+                        random.seed(f"{seed}:{i}")
+                    patient_data = generator.generate_complete_patient_data(num_conditions, num_observations, num_medications, num_encounters, patient_index=i)
+                all_patient_data.append(patient_data)
+                QUEUE_DEPTH.dec()
+                time.sleep(0.1)  # 模擬處理時間
+            num_medication_resources = all_patient_data.count("medications")
+            upload_source = all_patient_data.patient_data()
         
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(save_data, f, ensure_ascii=False, indent=2)
+        # 步驟 2: 儲存檔案
+        generation_status['current_step'] = '儲存資料到檔案...'
+        generation_status['progress'] = 50
+        
+        if cache_entry is None:
+            with open(filepath, 'w', encoding='utf-8') as f:
+                all_patient_data.write_json(f, keys=("patient", "encounters", "conditions", "observations",
+                                                     "medications", "medication_requests"), timer=timer)
+            if key is not None:
+                with timer.span('cache'):
+                    generation_cache.put(key, {'data': filepath}, {'num_medications': num_medication_resources})
+        BYTES_WRITTEN.inc(filepath.stat().st_size)
         
         generation_status['progress'] = 60
         
@@ -242,11 +300,12 @@ def generate_data_background(num_patients, num_conditions, num_observations, num
                 server_url = custom_server
             
             upload_results = []
-            for i, patient_data in enumerate(all_patient_data):
+            for i, patient_data in enumerate(upload_source):
                 generation_status['current_step'] = f'上傳第 {i+1}/{num_patients} 個病人...'
                 generation_status['progress'] = 60 + (i / num_patients) * 35
                 
-                result = generator.upload_patient_data_to_server(patient_data, server_url)
+                with timer.span('upload'):
+                    result = generator.upload_patient_data_to_server(patient_data, server_url)
                 upload_results.append(result)
                 time.sleep(0.5)  # 避免過於頻繁的請求
             
@@ -274,6 +333,7 @@ def generate_data_background(num_patients, num_conditions, num_observations, num
                         "medication_requests": total_medication_requests,
                         "errors": total_errors
                     },
+                    "timing": timer.summary(),
                     "results": upload_results
                 }, f, ensure_ascii=False, indent=2)
         
@@ -290,9 +350,12 @@ def generate_data_background(num_patients, num_conditions, num_observations, num
             'num_encounters': num_encounters * num_patients,
             'num_conditions': num_conditions * num_patients,
             'num_observations': num_observations * num_patients,
-            'num_medications': num_medications * num_patients,
+            'num_medications': num_medication_resources,
             'num_medication_requests': num_medications * num_patients,
-            'timestamp': timestamp
+            'medication_mode': medication_mode,
+            'cache': None if key is None else ('hit' if cache_entry is not None else 'miss'),
+            'timestamp': timestamp,
+            'timing': timer.summary()
         }
         
         if upload_results:
@@ -314,6 +377,23 @@ def generate_data_background(num_patients, num_conditions, num_observations, num
         generation_status['error'] = str(e)
         generation_status['current_step'] = f'錯誤: {str(e)}'
 
+def run_generation_job(*args):
+    """執行背景生成任務；啟用 PROFILE_JOBS 時以 cProfile 剖析並附上報告路徑"""
+    ACTIVE_JOBS.inc(1, 'batch')
+    depth_before = QUEUE_DEPTH.value()
+    try:
+        with Profiler('web_job', enabled=app.config.get('PROFILE_JOBS', False)) as profiler:
+            generate_data_background(*args)
+    finally:
+        ACTIVE_JOBS.dec(1, 'batch')
+        # 同時只會有一個批量任務；任務中途失敗時移除尚未生成的病人數
+        QUEUE_DEPTH.set(depth_before)
+    if profiler.stats_path and generation_status.get('results'):
+        generation_status['results']['profile'] = {
+            'stats': str(profiler.stats_path),
+            'report': str(profiler.report_path)
+        }
+
 @app.route('/status')
 def get_status():
     """獲取生成狀態的 API 端點"""
@@ -387,6 +467,7 @@ def search_items():
 @app.route('/generate_custom', methods=['POST'])
 def generate_custom():
     """生成自定義單一病人資料"""
+    ACTIVE_JOBS.inc(1, 'custom')
     try:
         data = request.get_json()
         
@@ -395,14 +476,19 @@ def generate_custom():
         selected_medications = data.get('medications', [])
         server_choice = data.get('server_choice', '1')
         custom_server = data.get('custom_server', '')
+        medication_mode = data.get('medication_mode', 'reference')
+        
+        if medication_mode not in MEDICATION_MODES:
+            return jsonify({'error': f'不支援的藥物輸出模式: {medication_mode}'}), 400
         
         # 生成資料
-        generator = TWFHIRGeneratorFixed()
-        patient_data = generator.generate_custom_patient_data(
-            selected_conditions=selected_conditions,
-            selected_observations=selected_observations,
-            selected_medications=selected_medications
-        )
+        generator = TWFHIRGeneratorFixed(medication_mode=medication_mode)
+        with generation_lock:
+            patient_data = generator.generate_custom_patient_data(
+                selected_conditions=selected_conditions,
+                selected_observations=selected_observations,
+                selected_medications=selected_medications
+            )
         
         if not patient_data:
             return jsonify({'error': '生成資料失敗'}), 500
@@ -417,6 +503,7 @@ def generate_custom():
         
         with open(filepath, 'w', encoding='utf-8') as f:
             json.dump(patient_data, f, ensure_ascii=False, indent=2)
+        BYTES_WRITTEN.inc(filepath.stat().st_size)
         
         # 準備回應資料
         patient_name = patient_data['patient']['name'][0]['text']
@@ -460,6 +547,42 @@ def generate_custom():
         
     except Exception as e:
         return jsonify({'error': f'生成失敗: {str(e)}'}), 500
+    finally:
+        ACTIVE_JOBS.dec(1, 'custom')
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 格式的執行期指標"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+def fhir_response(resource, status=200):
+    """以 application/fhir+json 回應 FHIR 資源"""
+    return Response(json.dumps(resource, ensure_ascii=False), status=status,
+                    mimetype='application/fhir+json')
+
+@app.route('/fhir/<resource_type>')
+def fhir_search(resource_type):
+    """本地 FHIR 搜尋（已生成資料，唯讀）"""
+    try:
+        bundle = get_local_fhir_store().search(
+            resource_type, list(request.args.items(multi=True)), base_url=request.host_url + 'fhir')
+        return fhir_response(bundle)
+    except (SearchError, ValueError) as e:
+        return fhir_response(operation_outcome(str(e)), 400)
+    except FileNotFoundError as e:
+        return fhir_response(operation_outcome(str(e), 'not-supported'), 500)
+
+@app.route('/fhir/<resource_type>/<resource_id>')
+def fhir_read(resource_type, resource_id):
+    """本地 FHIR 讀取"""
+    try:
+        resource = get_local_fhir_store().read(resource_type, resource_id)
+    except FileNotFoundError:
+        # 輸出目錄或檔案在載入時被重新生成或刪除
+        resource = None
+    if resource is None:
+        return fhir_response(operation_outcome(f'{resource_type}/{resource_id} 不存在', 'not-found'), 404)
+    return fhir_response(resource)
 
 if __name__ == '__main__':
     # 確保輸出目錄存在
@@ -0,0 +1,811 @@
+#!/usr/bin/env python3
+"""
+非互動式批量生成命令列
+以參數指定所有選項（不使用 input()），可在 cron / CI 中執行；
+進度以 JSON Lines 輸出到 stdout，生成器的訊息改輸出到 stderr，並以結束碼回報結果
+
+使用方法:
+    python batch_cli.py --patients 1000 --workers 4 --seed 42
+    python batch_cli.py --patients 500 --format ndjson --compress gzip --output output/run.ndjson.gz
+    python batch_cli.py --patients 20 --scenario-mix diabetes=3,hypertension=1,random=2
+    python batch_cli.py --patients 10 --upload twcore
+    python batch_cli.py --patients 1000 --encounters 3 --link-encounters   # 臨床資源引用就診
+    python batch_cli.py --patients 100 --longitudinal-days 1825 --visit-interval 7 --format ndjson   # 縱向時間序列
+    python batch_cli.py --patients 1000000 --seed 42 --shard-index 0 --shard-count 8   # 每台機器一個分片
+    python batch_cli.py --patients 1000 --seed 42 --id-strategy deterministic   # 第二次執行直接取回快取
+    python batch_cli.py --merge-manifests output/shards/*.manifest.json --output output/catalog.json
+    python batch_cli.py --delta-index output/run.ndjson.gz.index.tsv --window-start 2026-10-18 --window-days 1
+    python run.py --batch --patients 1000          # 經由啟動腳本執行
+"""
+
+import argparse
+import contextlib
+import gzip
+import hashlib
+import json
+import random
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from delta import (build_index, generate_delta, index_header, index_path_for, index_row, load_followups,
+                   read_patient_index)
+from generate_TW_patients import MEDICATION_MODES, TWFHIRGeneratorFixed, default_reference_time
+from generation_cache import CACHE_DIR, DEFAULT_MAX_BYTES, GenerationCache, cache_key
+from id_generator import ID_STRATEGIES
+from longitudinal import DEFAULT_VISIT_INTERVAL_DAYS
+from metrics import PATIENT_DATA_RESOURCE_TYPES
+from timing import StageTimer
+
+# 結束碼
+EXIT_OK = 0
+EXIT_UPLOAD_ERRORS = 1
+EXIT_USAGE = 2
+EXIT_FAILURE = 3
+EXIT_INTERRUPTED = 130
+
+OUTPUT_FORMATS = ("json", "ndjson", "bundle")
+COMPRESSIONS = ("none", "gzip")
+PROGRESS_MODES = ("json", "text", "none")
+
+# 上傳目標別名
+UPLOAD_TARGETS = {
+    "twcore": "https://twcore.hapi.fhir.tw/fhir",
+    "hapi": "http://hapi.fhir.org/baseR4"
+}
+
+# bundle 格式 entry.fullUrl 的預設伺服器根網址；資源內的相對引用（Patient/<id>）依此解析
+DEFAULT_BUNDLE_BASE_URL = "http://example.org/fhir"
+
+# 不套用情境、以一般隨機方式生成的情境名稱
+RANDOM_SCENARIO = "random"
+
+# 每個工作單位的病人數；與 workers 數無關，因此相同種子的輸出與 workers 數無關
+CHUNK_SIZE = 100
+
+# 分片清單檔名後綴
+MANIFEST_SUFFIX = ".manifest.json"
+# 決定是否屬於同一邏輯世代的參數（合併分片清單時需完全一致）
+COHORT_KEYS = ("patients", "seed", "shard_count", "conditions", "observations", "medications", "encounters",
+               "id_strategy", "medication_mode", "scenario_mix", "longitudinal_days", "visit_interval",
+               "link_encounters", "format", "compress", "bundle_base_url", "reference_time")
+
+# 工作程序內的生成器（由 _init_worker 建立）
+_worker_generator = None
+_worker_options: Dict[str, Any] = {}
+
+
+def _emit(mode: str, event: str, **fields):
+    """輸出進度事件"""
+    if mode == "json":
+        print(json.dumps(dict(event=event, **fields), ensure_ascii=False), flush=True)
+    elif mode == "text":
+        details = ", ".join(f"{key}={value}" for key, value in fields.items())
+        print(f"[{event}] {details}", file=sys.stderr, flush=True)
+
+
+def _init_worker(options: Dict[str, Any]):
+    """建立工作程序的生成器；生成器的輸出一律導向 stderr"""
+    global _worker_generator, _worker_options
+    with contextlib.redirect_stdout(sys.stderr):
+        _worker_generator = TWFHIRGeneratorFixed(
+            medication_mode=options["medication_mode"], id_strategy=options["id_strategy"],
+            seed=options["seed"], validate_profiles=False, national_id_key=options["national_id_key"],
+            reference_time=options["reference_time"], shared_id_key=options["shared_id_key"])
+    _worker_options = options
+
+
+def _generate_chunk(task: Tuple[int, int]) -> List[Dict[str, Any]]:
+    """生成 [start, end) 序號範圍內的病人資料"""
+    start, end = task
+    options = _worker_options
+    generator = _worker_generator
+    # 每個工作單位以 (種子, 起始序號) 重設亂數，並清除預先抽樣的生理數值，結果與由哪個程序執行無關；
+    # 共用 Medication 的 ID 由執行金鑰決定，各程序與各區塊相同，不需清除
+    if options["seed"] is not None:
+        random.seed(f"{options['seed']}:{start}")
+    generator.physiology_model.clear()
+    scenarios = options["scenarios"]
+    names, weights = list(scenarios), list(scenarios.values())
+
+    chunk = []
+    with contextlib.redirect_stdout(sys.stderr):
+        for patient_index in range(start, end):
+            scenario = random.choices(names, weights)[0] if names else RANDOM_SCENARIO
+            if scenario == RANDOM_SCENARIO and options["longitudinal_days"]:
+                patient_data = generator.generate_longitudinal_patient_data(
+                    options["longitudinal_days"], options["visit_interval"], options["conditions"],
+                    options["medications"], patient_index=patient_index)
+            elif scenario == RANDOM_SCENARIO:
+                patient_data = generator.generate_complete_patient_data(
+                    options["conditions"], options["observations"], options["medications"],
+                    options["encounters"], patient_index=patient_index,
+                    link_encounters=options["link_encounters"])
+            else:
+                definition = options["scenario_definitions"][scenario]
+                patient_data = generator.generate_custom_patient_data(
+                    selected_conditions=definition.get("conditions", []),
+                    selected_observations=definition.get("observations", []),
+                    selected_medications=definition.get("medications", []),
+                    num_encounters=definition.get("num_encounters", options["encounters"]),
+                    patient_index=patient_index, link_encounters=options["link_encounters"])
+                patient_data["scenario"] = scenario
+            chunk.append(patient_data)
+    return chunk
+
+
+def parse_scenario_mix(text: str, scenarios_path: str = "config/scenarios.json") -> Tuple[Dict[str, float], Dict[str, Any]]:
+    """
+    解析 "diabetes=3,hypertension=1,random=2" 形式的情境比例
+
+    Returns:
+        (情境比例, 情境定義)
+    """
+    with open(scenarios_path, 'r', encoding='utf-8') as f:
+        definitions = {scenario["id"]: scenario for scenario in json.load(f).get("scenarios", [])}
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name != RANDOM_SCENARIO and name not in definitions:
+            raise ValueError(f"未知的情境: {name}（可用: {', '.join(list(definitions) + [RANDOM_SCENARIO])}）")
+        mix[name] = float(weight) if weight else 1.0
+    return mix, definitions
+
+
+def count_resources(patient_data: Dict[str, Any]) -> Dict[str, int]:
+    """計算一位病人資料中各類資源的數量"""
+    counts = {"Patient": 1}
+    for key, resource_type in PATIENT_DATA_RESOURCE_TYPES:
+        counts[resource_type] = len(patient_data.get(key, []))
+    return counts
+
+
+class _OutputWriter:
+    """依輸出格式逐批寫入檔案，整批資料不需同時留在記憶體"""
+
+    def __init__(self, path: Path, output_format: str, compression: str,
+                 base_url: str = DEFAULT_BUNDLE_BASE_URL):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.format = output_format
+        self.base_url = base_url.rstrip('/')
+        # bundle 格式中已寫入的 Medication（reference 模式下多位病人共用同一 Medication）
+        self._written_medications = set()
+        if compression == "gzip":
+            self._file = gzip.open(path, 'wt', encoding='utf-8')
+        else:
+            self._file = open(path, 'w', encoding='utf-8')
+        self._first = True
+        if output_format == "json":
+            self._file.write("[\n")
+        elif output_format == "bundle":
+            self._file.write('{\n"resourceType": "Bundle",\n"type": "collection",\n'
+                             f'"timestamp": "{datetime.now().astimezone().isoformat(timespec="seconds")}",\n'
+                             '"entry": [\n')
+
+    def _write_item(self, text: str):
+        if not self._first:
+            self._file.write(",\n")
+        self._file.write(text)
+        self._first = False
+
+    def write(self, patient_data: Dict[str, Any]):
+        if self.format == "ndjson":
+            self._file.write(json.dumps(patient_data, ensure_ascii=False) + "\n")
+        elif self.format == "json":
+            self._write_item(json.dumps(patient_data, ensure_ascii=False, indent=2))
+        else:
+            resources = [patient_data["patient"]]
+            for key, _ in PATIENT_DATA_RESOURCE_TYPES:
+                if key == "medications":
+                    for medication in patient_data.get(key, []):
+                        if medication["id"] not in self._written_medications:
+                            self._written_medications.add(medication["id"])
+                            resources.append(medication)
+                else:
+                    resources.extend(patient_data.get(key, []))
+            for resource in resources:
+                # fullUrl 與資源內的相對引用 (Type/id) 一致，Bundle 內的引用才能解析
+                self._write_item(json.dumps({
+                    "fullUrl": f"{self.base_url}/{resource['resourceType']}/{resource['id']}",
+                    "resource": resource
+                }, ensure_ascii=False))
+
+    def close(self):
+        if self.format == "json":
+            self._file.write("\n]\n")
+        elif self.format == "bundle":
+            self._file.write("\n]\n}\n")
+        self._file.close()
+
+
+def _default_output_path(output_format: str, compression: str, shard_index: int = 0, shard_count: int = 1) -> Path:
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    extension = "ndjson" if output_format == "ndjson" else "json"
+    suffix = ".gz" if compression == "gzip" else ""
+    shard = f"_shard{shard_index:04d}of{shard_count:04d}" if shard_count > 1 else ""
+    name = f"tw_complete_patients_fixed_{timestamp}{shard}.{extension}{suffix}"
+    return Path("output/complete_patients_fixed") / name
+
+
+def shard_unit_count(num_patients: int) -> int:
+    """世代的工作單位數（每 CHUNK_SIZE 位病人一個），即可用的最大分片數"""
+    return -(-num_patients // CHUNK_SIZE)
+
+
+def shard_tasks(num_patients: int, shard_index: int = 0, shard_count: int = 1) -> List[Tuple[int, int]]:
+    """
+    將整個世代切成工作單位，並取出本分片負責的連續區段
+
+    工作單位的邊界與分片數無關，因此各分片合起來與單機生成的結果完全相同；
+    各分片的工作單位數最多相差一個，分片數不可超過 shard_unit_count()
+
+    Args:
+        num_patients: 整個世代的病人數
+        shard_index: 本分片編號 (0 起算)
+        shard_count: 分片總數
+
+    Returns:
+        本分片的 [(start, end), ...] 病人序號範圍
+    """
+    if shard_count > shard_unit_count(num_patients):
+        raise ValueError(f"分片數 {shard_count} 超過工作單位數 {shard_unit_count(num_patients)}")
+    tasks = [(start, min(start + CHUNK_SIZE, num_patients)) for start in range(0, num_patients, CHUNK_SIZE)]
+    first = len(tasks) * shard_index // shard_count
+    last = len(tasks) * (shard_index + 1) // shard_count
+    return tasks[first:last]
+
+
+def _iter_chunks(tasks: List[Tuple[int, int]], workers: int,
+                 options: Dict[str, Any]) -> Iterator[List[Dict[str, Any]]]:
+    """依序產生各工作單位的結果"""
+    if workers <= 1:
+        _init_worker(options)
+        for task in tasks:
+            yield _generate_chunk(task)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options,)) as executor:
+        for chunk in executor.map(_generate_chunk, tasks):
+            yield chunk
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_manifest(output_path: Path, cohort: Dict[str, Any], shard_index: int,
+                   tasks: List[Tuple[int, int]], patients: int, resources: Dict[str, int],
+                   index_path: Optional[Path] = None) -> Path:
+    """
+    寫入分片清單（與輸出檔同目錄，檔名加上 .manifest.json）
+
+    Returns:
+        清單檔路徑
+    """
+    manifest = {
+        "cohort": cohort,
+        "shard_index": shard_index,
+        "patient_range": [tasks[0][0], tasks[-1][1]] if tasks else None,
+        "patients": patients,
+        "resources": resources,
+        "file": output_path.name,
+        "index": index_path.name if index_path else None,
+        "bytes": output_path.stat().st_size,
+        "sha256": _file_sha256(output_path),
+        "created_at": datetime.now().astimezone().isoformat(timespec="seconds")
+    }
+    manifest_path = output_path.with_name(output_path.name + MANIFEST_SUFFIX)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest_path
+
+
+def merge_manifests(manifest_paths: List[str], verify: bool = False) -> Dict[str, Any]:
+    """
+    合併各分片清單為單一世代目錄
+
+    Args:
+        manifest_paths: 分片清單檔路徑
+        verify: 是否重新計算各分片輸出檔的 SHA-256
+
+    Returns:
+        世代目錄
+
+    Raises:
+        ValueError: 清單不屬於同一世代、分片重複或缺漏、檔案不符
+    """
+    manifests = []
+    for manifest_path in manifest_paths:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifests.append((Path(manifest_path), json.load(f)))
+    if not manifests:
+        raise ValueError("沒有分片清單")
+
+    cohort = manifests[0][1]["cohort"]
+    for manifest_path, manifest in manifests:
+        if manifest["cohort"] != cohort:
+            raise ValueError(f"{manifest_path} 與其他分片不屬於同一世代")
+    shards = sorted(manifests, key=lambda item: item[1]["shard_index"])
+    indexes = [manifest["shard_index"] for _, manifest in shards]
+    if indexes != list(range(cohort["shard_count"])):
+        missing = sorted(set(range(cohort["shard_count"])) - set(indexes))
+        raise ValueError(f"分片重複或缺漏（共 {cohort['shard_count']} 片，取得 {indexes}，缺少 {missing}）")
+
+    resources: Dict[str, int] = {}
+    entries = []
+    for manifest_path, manifest in shards:
+        data_path = manifest_path.with_name(manifest["file"])
+        if verify:
+            if not data_path.exists():
+                raise ValueError(f"找不到分片輸出檔: {data_path}")
+            if _file_sha256(data_path) != manifest["sha256"]:
+                raise ValueError(f"分片輸出檔內容與清單不符: {data_path}")
+        for resource_type, count in manifest["resources"].items():
+            resources[resource_type] = resources.get(resource_type, 0) + count
+        entries.append({key: manifest[key] for key in
+                        ("shard_index", "patient_range", "patients", "resources", "bytes", "sha256")})
+        entries[-1]["file"] = str(data_path)
+        if manifest.get("index"):
+            entries[-1]["index"] = str(manifest_path.with_name(manifest["index"]))
+
+    total_patients = sum(entry["patients"] for entry in entries)
+    if total_patients != cohort["patients"]:
+        raise ValueError(f"分片病人數合計 {total_patients} 與世代病人數 {cohort['patients']} 不符")
+    return {
+        "cohort": cohort,
+        "patients": total_patients,
+        "resources": resources,
+        "bytes": sum(entry["bytes"] for entry in entries),
+        "shards": entries,
+        "created_at": datetime.now().astimezone().isoformat(timespec="seconds")
+    }
+
+
+def run_merge(args) -> int:
+    """合併分片清單，回傳結束碼"""
+    try:
+        catalog = merge_manifests(args.merge_manifests, verify=args.verify)
+    except (OSError, KeyError, ValueError) as e:
+        _emit(args.progress, "error", message=str(e))
+        return EXIT_FAILURE
+    output_path = Path(args.output) if args.output else Path("output/complete_patients_fixed/catalog.json")
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(catalog, f, ensure_ascii=False, indent=2)
+    _emit(args.progress, "merged", output=str(output_path), shards=len(catalog["shards"]),
+          patients=catalog["patients"], resources=catalog["resources"])
+    return EXIT_OK
+
+
+def run_build_index(args) -> int:
+    """由既有輸出建立病人索引，回傳結束碼"""
+    try:
+        index_path, patients = build_index(Path(args.build_index), Path(args.output) if args.output else None)
+    except (OSError, ValueError, KeyError) as e:
+        _emit(args.progress, "error", message=str(e))
+        return EXIT_FAILURE
+    _emit(args.progress, "indexed", index=str(index_path), patients=patients)
+    return EXIT_OK
+
+
+def run_delta(args) -> int:
+    """
+    增量生成：掃描病人索引，只為時間窗內有就診的病人生成新資源，
+    以 FHIR NDJSON（一行一個資源）輸出或上傳，回傳結束碼
+    """
+    progress = args.progress
+    timer = StageTimer()
+    if args.window_start:
+        window_start = datetime.fromisoformat(args.window_start)
+    else:
+        window_start = datetime.combine(datetime.now().date(), datetime.min.time())
+    if args.seed is not None:
+        random.seed(f"{args.seed}:delta:{window_start.isoformat()}")
+
+    with contextlib.redirect_stdout(sys.stderr):
+        generator = TWFHIRGeneratorFixed(
+            medication_mode=args.medication_mode, id_strategy=args.id_strategy, seed=args.seed,
+            validate_profiles=not args.no_validate, upload_interval=args.upload_interval, timer=timer)
+    followups = load_followups(generator)
+
+    if args.output:
+        output_path = Path(args.output)
+    else:
+        suffix = ".gz" if args.compress == "gzip" else ""
+        output_path = Path("output/delta") / f"delta_{window_start.strftime('%Y%m%dT%H%M%S')}.ndjson{suffix}"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    server_url = UPLOAD_TARGETS.get(args.upload, args.upload) if args.upload else None
+    if server_url and args.forget_medication_ids:
+        generator.medication_registry.forget_server(server_url)
+
+    _emit(progress, "start", delta=True, index=args.delta_index, window_start=window_start.isoformat(),
+          window_days=args.window_days, output=str(output_path), upload=server_url)
+
+    started = time.perf_counter()
+    scanned = [0]
+    active_patients = 0
+    resource_counts: Dict[str, int] = {}
+    upload_summary = {"resources": 0, "errors": 0}
+    upload_errors: List[str] = []
+    # reference 模式下同一 Medication 只輸出一次
+    written_medications = set()
+
+    def counted(entries):
+        for entry in entries:
+            scanned[0] += 1
+            yield entry
+
+    output_file = gzip.open(output_path, 'wt', encoding='utf-8') if args.compress == "gzip" \
+        else open(output_path, 'w', encoding='utf-8')
+    try:
+        deltas = generate_delta(generator, counted(read_patient_index(Path(args.delta_index))),
+                                window_start, args.window_days, followups)
+        while True:
+            with timer.span("generation"), contextlib.redirect_stdout(sys.stderr):
+                item = next(deltas, None)
+            if item is None:
+                break
+            entry, followup_data = item
+            active_patients += 1
+            with timer.span("write"):
+                for key, resource_type in PATIENT_DATA_RESOURCE_TYPES:
+                    for resource in followup_data[key]:
+                        if key == "medications":
+                            if resource["id"] in written_medications:
+                                continue
+                            written_medications.add(resource["id"])
+                        output_file.write(json.dumps(resource, ensure_ascii=False) + "\n")
+                        resource_counts[resource_type] = resource_counts.get(resource_type, 0) + 1
+
+            if server_url:
+                with timer.span("upload"), contextlib.redirect_stdout(sys.stderr):
+                    result = generator.upload_patient_data_to_server(followup_data, server_url,
+                                                                     existing_patient_id=entry.id)
+                upload_summary["resources"] += sum(len(result.get(key, [])) for key, _ in PATIENT_DATA_RESOURCE_TYPES)
+                upload_summary["errors"] += len(result["errors"])
+                upload_errors.extend(result["errors"])
+
+            if active_patients % 1000 == 0:
+                _emit(progress, "progress", scanned=scanned[0], active_patients=active_patients,
+                      resources=sum(resource_counts.values()))
+    except KeyboardInterrupt:
+        output_file.close()
+        _emit(progress, "interrupted", scanned=scanned[0], output=str(output_path))
+        return EXIT_INTERRUPTED
+    except Exception as e:
+        output_file.close()
+        _emit(progress, "error", message=str(e), scanned=scanned[0])
+        return EXIT_FAILURE
+    output_file.close()
+
+    exit_code = EXIT_UPLOAD_ERRORS if upload_summary["errors"] else EXIT_OK
+    elapsed = time.perf_counter() - started
+    summary = {
+        "output": str(output_path),
+        "scanned_patients": scanned[0],
+        "active_patients": active_patients,
+        "resources": resource_counts,
+        "bytes": output_path.stat().st_size,
+        "elapsed_seconds": round(elapsed, 3),
+        "timing": timer.summary(),
+        "exit_code": exit_code
+    }
+    if server_url:
+        summary["upload"] = dict(upload_summary, server_url=server_url, error_messages=upload_errors[:50])
+    _emit(progress, "done", **summary)
+    return exit_code
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description='台灣 FHIR 病人資料生成器 - 非互動式批量生成 / Headless batch generation',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"""
+結束碼 / Exit codes:
+  {EXIT_OK}    成功 / Success
+  {EXIT_UPLOAD_ERRORS}    資料已生成但部分上傳失敗 / Generated, but some uploads failed
+  {EXIT_USAGE}    參數錯誤 / Invalid arguments
+  {EXIT_FAILURE}    生成失敗 / Generation failed
+  {EXIT_INTERRUPTED}  使用者中斷 / Interrupted
+        """
+    )
+    parser.add_argument('--patients', type=int, default=2, help='病人數量 (預設: 2)')
+    parser.add_argument('--conditions', type=int, default=2, help='每位病人的疾病數量 (預設: 2)')
+    parser.add_argument('--observations', type=int, default=3, help='每位病人的觀察記錄數量 (預設: 3)')
+    parser.add_argument('--medications', type=int, default=2, help='每位病人的藥物數量 (預設: 2)')
+    parser.add_argument('--encounters', type=int, default=1, help='每位病人的就診記錄數量 (預設: 1)')
+    parser.add_argument('--seed', type=int,
+                        help='隨機種子；指定時資料內容可重現（同一 --reference-time）且與 --workers 無關，'
+                             '搭配 --id-strategy deterministic 時資源 ID 也可重現（才會使用生成快取）')
+    parser.add_argument('--reference-time',
+                        help='生成資料的基準時間 YYYY-MM-DD 或 ISO 日期時間，日期皆相對於此 '
+                             '(預設: 指定 --seed 時為今天 00:00，否則為執行開始時間)')
+    parser.add_argument('--id-strategy', choices=ID_STRATEGIES, default='uuid4', help='資源 ID 策略 (預設: uuid4)')
+    parser.add_argument('--medication-mode', choices=MEDICATION_MODES,
+                        default='reference', help='MedicationRequest 引用藥物的方式 (預設: reference)')
+    parser.add_argument('--workers', type=int, default=1, help='平行生成的程序數 (預設: 1)')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='json',
+                        help='輸出格式: json (病人資料陣列)、ndjson (每行一位病人)、bundle (FHIR collection Bundle)')
+    parser.add_argument('--compress', choices=COMPRESSIONS, default='none', help='輸出壓縮方式 (預設: none)')
+    parser.add_argument('--bundle-base-url', default=DEFAULT_BUNDLE_BASE_URL,
+                        help=f'bundle 格式 entry.fullUrl 使用的伺服器根網址 (預設: {DEFAULT_BUNDLE_BASE_URL})')
+    parser.add_argument('--output', help='輸出檔案路徑 (預設: output/complete_patients_fixed/ 下依時間命名)')
+    parser.add_argument('--scenario-mix', help='情境比例，例如 diabetes=3,hypertension=1,random=2 (見 config/scenarios.json)')
+    parser.add_argument('--link-encounters', action='store_true',
+                        help='先排定就診時間軸，Condition / Observation / MedicationRequest 引用其中一次就診並使用就診日期')
+    parser.add_argument('--longitudinal-days', type=int,
+                        help='縱向模式：在此追蹤期間（天）內生成多次就診的生命徵象與定期檢驗序列')
+    parser.add_argument('--visit-interval', type=float, default=DEFAULT_VISIT_INTERVAL_DAYS,
+                        help=f'縱向模式的平均就診間隔天數 (預設: {DEFAULT_VISIT_INTERVAL_DAYS})')
+    parser.add_argument('--upload', help='上傳目標: twcore、hapi 或 FHIR 伺服器 URL；未指定時不上傳')
+    parser.add_argument('--upload-interval', type=float, default=0.5, help='上傳每筆資源之間的間隔秒數 (預設: 0.5)')
+    parser.add_argument('--no-validate', action='store_true', help='上傳前不驗證 TW Core Profile')
+    parser.add_argument('--forget-medication-ids', action='store_true',
+                        help='上傳前清除此伺服器的 Medication ID 快取（伺服器資料已重置時使用）')
+    parser.add_argument('--shard-index', type=int, default=0, help='本分片編號，0 起算 (預設: 0)')
+    parser.add_argument('--shard-count', type=int, default=1,
+                        help=f'分片總數；大於 1 時 --patients 為整個世代的病人數，需指定 --seed，'
+                             f'最多為每 {CHUNK_SIZE} 位病人一個分片 (預設: 1)')
+    parser.add_argument('--merge-manifests', nargs='+', metavar='MANIFEST',
+                        help='合併各分片的清單為世代目錄（寫到 --output），不生成資料')
+    parser.add_argument('--verify', action='store_true', help='合併時重新計算各分片輸出檔的 SHA-256')
+    parser.add_argument('--delta-index', metavar='INDEX',
+                        help='增量模式：讀取既有世代的病人索引，只生成時間窗內的新就診、觀察與處方')
+    parser.add_argument('--window-start', help='增量時間窗起點 YYYY-MM-DD 或 ISO 日期時間 (預設: 今天 00:00)')
+    parser.add_argument('--window-days', type=float, default=1, help='增量時間窗長度（天）(預設: 1)')
+    parser.add_argument('--build-index', metavar='SOURCE',
+                        help='由既有的 json / ndjson 輸出建立病人索引（寫到 SOURCE.index.tsv 或 --output）')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='不使用生成快取（指定 --seed、--id-strategy deterministic 且不上傳時預設使用）')
+    parser.add_argument('--cache-dir', default=str(CACHE_DIR), help=f'生成快取目錄 (預設: {CACHE_DIR})')
+    parser.add_argument('--cache-max-mb', type=int, default=DEFAULT_MAX_BYTES // 2 ** 20,
+                        help=f'生成快取容量上限 MB，超過時淘汰最久未使用的項目 (預設: {DEFAULT_MAX_BYTES // 2 ** 20})')
+    parser.add_argument('--progress', choices=PROGRESS_MODES, default='json',
+                        help='進度輸出: json (stdout JSON Lines)、text (stderr)、none')
+    return parser
+
+
+def _validate_args(args) -> Optional[str]:
+    if args.merge_manifests or args.build_index:
+        return None
+    if args.delta_index:
+        if args.window_days <= 0:
+            return "--window-days 必須大於 0"
+        if args.window_start:
+            try:
+                datetime.fromisoformat(args.window_start)
+            except ValueError:
+                return f"--window-start 格式錯誤: {args.window_start}"
+        return None
+    if args.patients < 1:
+        return "病人數量必須大於 0"
+    if args.reference_time:
+        try:
+            reference_time = datetime.fromisoformat(args.reference_time)
+        except ValueError:
+            return f"--reference-time 格式錯誤: {args.reference_time}"
+        if reference_time.tzinfo is not None:
+            return "--reference-time 請使用不含時區的台灣本地時間"
+    for name in ("conditions", "observations", "medications", "encounters"):
+        if getattr(args, name) < 0:
+            return f"--{name} 不可為負數"
+    if args.workers < 1:
+        return "--workers 必須大於 0"
+    if args.longitudinal_days is not None and args.longitudinal_days < 1:
+        return "--longitudinal-days 必須大於 0"
+    if args.visit_interval <= 0:
+        return "--visit-interval 必須大於 0"
+    if args.shard_count < 1:
+        return "--shard-count 必須大於 0"
+    if not 0 <= args.shard_index < args.shard_count:
+        return f"--shard-index 必須在 0-{args.shard_count - 1} 之間"
+    if args.shard_count > 1 and args.seed is None:
+        return "分片生成需指定 --seed，所有分片必須使用相同種子"
+    if args.shard_count > shard_unit_count(args.patients):
+        return (f"--shard-count 不可超過工作單位數 {shard_unit_count(args.patients)}"
+                f"（每 {CHUNK_SIZE} 位病人一個單位，否則會有分片沒有病人）")
+    if args.cache_max_mb < 0:
+        return "--cache-max-mb 不可為負數"
+    return None
+
+
+def _restore_cached(args, entry: Dict[str, Any], output_path: Path, cohort: Dict[str, Any],
+                    tasks: List[Tuple[int, int]], started: float) -> int:
+    """由快取項目還原輸出檔、病人索引與分片清單，回傳結束碼"""
+    meta = entry["meta"]
+    GenerationCache.restore(entry, "data", output_path)
+    index_path = GenerationCache.restore(entry, "index", index_path_for(output_path))
+    manifest_path = write_manifest(output_path, cohort, args.shard_index, tasks, meta["patients"],
+                                   meta["resources"], index_path)
+    elapsed = time.perf_counter() - started
+    _emit(args.progress, "done", output=str(output_path), manifest=str(manifest_path), index=str(index_path),
+          patients=meta["patients"], resources=meta["resources"], bytes=output_path.stat().st_size,
+          elapsed_seconds=round(elapsed, 3), cache="hit", cache_key=entry["key"], exit_code=EXIT_OK)
+    return EXIT_OK
+
+
+def run(args) -> int:
+    """依參數執行批量生成，回傳結束碼"""
+    progress = args.progress
+    timer = StageTimer()
+    scenarios, scenario_definitions = {}, {}
+    if args.scenario_mix:
+        try:
+            scenarios, scenario_definitions = parse_scenario_mix(args.scenario_mix)
+        except (OSError, ValueError) as e:
+            _emit(progress, "error", message=str(e))
+            return EXIT_USAGE
+
+    options = {
+        "conditions": args.conditions,
+        "observations": args.observations,
+        "medications": args.medications,
+        "encounters": args.encounters,
+        "seed": args.seed,
+        # 所有工作程序共用同一個身分證字號置換金鑰；未指定種子時由主程序抽出一次
+        "national_id_key": args.seed if args.seed is not None else random.SystemRandom().getrandbits(64),
+        # 所有工作程序共用同一個 Medication ID 金鑰，同一藥物在整次執行中只有一個 Medication
+        "shared_id_key": uuid.uuid4().hex,
+        # 所有工作程序共用同一個基準時間，輸出與各程序實際執行的時間無關
+        "reference_time": datetime.fromisoformat(args.reference_time) if args.reference_time
+        else default_reference_time(args.seed),
+        "id_strategy": args.id_strategy,
+        "medication_mode": args.medication_mode,
+        "link_encounters": args.link_encounters,
+        "longitudinal_days": args.longitudinal_days,
+        "visit_interval": args.visit_interval,
+        "scenarios": scenarios,
+        "scenario_definitions": scenario_definitions
+    }
+    output_path = Path(args.output) if args.output else _default_output_path(
+        args.format, args.compress, args.shard_index, args.shard_count)
+    tasks = shard_tasks(args.patients, args.shard_index, args.shard_count)
+    shard_patients = sum(end - start for start, end in tasks)
+    server_url = UPLOAD_TARGETS.get(args.upload, args.upload) if args.upload else None
+
+    uploader = None
+    if server_url:
+        with contextlib.redirect_stdout(sys.stderr):
+            uploader = TWFHIRGeneratorFixed(validate_profiles=not args.no_validate,
+                                            upload_interval=args.upload_interval, timer=timer)
+            if args.forget_medication_ids:
+                uploader.medication_registry.forget_server(server_url)
+
+    _emit(progress, "start", patients=shard_patients, workers=args.workers, output=str(output_path),
+          format=args.format, compress=args.compress, upload=server_url,
+          shard_index=args.shard_index, shard_count=args.shard_count,
+          patient_range=[tasks[0][0], tasks[-1][1]] if tasks else None)
+
+    started = time.perf_counter()
+    cohort = {key: getattr(args, key) for key in COHORT_KEYS if key != "scenario_mix"}
+    cohort["scenario_mix"] = scenarios
+    cohort["reference_time"] = options["reference_time"].isoformat()
+
+    # 輸出可完全重現（指定種子且 ID 由種子決定）且不上傳時使用生成快取：
+    # 相同世代、分片與輸出格式直接取回先前的輸出
+    cache = key = None
+    if args.seed is not None and args.id_strategy == "deterministic" and uploader is None and not args.no_cache:
+        cache = GenerationCache(Path(args.cache_dir), args.cache_max_mb * 2 ** 20)
+        key = cache_key(dict(cohort, shard_index=args.shard_index), args.seed)
+        entry = cache.get(key)
+        if entry is not None:
+            try:
+                return _restore_cached(args, entry, output_path, cohort, tasks, started)
+            except (OSError, KeyError) as e:
+                # 快取項目損壞或同時被淘汰時改為重新生成
+                _emit(progress, "cache_error", message=str(e))
+    generated = 0
+    resource_counts: Dict[str, int] = {}
+    upload_summary = {"patients": 0, "resources": 0, "errors": 0}
+    upload_errors: List[str] = []
+
+    writer = _OutputWriter(output_path, args.format, args.compress, args.bundle_base_url)
+    # 精簡病人索引，供增量生成使用（見 delta.py）
+    index_path = index_path_for(output_path)
+    index_file = open(index_path, 'w', encoding='utf-8')
+    index_file.write(index_header())
+    patient_indexes = (i for start, end in tasks for i in range(start, end))
+    try:
+        chunks = _iter_chunks(tasks, args.workers, options)
+        while True:
+            with timer.span("generation"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            with timer.span("write"):
+                for patient_data in chunk:
+                    writer.write(patient_data)
+                    index_file.write(index_row(patient_data, next(patient_indexes)))
+            for patient_data in chunk:
+                for resource_type, count in count_resources(patient_data).items():
+                    resource_counts[resource_type] = resource_counts.get(resource_type, 0) + count
+            generated += len(chunk)
+
+            if uploader is not None:
+                with timer.span("upload"), contextlib.redirect_stdout(sys.stderr):
+                    for patient_data in chunk:
+                        result = uploader.upload_patient_data_to_server(patient_data, server_url)
+                        upload_summary["patients"] += 1 if result["patient"] else 0
+                        upload_summary["resources"] += (1 if result["patient"] else 0) + sum(
+                            len(result.get(key, [])) for key, _ in PATIENT_DATA_RESOURCE_TYPES)
+                        upload_summary["errors"] += len(result["errors"])
+                        upload_errors.extend(result["errors"])
+
+            elapsed = time.perf_counter() - started
+            _emit(progress, "progress", generated=generated, total=shard_patients,
+                  percent=round(generated / shard_patients * 100, 1),
+                  patients_per_second=round(generated / elapsed, 1) if elapsed else None,
+                  uploaded=upload_summary["patients"] if uploader else None)
+    except KeyboardInterrupt:
+        writer.close()
+        index_file.close()
+        _emit(progress, "interrupted", generated=generated, output=str(output_path))
+        return EXIT_INTERRUPTED
+    except Exception as e:
+        writer.close()
+        index_file.close()
+        _emit(progress, "error", message=str(e), generated=generated)
+        return EXIT_FAILURE
+
+    with timer.span("write"):
+        writer.close()
+        index_file.close()
+    if cache is not None:
+        with timer.span("cache"):
+            try:
+                cache.put(key, {"data": output_path, "index": index_path},
+                          {"patients": generated, "resources": resource_counts})
+            except OSError as e:
+                _emit(progress, "cache_error", message=str(e))
+    manifest_path = write_manifest(output_path, cohort, args.shard_index, tasks, generated, resource_counts,
+                                   index_path)
+
+    exit_code = EXIT_UPLOAD_ERRORS if upload_summary["errors"] else EXIT_OK
+    elapsed = time.perf_counter() - started
+    summary = {
+        "output": str(output_path),
+        "manifest": str(manifest_path),
+        "index": str(index_path),
+        "patients": generated,
+        "resources": resource_counts,
+        "bytes": output_path.stat().st_size,
+        "elapsed_seconds": round(elapsed, 3),
+        "patients_per_second": round(generated / elapsed, 1) if elapsed else None,
+        "timing": timer.summary(),
+        "cache": "miss" if cache is not None else None,
+        "exit_code": exit_code
+    }
+    if uploader is not None:
+        summary["upload"] = dict(upload_summary, server_url=server_url, error_messages=upload_errors[:50])
+    _emit(progress, "done", **summary)
+    return exit_code
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    message = _validate_args(args)
+    if message:
+        parser.print_usage(sys.stderr)
+        print(f"錯誤: {message}", file=sys.stderr)
+        return EXIT_USAGE
+    if args.merge_manifests:
+        return run_merge(args)
+    if args.build_index:
+        return run_build_index(args)
+    if args.delta_index:
+        return run_delta(args)
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+生成器效能測試模組
+測量各生成函式與完整病人資料生成、JSON 儲存的吞吐量（patients/s、resources/s、bytes/s）與峰值記憶體，
+結果可儲存為基準線並在效能退步超過門檻時標示
+
+使用方法:
+    python run.py --bench                       # 執行效能測試並與基準線比較
+    python run.py --bench --save-baseline       # 執行後將結果存為新的基準線
+"""
+
+import contextlib
+import io
+import json
+import math
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+DEFAULT_BASELINE_PATH = "output/benchmarks/baseline.json"
+# 吞吐量下降（或峰值記憶體上升）超過此比例即視為退步
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+# 完整病人資料生成的世代大小
+COHORT_SIZES = (10, 100, 500)
+# 選項組合: (名稱, 生成器參數, generate_complete_patient_data 參數)
+OPTION_COMBINATIONS = (
+    ("reference", {"medication_mode": "reference"}, (2, 3, 2, 1)),
+    ("contained", {"medication_mode": "contained"}, (2, 3, 2, 1)),
+    ("codeable_concept", {"medication_mode": "codeable_concept"}, (2, 3, 2, 1)),
+    ("deterministic_large", {"id_strategy": "deterministic"}, (5, 10, 5, 3))
+)
+# 單一函式測試的呼叫次數
+MICRO_ITERATIONS = 2000
+# 每項測量重複次數，取最快的一次以降低雜訊
+REPEATS = 3
+
+# 數值越高越好的指標；其餘（peak_memory_kb）越低越好
+THROUGHPUT_METRICS = ("ops_per_second", "patients_per_second", "resources_per_second", "bytes_per_second")
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    """nearest-rank 百分位數（輸入需已排序）"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def count_resources(patient_data: Dict[str, Any]) -> int:
+    """計算一位病人資料中的資源數"""
+    return 1 + sum(len(patient_data.get(key, [])) for key in
+                   ("encounters", "conditions", "observations", "medications", "medication_requests"))
+
+
+def _quiet_generator(**kwargs):
+    """建立生成器，並隱藏載入配置時的輸出"""
+    from generate_TW_patients import TWFHIRGeneratorFixed
+    with contextlib.redirect_stdout(io.StringIO()):
+        return TWFHIRGeneratorFixed(**kwargs)
+
+
+def _time_calls(func: Callable[[], Any], iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return time.perf_counter() - start
+
+
+def _peak_memory_kb(func: Callable[[], Any]) -> float:
+    tracemalloc.start()
+    try:
+        func()
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+
+def run_micro_benchmarks(iterations: int = MICRO_ITERATIONS, seed: int = 42) -> Dict[str, Dict[str, float]]:
+    """測量單一資源生成函式"""
+    random.seed(seed)
+    generator = _quiet_generator(seed=seed)
+    patient = generator.generate_patient()
+    patient_id, patient_name = patient["id"], patient["name"][0]["text"]
+
+    cases = {
+        "generate_patient": generator.generate_patient,
+        "generate_encounter": lambda: generator.generate_encounter(patient_id, patient_name),
+        "generate_condition_with_info": lambda: generator.generate_condition_with_info(
+            patient_id, patient_name, random.choice(generator.conditions)),
+        "generate_observation_with_info": lambda: generator.generate_observation_with_info(
+            patient_id, patient_name, random.choice(generator.observations)),
+        "generate_medication_with_info": lambda: generator.generate_medication_with_info(
+            patient_id, patient_name, random.choice(generator.medications))
+    }
+
+    results = {}
+    for name, func in cases.items():
+        # 先暖身一次，讓各種延遲載入的快取不計入測量
+        func()
+        elapsed = min(_time_calls(func, iterations) for _ in range(REPEATS))
+        results[name] = {
+            "ops_per_second": round(iterations / elapsed, 1),
+            "us_per_op": round(elapsed / iterations * 1e6, 2)
+        }
+    return results
+
+
+def run_cohort_benchmark(cohort_size: int, generator_options: Dict[str, Any],
+                         counts: Tuple[int, int, int, int], seed: int = 42) -> Dict[str, float]:
+    """
+    測量完整病人資料生成與 JSON 儲存
+
+    Args:
+        cohort_size: 病人數
+        generator_options: TWFHIRGeneratorFixed 參數
+        counts: (疾病數, 觀察數, 藥物數, 就診數)
+        seed: 隨機種子
+
+    Returns:
+        吞吐量與峰值記憶體指標
+    """
+    def generate():
+        random.seed(seed)
+        generator = _quiet_generator(seed=seed, **generator_options)
+        generator.generate_complete_patient_data(*counts, patient_index=0)
+        start = time.perf_counter()
+        cohort = [generator.generate_complete_patient_data(*counts, patient_index=i) for i in range(cohort_size)]
+        return cohort, time.perf_counter() - start
+
+    runs = [generate() for _ in range(REPEATS)]
+    cohort = runs[0][0]
+    generate_seconds = min(seconds for _, seconds in runs)
+    resources = sum(count_resources(patient_data) for patient_data in cohort)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filepath = Path(tmp_dir) / "cohort.json"
+        save_seconds = float("inf")
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            with open(filepath, 'w', encoding='utf-8') as f:
+                json.dump(cohort, f, ensure_ascii=False, indent=2)
+            save_seconds = min(save_seconds, time.perf_counter() - start)
+        size = filepath.stat().st_size
+
+    return {
+        "patients_per_second": round(cohort_size / generate_seconds, 1),
+        "resources_per_second": round(resources / generate_seconds, 1),
+        "bytes_per_second": round(size / save_seconds, 1),
+        "bytes": size,
+        "peak_memory_kb": _peak_memory_kb(generate)
+    }
+
+
+def run_benchmarks(cohort_sizes=COHORT_SIZES, iterations: int = MICRO_ITERATIONS, seed: int = 42) -> Dict[str, Any]:
+    """執行完整效能測試"""
+    results: Dict[str, Any] = {}
+    print("⏱️  測量單一資源生成函式...")
+    for name, metrics in run_micro_benchmarks(iterations, seed).items():
+        results[name] = metrics
+        print(f"   {name}: {metrics['ops_per_second']:,.0f} ops/s")
+
+    for option_name, generator_options, counts in OPTION_COMBINATIONS:
+        for cohort_size in cohort_sizes:
+            name = f"cohort_{cohort_size}_{option_name}"
+            print(f"⏱️  {name}...")
+            metrics = run_cohort_benchmark(cohort_size, generator_options, counts, seed)
+            results[name] = metrics
+            print(f"   {metrics['patients_per_second']:,.0f} patients/s, "
+                  f"{metrics['resources_per_second']:,.0f} resources/s, "
+                  f"{metrics['bytes_per_second'] / 1e6:.1f} MB/s 儲存, 峰值 {metrics['peak_memory_kb'] / 1024:.1f} MB")
+
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results
+    }
+
+
+def compare_with_baseline(current: Dict[str, Any], baseline: Dict[str, Any],
+                          threshold: float = DEFAULT_REGRESSION_THRESHOLD) -> List[str]:
+    """
+    與基準線比較
+
+    Returns:
+        退步項目的說明；沒有退步時為空 list
+    """
+    regressions = []
+    for name, metrics in current["results"].items():
+        baseline_metrics = baseline.get("results", {}).get(name)
+        if not baseline_metrics:
+            continue
+        for metric, value in metrics.items():
+            base = baseline_metrics.get(metric)
+            if not base:
+                continue
+            if metric in THROUGHPUT_METRICS:
+                regressed = value < base * (1 - threshold)
+            elif metric == "peak_memory_kb":
+                regressed = value > base * (1 + threshold)
+            else:
+                continue
+            if regressed:
+                regressions.append(f"{name}.{metric}: {base:,.1f} → {value:,.1f} ({(value - base) / base:+.0%})")
+    return regressions
+
+
+def main(baseline_path: str = DEFAULT_BASELINE_PATH, save_baseline: bool = False,
+         threshold: float = DEFAULT_REGRESSION_THRESHOLD, cohort_sizes=COHORT_SIZES) -> int:
+    """
+    執行效能測試並與基準線比較
+
+    Returns:
+        程式結束碼：有退步時為 1
+    """
+    current = run_benchmarks(cohort_sizes)
+    baseline_file = Path(baseline_path)
+
+    result_dir = baseline_file.parent
+    result_dir.mkdir(parents=True, exist_ok=True)
+    result_file = result_dir / f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(result_file, 'w', encoding='utf-8') as f:
+        json.dump(current, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 測試結果已儲存到: {result_file}")
+
+    exit_code = 0
+    if baseline_file.exists() and not save_baseline:
+        with open(baseline_file, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(current, baseline, threshold)
+        if regressions:
+            print(f"\n⚠️  與基準線 ({baseline.get('created_at')}) 相比，以下項目退步超過 {threshold:.0%}:")
+            for regression in regressions:
+                print(f"   - {regression}")
+            exit_code = 1
+        else:
+            print(f"\n✅ 與基準線 ({baseline.get('created_at')}) 相比沒有超過 {threshold:.0%} 的退步")
+    elif not baseline_file.exists() and not save_baseline:
+        print(f"\nℹ️  尚無基準線，可使用 --save-baseline 建立: {baseline_file}")
+
+    if save_baseline:
+        with open(baseline_file, 'w', encoding='utf-8') as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        print(f"📌 已更新基準線: {baseline_file}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+ConceptMap 轉換模組
+將 TW Core IG 套件中的 ConceptMap 編譯為以 (來源 system, code) 為鍵的雜湊表，生成資源時的代碼轉換為 O(1)
+"""
+
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from terminology import TerminologyStore, get_terminology_store
+
+# 不代表可用對應的等價關係
+NON_MAPPING_EQUIVALENCES = ("unmatched", "disjoint")
+
+# (target system, target code, target display, equivalence)
+Target = Tuple[str, str, Optional[str], str]
+
+
+class CompiledConceptMap:
+    """編譯後的 ConceptMap"""
+
+    def __init__(self, concept_map: Dict[str, Any]):
+        """
+        編譯 ConceptMap
+
+        Args:
+            concept_map: ConceptMap 資源內容
+        """
+        self.url = concept_map["url"]
+        self.version = concept_map.get("version")
+        self.source = concept_map.get("sourceUri") or concept_map.get("sourceCanonical")
+        self.target = concept_map.get("targetUri") or concept_map.get("targetCanonical")
+        self._table: Dict[Tuple[str, str], Tuple[Target, ...]] = {}
+        self._unmapped: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+
+        for group in concept_map.get("group", []):
+            source_system, target_system = group.get("source"), group.get("target")
+            for element in group.get("element", []):
+                targets = tuple(
+                    (target_system, target["code"], target.get("display"), target.get("equivalence", "equivalent"))
+                    for target in element.get("target", [])
+                    if "code" in target and target.get("equivalence") not in NON_MAPPING_EQUIVALENCES
+                )
+                key = (source_system, element["code"])
+                self._table[key] = self._table.get(key, ()) + targets
+            if "unmapped" in group:
+                self._unmapped[source_system] = (target_system, group["unmapped"])
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def translate(self, system: str, code: str) -> Tuple[Target, ...]:
+        """
+        轉換代碼
+
+        Args:
+            system: 來源 CodeSystem
+            code: 來源代碼
+
+        Returns:
+            所有對應目標 (system, code, display, equivalence)；沒有對應時為空 tuple
+        """
+        targets = self._table.get((system, code))
+        if targets is not None:
+            return targets
+        if system in self._unmapped:
+            target_system, unmapped = self._unmapped[system]
+            if unmapped.get("mode") == "provided":
+                return ((target_system, code, None, "equivalent"),)
+            if unmapped.get("mode") == "fixed":
+                return ((target_system, unmapped["code"], unmapped.get("display"), "equivalent"),)
+        return ()
+
+    def translate_first(self, system: str, code: str) -> Optional[Target]:
+        """取得第一個對應目標，沒有對應時為 None"""
+        targets = self.translate(system, code)
+        return targets[0] if targets else None
+
+
+class ConceptMapRegistry:
+    """ConceptMap 登錄器：第一次使用某個 ConceptMap 時才編譯"""
+
+    def __init__(self, store: Optional[TerminologyStore] = None):
+        """
+        Args:
+            store: 術語庫，未指定時使用共用術語庫
+        """
+        self.store = store or get_terminology_store()
+        self._compiled: Dict[str, Optional[CompiledConceptMap]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> Optional[CompiledConceptMap]:
+        """取得編譯後的 ConceptMap，套件中不存在時為 None"""
+        url = url.split("|", 1)[0]
+        if url in self._compiled:
+            return self._compiled[url]
+        with self._lock:
+            if url not in self._compiled:
+                concept_map = self.store.load_resource("ConceptMap", url)
+                self._compiled[url] = CompiledConceptMap(concept_map) if concept_map else None
+        return self._compiled[url]
+
+    def translate(self, url: str, system: str, code: str) -> Tuple[Target, ...]:
+        """以指定 ConceptMap 轉換代碼，ConceptMap 不存在時為空 tuple"""
+        concept_map = self.get(url)
+        return concept_map.translate(system, code) if concept_map else ()
+
+    def list_urls(self) -> List[str]:
+        """列出套件中所有 ConceptMap 的 URL"""
+        return [entry["url"] for entry in self.store.list_resources("ConceptMap")]
+
+
+@lru_cache(maxsize=None)
+def get_concept_map_registry(package_dir: str = "package") -> ConceptMapRegistry:
+    """取得共用的 ConceptMap 登錄器（同一程序內只建立一次）"""
+    return ConceptMapRegistry(get_terminology_store(package_dir))
@@ -1,28 +1,51 @@
 #!/usr/bin/env python3
 """
 配置檔案載入器模組
-負責載入和管理診斷、觀察、藥物的配置資料
+負責載入和管理診斷、觀察、藥物的配置資料；
+解析後的目錄另存為 marshal 快照，來源檔未變更時直接載入快照，不需重新解析 JSON
 """
 
+import hashlib
 import json
+import marshal
 import os
+import sys
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+
+# 目錄快照的預設目錄（每個設定目錄一個快照檔）
+SNAPSHOT_DIR = "output/.catalog"
+# 快照格式版本；快照內容的結構改變時遞增
+SNAPSHOT_FORMAT = 1
+# 快照涵蓋的來源檔（population.json 為選用）
+CATALOG_FILES = ("conditions.json", "observations.json", "medications.json", "population.json")
+
+
+def _file_sha256(path: Path) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
 
 class ConfigLoader:
     """配置檔案載入器"""
     
-    def __init__(self, config_dir: str = "config"):
+    def __init__(self, config_dir: str = "config", snapshot_dir: Optional[str] = SNAPSHOT_DIR):
         """
         初始化配置載入器
         
         Args:
             config_dir: 配置檔案目錄路徑
+            snapshot_dir: 目錄快照的存放目錄；None 時每次都解析 JSON
         """
         self.config_dir = Path(config_dir)
         self.conditions = []
         self.observations = []
         self.medications = []
+        self.population = {}
+        self.snapshot_path = None
+        if snapshot_dir is not None:
+            digest = hashlib.sha1(str(self.config_dir.resolve()).encode("utf-8")).hexdigest()[:12]
+            self.snapshot_path = Path(snapshot_dir) / f"catalog-{digest}.marshal"
         
         # 載入所有配置檔案
         self.load_all_configs()
@@ -109,24 +132,122 @@ class ConfigLoader:
         
         return medications
     
+    def _source_stats(self) -> Dict[str, Optional[List[int]]]:
+        """來源檔的 [mtime_ns, size]；不存在的檔案為 None"""
+        stats = {}
+        for filename in CATALOG_FILES:
+            try:
+                stat = (self.config_dir / filename).stat()
+                stats[filename] = [stat.st_mtime_ns, stat.st_size]
+            except FileNotFoundError:
+                stats[filename] = None
+        return stats
+    
+    def _load_snapshot(self) -> Optional[Dict[str, Any]]:
+        """
+        載入目錄快照；來源檔的 mtime 與大小都相同時直接使用，
+        只有 mtime 改變時比對內容雜湊（例如重新 checkout），相同則更新快照中的 mtime
+        
+        Returns:
+            快照內容；不存在、格式不符或來源檔已變更時為 None
+        """
+        if self.snapshot_path is None:
+            return None
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                snapshot = marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(snapshot, dict) or snapshot.get("format") != SNAPSHOT_FORMAT \
+                or snapshot.get("python") != list(sys.version_info[:2]):
+            return None
+        
+        sources = snapshot["sources"]
+        touched = False
+        for filename, stat in self._source_stats().items():
+            recorded = sources.get(filename)
+            if stat is None or recorded is None:
+                if stat != recorded:
+                    return None
+                continue
+            if stat == recorded["stat"]:
+                continue
+            if stat[1] != recorded["stat"][1] or _file_sha256(self.config_dir / filename) != recorded["sha256"]:
+                return None
+            recorded["stat"] = stat
+            touched = True
+        if touched:
+            self._write_snapshot(snapshot)
+        return snapshot
+    
+    def _write_snapshot(self, snapshot: Dict[str, Any]):
+        """寫入目錄快照（先寫暫存檔再改名）；無法寫入時略過"""
+        try:
+            self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.snapshot_path.with_name(f"{self.snapshot_path.name}.{os.getpid()}.tmp")
+            with open(temp_path, 'wb') as f:
+                f.write(marshal.dumps(snapshot))
+            os.replace(temp_path, self.snapshot_path)
+        except OSError:
+            pass
+    
+    def _source_fingerprints(self) -> Dict[str, Optional[Dict[str, Any]]]:
+        """來源檔的 mtime、大小與內容雜湊；不存在的檔案為 None"""
+        return {
+            filename: None if stat is None else {"stat": stat, "sha256": _file_sha256(self.config_dir / filename)}
+            for filename, stat in self._source_stats().items()
+        }
+    
+    def _build_snapshot(self, sources: Dict[str, Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+        return {
+            "format": SNAPSHOT_FORMAT,
+            "python": list(sys.version_info[:2]),
+            "sources": sources,
+            "conditions": self.conditions,
+            "observations": self.observations,
+            "medications": self.medications,
+            "population": self.population
+        }
+    
     def load_all_configs(self):
-        """載入所有配置檔案"""
+        """載入所有配置檔案（來源檔未變更時使用目錄快照）"""
         try:
             print("📋 載入配置檔案...")
             
-            # 載入疾病配置
-            self.conditions = self.load_conditions_config()
-            print(f"   ✅ 載入 {len(self.conditions)} 種疾病診斷")
+            snapshot = self._load_snapshot()
+            if snapshot is not None:
+                self.conditions = snapshot["conditions"]
+                self.observations = snapshot["observations"]
+                self.medications = snapshot["medications"]
+                self.population = snapshot["population"]
+            else:
+                # 解析前記錄來源檔狀態，解析期間被修改時下次載入會重新解析
+                sources = self._source_fingerprints() if self.snapshot_path is not None else None
+                
+                # 載入疾病配置
+                self.conditions = self.load_conditions_config()
+                
+                # 載入觀察項目配置
+                self.observations = self.load_observations_config()
+                
+                # 載入藥物配置
+                self.medications = self.load_medications_config()
+                
+                # 載入人口分布配置（選用）
+                self.population = {}
+                if (self.config_dir / "population.json").exists():
+                    self.population = self.load_json_config("population.json")
+                
+                if self.snapshot_path is not None:
+                    self._write_snapshot(self._build_snapshot(sources))
             
-            # 載入觀察項目配置
-            self.observations = self.load_observations_config()
+            print(f"   ✅ 載入 {len(self.conditions)} 種疾病診斷")
             print(f"   ✅ 載入 {len(self.observations)} 種觀察項目")
-            
-            # 載入藥物配置
-            self.medications = self.load_medications_config()
             print(f"   ✅ 載入 {len(self.medications)} 種藥物")
+            if self.population:
+                print(f"   ✅ 載入人口分布模型")
             
-            print("📋 配置檔案載入完成")
+            print(f"📋 配置檔案載入完成{'（快照）' if snapshot is not None else ''}")
             
         except Exception as e:
             print(f"❌ 載入配置檔案失敗: {e}")
@@ -144,6 +265,10 @@ class ConfigLoader:
         """獲取藥物列表"""
         return self.medications
     
+    def get_population(self) -> Dict[str, Any]:
+        """獲取人口分布配置（未提供時為空字典）"""
+        return self.population
+    
     def get_conditions_by_category(self, category_key: str) -> List[Dict[str, Any]]:
         """
         根據類別獲取疾病列表
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+增量生成模組
+讀取既有世代的精簡病人索引（序號、病人 ID、出生日期、性別、進行中的疾病），不需載入完整 JSON；
+只為指定時間窗內有就診的病人生成新的 Encounter、Observation 與 MedicationRequest
+
+使用方法（經由 batch_cli）:
+    python run.py --batch --delta-index output/cohort.ndjson.index.tsv --window-start 2026-10-18 --window-days 1
+    python run.py --batch --build-index output/cohort.ndjson     # 由既有的 json / ndjson 輸出建立索引
+"""
+
+import gzip
+import json
+import math
+import random
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+# 病人索引檔名後綴（與輸出檔同目錄）
+INDEX_SUFFIX = ".index.tsv"
+INDEX_COLUMNS = ("patient_index", "id", "birth_date", "gender", "conditions")
+
+# 就診頻率（每人每年）：基本次數依年齡調整，每個進行中的疾病另外增加
+BASE_VISITS_PER_YEAR = 4.0
+CONDITION_VISITS_PER_YEAR = 2.0
+# 每次就診的觀察數與開立處方的機率
+OBSERVATIONS_PER_VISIT = 3
+MEDICATION_PROBABILITY = 0.5
+
+
+class IndexEntry(NamedTuple):
+    """病人索引中的一列"""
+    patient_index: int
+    id: str
+    birth_date: str
+    gender: str
+    conditions: Tuple[str, ...]
+
+
+def _open_text(path: Path, mode: str = 'r'):
+    if path.suffix == ".gz":
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def index_row(patient_data: Dict[str, Any], patient_index: int) -> str:
+    """將一位病人的資料轉為索引列（含換行）"""
+    patient = patient_data["patient"]
+    conditions = ",".join(
+        condition["code"]["coding"][0]["code"] for condition in patient_data.get("conditions", [])
+        if condition.get("clinicalStatus", {}).get("coding", [{}])[0].get("code") == "active"
+    )
+    return f"{patient_index}\t{patient['id']}\t{patient.get('birthDate', '')}\t{patient.get('gender', '')}\t{conditions}\n"
+
+
+def index_header() -> str:
+    return "\t".join(INDEX_COLUMNS) + "\n"
+
+
+def index_path_for(output_path: Path) -> Path:
+    """輸出檔對應的病人索引路徑"""
+    return output_path.with_name(output_path.name + INDEX_SUFFIX)
+
+
+def read_patient_index(path: Path) -> Iterator[IndexEntry]:
+    """逐列讀取病人索引"""
+    with _open_text(Path(path)) as f:
+        header = f.readline().rstrip("\n").split("\t")
+        if tuple(header) != INDEX_COLUMNS:
+            raise ValueError(f"不是病人索引檔: {path}")
+        for line in f:
+            patient_index, patient_id, birth_date, gender, conditions = line.rstrip("\n").split("\t")
+            yield IndexEntry(int(patient_index), patient_id, birth_date, gender,
+                             tuple(conditions.split(",")) if conditions else ())
+
+
+def build_index(source_path: Path, index_path: Optional[Path] = None) -> Tuple[Path, int]:
+    """
+    由既有的輸出檔（json 病人資料陣列或 ndjson，可為 .gz）建立病人索引
+
+    Returns:
+        (索引路徑, 病人數)
+    """
+    source_path = Path(source_path)
+    index_path = Path(index_path) if index_path else index_path_for(source_path)
+    with _open_text(source_path) as f:
+        first = f.read(1)
+        f.seek(0)
+        records = json.load(f) if first == "[" else (json.loads(line) for line in f if line.strip())
+        count = 0
+        with _open_text(index_path, 'w') as index_file:
+            index_file.write(index_header())
+            for count, patient_data in enumerate(records, 1):
+                index_file.write(index_row(patient_data, count - 1))
+    return index_path, count
+
+
+def poisson(mean: float) -> int:
+    """Poisson 抽樣（Knuth 方法，適用於小平均值）"""
+    threshold = math.exp(-mean)
+    count, product = 0, random.random()
+    while product > threshold:
+        count += 1
+        product *= random.random()
+    return count
+
+
+def visits_per_year(entry: IndexEntry, today: date) -> float:
+    """依年齡與進行中疾病數估計每年就診次數"""
+    age = today.year - int(entry.birth_date[:4]) if entry.birth_date else 40
+    return BASE_VISITS_PER_YEAR * (0.5 + age / 40) + CONDITION_VISITS_PER_YEAR * len(entry.conditions)
+
+
+def load_followups(generator, scenarios_path: str = "config/scenarios.json") -> Dict[str, Tuple[List, List]]:
+    """
+    由情境設定建立 疾病代碼 → (追蹤觀察項目, 藥物) 對照
+
+    Returns:
+        {疾病代碼: ([觀察項目], [藥物])}；目錄中找不到的代碼略過
+    """
+    try:
+        with open(scenarios_path, 'r', encoding='utf-8') as f:
+            scenarios = json.load(f).get("scenarios", [])
+    except FileNotFoundError:
+        return {}
+    observations_by_code = {info["code"]: info for info in generator.observations}
+    medications_by_code = {}
+    for info in generator.medications:
+        medications_by_code.setdefault(info["code"], info)
+    followups: Dict[str, Tuple[List, List]] = {}
+    for scenario in scenarios:
+        observation_infos = [observations_by_code[code] for code in scenario.get("observations", [])
+                             if code in observations_by_code]
+        medication_infos = [medications_by_code[code] for code in scenario.get("medications", [])
+                            if code in medications_by_code]
+        for code in scenario.get("conditions", []):
+            entry_observations, entry_medications = followups.setdefault(code, ([], []))
+            entry_observations.extend(info for info in observation_infos if info not in entry_observations)
+            entry_medications.extend(info for info in medication_infos if info not in entry_medications)
+    return followups
+
+
+def plan_visits(entry: IndexEntry, window_start: datetime, window_days: float) -> List[datetime]:
+    """抽出病人在時間窗內的就診時間（多數病人為空列表）"""
+    mean = visits_per_year(entry, window_start.date()) * window_days / 365
+    count = poisson(mean)
+    return [window_start + timedelta(seconds=random.uniform(0, window_days * 86400)) for _ in range(count)]
+
+
+def generate_delta(generator, entries: Iterator[IndexEntry], window_start: datetime, window_days: float,
+                   followups: Optional[Dict[str, Tuple[List, List]]] = None,
+                   observations_per_visit: int = OBSERVATIONS_PER_VISIT,
+                   medication_probability: float = MEDICATION_PROBABILITY) -> Iterator[Tuple[IndexEntry, Dict[str, Any]]]:
+    """
+    逐一產生時間窗內有就診的病人的增量資料
+
+    Args:
+        generator: TWFHIRGeneratorFixed
+        entries: 病人索引
+        window_start: 時間窗起點
+        window_days: 時間窗長度（天）
+        followups: load_followups() 的結果；病人的疾病有對應時只選該疾病的追蹤項目
+        observations_per_visit: 每次就診的觀察數
+        medication_probability: 每次就診開立處方的機率
+
+    Yields:
+        (索引列, generate_followup_data() 的結果)
+    """
+    followups = followups or {}
+    window_key = window_start.strftime("%Y%m%dT%H%M%S")
+    for entry in entries:
+        visit_dates = plan_visits(entry, window_start, window_days)
+        if not visit_dates:
+            continue
+        # 多個疾病共用的追蹤項目只列一次
+        observation_infos, medication_infos = {}, {}
+        for code in entry.conditions:
+            condition_observations, condition_medications = followups.get(code, ((), ()))
+            observation_infos.update((info["code"], info) for info in condition_observations)
+            medication_infos.update((info["code"], info) for info in condition_medications)
+        yield entry, generator.generate_followup_data(
+            entry.id, f"{entry.patient_index}:delta:{window_key}", visit_dates,
+            list(observation_infos.values()) or generator.observations,
+            list(medication_infos.values()) or generator.medications,
+            observations_per_visit, medication_probability)
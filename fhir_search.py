@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+本地 FHIR 搜尋模組
+將 output/ 目錄中已生成的資料載入記憶體，依 TW Core IG 的 SearchParameter 運算式建立索引，
+提供唯讀的 FHIR 搜尋（_count 分頁、_include），不需要外部 FHIR 伺服器
+"""
+
+import bisect
+import json
+import re
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlencode
+
+from fhirpath import FHIRPathError, compile_expression
+from terminology import TerminologyStore, get_terminology_store
+
+# 已生成資料的目錄（批量生成與自定義生成）
+DEFAULT_OUTPUT_DIRS = ("output/complete_patients_fixed", "output/custom_patients")
+
+# 病人資料中的資源清單欄位
+PATIENT_DATA_KEYS = ("encounters", "conditions", "observations", "medications", "medication_requests")
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 1000
+
+DATE_PREFIXES = ("eq", "ne", "gt", "lt", "ge", "le", "sa", "eb", "ap")
+
+# 資源鍵：(resourceType, id)
+ResourceKey = Tuple[str, str]
+
+_RESOLVE_PATTERN = re.compile(r"\.where\(resolve\(\) is (\w+)\)")
+
+
+class SearchError(ValueError):
+    """不支援的搜尋參數或格式錯誤的搜尋值"""
+
+
+def _date_range(value: str) -> Tuple[datetime, datetime]:
+    """將 FHIR date / dateTime 依精確度轉換為 [起, 迄) 區間（忽略時區）"""
+    value = re.sub(r"(Z|[+-]\d{2}:\d{2})$", "", value)
+    if len(value) == 4:
+        start = datetime(int(value), 1, 1)
+        return start, start.replace(year=start.year + 1)
+    if len(value) == 7:
+        start = datetime.strptime(value, "%Y-%m")
+        return start, (start + timedelta(days=32)).replace(day=1)
+    if len(value) == 10:
+        start = datetime.strptime(value, "%Y-%m-%d")
+        return start, start + timedelta(days=1)
+    start = datetime.fromisoformat(value.split(".")[0])
+    return start, start + timedelta(seconds=1)
+
+
+def _date_matches(prefix: str, resource_range: Tuple[datetime, datetime],
+                  search_range: Tuple[datetime, datetime]) -> bool:
+    (r_start, r_end), (p_start, p_end) = resource_range, search_range
+    if prefix == "eq":
+        return r_start >= p_start and r_end <= p_end
+    if prefix == "ne":
+        return not (r_start >= p_start and r_end <= p_end)
+    if prefix == "gt":
+        return r_end > p_end
+    if prefix == "lt":
+        return r_start < p_start
+    if prefix == "ge":
+        return r_end > p_start
+    if prefix == "le":
+        return r_start < p_end
+    if prefix == "sa":
+        return r_start >= p_end
+    if prefix == "eb":
+        return r_end <= p_start
+    # ap：區間重疊即視為相近
+    return r_start < p_end and r_end > p_start
+
+
+def _normalize_string(value: str) -> str:
+    return value.strip().lower()
+
+
+class _SearchIndex:
+    """單一 SearchParameter 的索引"""
+
+    def __init__(self, code: str, param_type: str, expression: str, resource_type: str):
+        self.code = code
+        self.type = param_type
+        self.resource_type = resource_type
+        # resolve() 不在 FHIRPath 子集中，改以引用字串前綴判斷目標類型
+        expression = _RESOLVE_PATTERN.sub(r".where(reference.startsWith('\1/'))", expression)
+        expression = re.sub(r"(^|[|(\s])Resource\.", rf"\1{resource_type}.", expression)
+        self.evaluator = compile_expression(expression)
+
+        self.tokens: Dict[str, List[Tuple[Optional[str], ResourceKey]]] = {}
+        self.strings: List[Tuple[str, ResourceKey]] = []
+        self.dates: List[Tuple[datetime, datetime, ResourceKey]] = []
+        self.references: Dict[str, Set[ResourceKey]] = {}
+        self._strings_sorted = True
+
+    def add(self, resource: Dict[str, Any], key: ResourceKey):
+        values = self.evaluator([resource], {"resource": resource})
+        for value in values:
+            if self.type == "token":
+                for system, code in self._token_values(value):
+                    self.tokens.setdefault(code, []).append((system, key))
+            elif self.type == "string":
+                for text in self._string_values(value):
+                    self.strings.append((_normalize_string(text), key))
+                    self._strings_sorted = False
+            elif self.type == "date":
+                date_range = self._date_value(value)
+                if date_range:
+                    self.dates.append(date_range + (key,))
+            elif self.type == "reference":
+                if isinstance(value, dict) and isinstance(value.get("reference"), str):
+                    reference = value["reference"]
+                    self.references.setdefault(reference, set()).add(key)
+                    self.references.setdefault(reference.rsplit("/", 1)[-1], set()).add(key)
+
+    @staticmethod
+    def _token_values(value: Any) -> Iterable[Tuple[Optional[str], str]]:
+        if isinstance(value, bool):
+            return [(None, "true" if value else "false")]
+        if isinstance(value, (str, int)):
+            return [(None, str(value))]
+        if isinstance(value, dict):
+            if "coding" in value:
+                return [(c.get("system"), c["code"]) for c in value["coding"] if "code" in c]
+            if "code" in value:
+                return [(value.get("system"), value["code"])]
+            if "value" in value:
+                return [(value.get("system"), str(value["value"]))]
+        return []
+
+    @staticmethod
+    def _string_values(value: Any) -> Iterable[str]:
+        if isinstance(value, str):
+            return [value]
+        if isinstance(value, dict):
+            texts = []
+            for item in value.values():
+                if isinstance(item, str):
+                    texts.append(item)
+                elif isinstance(item, list):
+                    texts.extend(i for i in item if isinstance(i, str))
+            return texts
+        return []
+
+    @staticmethod
+    def _date_value(value: Any) -> Optional[Tuple[datetime, datetime]]:
+        try:
+            if isinstance(value, str):
+                return _date_range(value)
+            if isinstance(value, dict) and ("start" in value or "end" in value):
+                start = _date_range(value["start"])[0] if "start" in value else datetime.min
+                end = _date_range(value["end"])[1] if "end" in value else datetime.max
+                return start, end
+        except ValueError:
+            return None
+        return None
+
+    def match(self, raw_value: str, modifier: Optional[str]) -> Set[ResourceKey]:
+        """以逗號分隔的多個值為 OR 條件"""
+        result: Set[ResourceKey] = set()
+        for value in raw_value.split(","):
+            result |= self._match_one(value, modifier)
+        return result
+
+    def _match_one(self, value: str, modifier: Optional[str]) -> Set[ResourceKey]:
+        if self.type == "token":
+            system, _, code = value.rpartition("|") if "|" in value else (None, None, value)
+            if code == "":
+                return {key for entries in self.tokens.values() for s, key in entries if s == system}
+            entries = self.tokens.get(code, [])
+            if system is None:
+                return {key for _, key in entries}
+            system = system or None
+            return {key for s, key in entries if s == system}
+
+        if self.type == "string":
+            if not self._strings_sorted:
+                self.strings.sort()
+                self._strings_sorted = True
+            needle = _normalize_string(value)
+            if modifier == "contains":
+                return {key for text, key in self.strings if needle in text}
+            if modifier == "exact":
+                return {key for text, key in self.strings if text == needle}
+            start = bisect.bisect_left(self.strings, (needle,))
+            result = set()
+            for text, key in self.strings[start:]:
+                if not text.startswith(needle):
+                    break
+                result.add(key)
+            return result
+
+        if self.type == "date":
+            prefix = value[:2] if value[:2] in DATE_PREFIXES else "eq"
+            if value[:2] in DATE_PREFIXES:
+                value = value[2:]
+            try:
+                search_range = _date_range(value)
+            except ValueError:
+                raise SearchError(f"無效的日期: {value}")
+            return {key for start, end, key in self.dates if _date_matches(prefix, (start, end), search_range)}
+
+        if self.type == "reference":
+            return set(self.references.get(value, ()))
+
+        raise SearchError(f"不支援的搜尋參數類型: {self.type}")
+
+    def referenced_keys(self, resource: Dict[str, Any]) -> List[ResourceKey]:
+        """取得資源在此參數上的引用目標（_include 使用）"""
+        keys = []
+        for value in self.evaluator([resource], {"resource": resource}):
+            if isinstance(value, dict) and isinstance(value.get("reference"), str) \
+                    and "/" in value["reference"]:
+                resource_type, resource_id = value["reference"].rsplit("/", 2)[-2:]
+                keys.append((resource_type, resource_id))
+        return keys
+
+
+class LocalFHIRStore:
+    """已生成資料的記憶體內 FHIR 資料庫"""
+
+    def __init__(self, output_dirs: Iterable[str] = DEFAULT_OUTPUT_DIRS,
+                 store: Optional[TerminologyStore] = None):
+        """
+        Args:
+            output_dirs: 要載入的輸出目錄
+            store: 提供 SearchParameter 的術語庫，未指定時使用共用術語庫
+        """
+        self.output_dirs = [Path(d) for d in output_dirs]
+        self.store = store or get_terminology_store()
+        self._lock = threading.RLock()
+        self._signature = None
+        self.resources: Dict[ResourceKey, Dict[str, Any]] = {}
+        self._by_type: Dict[str, List[ResourceKey]] = {}
+        self._indexes: Dict[str, Dict[str, _SearchIndex]] = {}
+        self._search_parameters = self._load_search_parameters()
+
+    def _load_search_parameters(self) -> Dict[str, Dict[str, Tuple[str, str]]]:
+        """{resourceType: {code: (type, expression)}}"""
+        parameters: Dict[str, Dict[str, Tuple[str, str]]] = {}
+        for entry in self.store.list_resources("SearchParameter"):
+            definition = self.store.load_resource("SearchParameter", entry["url"])
+            if not definition or not definition.get("expression"):
+                continue
+            for base in definition.get("base", []):
+                parameters.setdefault(base, {})[definition["code"]] = (definition["type"], definition["expression"])
+        return parameters
+
+    def _files_signature(self) -> Tuple:
+        files = []
+        for directory in self.output_dirs:
+            if directory.exists():
+                for path in sorted(directory.glob("*.json")):
+                    stat = path.stat()
+                    files.append((str(path), stat.st_mtime_ns, stat.st_size))
+        return tuple(files)
+
+    def refresh(self):
+        """輸出目錄有變動時重新載入並重建索引"""
+        signature = self._files_signature()
+        if signature == self._signature:
+            return
+        with self._lock:
+            if signature == self._signature:
+                return
+            self.resources = {}
+            self._by_type = {}
+            self._indexes = {}
+            for path, _, _ in signature:
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except (OSError, json.JSONDecodeError):
+                    continue
+                for patient_data in data if isinstance(data, list) else [data]:
+                    if isinstance(patient_data, dict):
+                        self.add_patient_data(patient_data)
+            self._signature = signature
+
+    def add_patient_data(self, patient_data: Dict[str, Any]):
+        """加入一個病人的完整資料（generate_complete_patient_data 的輸出格式）"""
+        if "patient" in patient_data:
+            self.add_resource(patient_data["patient"])
+        for key in PATIENT_DATA_KEYS:
+            for resource in patient_data.get(key, []):
+                self.add_resource(resource)
+
+    def add_resource(self, resource: Dict[str, Any]):
+        """加入單一資源並更新已建立的索引"""
+        resource_type, resource_id = resource.get("resourceType"), resource.get("id")
+        if not resource_type or not resource_id:
+            return
+        key = (resource_type, resource_id)
+        with self._lock:
+            if key not in self.resources:
+                self._by_type.setdefault(resource_type, []).append(key)
+            self.resources[key] = resource
+            for index in self._indexes.get(resource_type, {}).values():
+                index.add(resource, key)
+
+    def _get_index(self, resource_type: str, code: str) -> _SearchIndex:
+        """取得搜尋參數索引，第一次使用時才建立"""
+        indexes = self._indexes.setdefault(resource_type, {})
+        index = indexes.get(code)
+        if index is not None:
+            return index
+        with self._lock:
+            index = indexes.get(code)
+            if index is None:
+                definition = self._search_parameters.get(resource_type, {}).get(code) \
+                    or self._search_parameters.get("Resource", {}).get(code)
+                if definition is None and code == "_id":
+                    definition = ("token", f"{resource_type}.id")
+                if definition is None:
+                    raise SearchError(f"{resource_type} 不支援搜尋參數: {code}")
+                try:
+                    index = _SearchIndex(code, definition[0], definition[1], resource_type)
+                except FHIRPathError as e:
+                    raise SearchError(f"搜尋參數 {code} 的運算式不受支援: {e}")
+                for key in self._by_type.get(resource_type, []):
+                    index.add(self.resources[key], key)
+                indexes[code] = index
+        return index
+
+    def supported_parameters(self, resource_type: str) -> Dict[str, str]:
+        """{code: type}（含適用所有資源的 Resource 參數）"""
+        parameters = dict(self._search_parameters.get("Resource", {}))
+        parameters.update(self._search_parameters.get(resource_type, {}))
+        return {code: definition[0] for code, definition in parameters.items()}
+
+    def read(self, resource_type: str, resource_id: str) -> Optional[Dict[str, Any]]:
+        """依 ID 讀取資源"""
+        self.refresh()
+        return self.resources.get((resource_type, resource_id))
+
+    def search(self, resource_type: str, params: List[Tuple[str, str]], base_url: str = "") -> Dict[str, Any]:
+        """
+        執行搜尋
+
+        Args:
+            resource_type: 資源類型
+            params: 查詢參數 [(名稱, 值)]，同名參數重複出現時為 AND 條件
+            base_url: 產生 fullUrl 與分頁連結用的基底 URL
+
+        Returns:
+            searchset Bundle
+        """
+        self.refresh()
+        count, offset = DEFAULT_PAGE_SIZE, 0
+        includes = []
+        matched: Optional[Set[ResourceKey]] = None
+
+        for name, value in params:
+            if name == "_count":
+                count = max(0, min(int(value), MAX_PAGE_SIZE))
+                continue
+            if name == "_offset":
+                offset = max(0, int(value))
+                continue
+            if name == "_include":
+                includes.append(value)
+                continue
+            if name.startswith("_") and name != "_id" and name != "_lastUpdated":
+                raise SearchError(f"不支援的搜尋控制參數: {name}")
+            code, _, modifier = name.partition(":")
+            keys = self._get_index(resource_type, code).match(value, modifier or None)
+            matched = keys if matched is None else matched & keys
+
+        if matched is None:
+            ordered = list(self._by_type.get(resource_type, []))
+        else:
+            ordered = [key for key in self._by_type.get(resource_type, []) if key in matched]
+
+        page = ordered[offset:offset + count]
+        entries = [self._entry(self.resources[key], "match", base_url) for key in page]
+
+        included: Set[ResourceKey] = set(page)
+        for include in includes:
+            parts = include.split(":")
+            if len(parts) < 2 or parts[0] != resource_type:
+                raise SearchError(f"無效的 _include: {include}")
+            target_type = parts[2] if len(parts) > 2 else None
+            index = self._get_index(resource_type, parts[1])
+            for key in page:
+                for target in index.referenced_keys(self.resources[key]):
+                    if target in included or target not in self.resources:
+                        continue
+                    if target_type and target[0] != target_type:
+                        continue
+                    included.add(target)
+                    entries.append(self._entry(self.resources[target], "include", base_url))
+
+        # 參數值常含 |、: 與中文，需編碼後才是合法的 URL
+        query = urlencode([(name, value) for name, value in params if name not in ("_offset", "_count")])
+        links = [{"relation": "self", "url": self._page_url(base_url, resource_type, query, count, offset)}]
+        if offset + count < len(ordered):
+            links.append({"relation": "next",
+                          "url": self._page_url(base_url, resource_type, query, count, offset + count)})
+        if offset > 0:
+            links.append({"relation": "previous",
+                          "url": self._page_url(base_url, resource_type, query, count, max(0, offset - count))})
+
+        return {
+            "resourceType": "Bundle",
+            "type": "searchset",
+            "total": len(ordered),
+            "link": links,
+            "entry": entries
+        }
+
+    @staticmethod
+    def _page_url(base_url: str, resource_type: str, query: str, count: int, offset: int) -> str:
+        paging = f"_count={count}&_offset={offset}"
+        return f"{base_url}/{resource_type}?{query + '&' if query else ''}{paging}"
+
+    @staticmethod
+    def _entry(resource: Dict[str, Any], mode: str, base_url: str) -> Dict[str, Any]:
+        return {
+            "fullUrl": f"{base_url}/{resource['resourceType']}/{resource['id']}",
+            "resource": resource,
+            "search": {"mode": mode}
+        }
+
+
+@lru_cache(maxsize=None)
+def get_local_fhir_store(package_dir: str = "package") -> LocalFHIRStore:
+    """取得共用的本地 FHIR 資料庫（同一程序內只建立一次）"""
+    return LocalFHIRStore(store=get_terminology_store(package_dir))
+
+
+def operation_outcome(message: str, code: str = "invalid") -> Dict[str, Any]:
+    """建立錯誤回應用的 OperationOutcome"""
+    return {
+        "resourceType": "OperationOutcome",
+        "issue": [{"severity": "error", "code": code, "diagnostics": message}]
+    }
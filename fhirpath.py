@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+"""
+FHIRPath 子集編譯器
+將 StructureDefinition constraint.expression 編譯為 Python 閉包（依運算式文字快取），
+驗證時直接呼叫閉包，不需要每個資源重新解析運算式
+
+支援：路徑導覽（含選擇型別 value[x]）、索引、字串 / 數字 / 布林字面值、$this、%resource、
+比較與相等、and / or / xor / implies、|、in / contains、+ - &、is / as，
+以及 exists()、empty()、not()、where()、all()、select()、count()、matches()、first()、last()、
+hasValue()、children()、ofType()、is()、as()、toString()、length()、startsWith()、contains()、
+distinct()、isDistinct()、allTrue()、anyTrue()、intersect()、iif()
+"""
+
+import re
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+# 編譯後的運算式：(輸入集合, 環境) → 結果集合
+Evaluator = Callable[[List[Any], Dict[str, Any]], List[Any]]
+
+
+class FHIRPathError(ValueError):
+    """不支援或語法錯誤的 FHIRPath 運算式"""
+
+
+_TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+      (?P<string>'(?:[^'\\]|\\.)*')
+    | (?P<number>\d+(?:\.\d+)?)
+    | (?P<quoted>`[^`]*`)
+    | (?P<variable>[$%][A-Za-z_][A-Za-z0-9_]*)
+    | (?P<identifier>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<operator>!=|>=|<=|!~|[=~<>|&+\-*/.,()\[\]{}])
+    )""", re.VERBOSE)
+
+_STRING_ESCAPES = {"t": "\t", "n": "\n", "r": "\r", "f": "\f"}
+
+# 中序運算子的結合強度（數字越大越優先）
+_BINARY_PRECEDENCE = {
+    "implies": 1,
+    "or": 2, "xor": 2,
+    "and": 3,
+    "in": 4, "contains": 4,
+    "=": 5, "!=": 5, "~": 5, "!~": 5,
+    ">": 6, "<": 6, ">=": 6, "<=": 6,
+    "|": 7,
+    "is": 8, "as": 8,
+    "+": 9, "-": 9, "&": 9,
+    "*": 10, "/": 10, "div": 10, "mod": 10
+}
+
+_DATE_TIME = re.compile(r"\d{4}(-\d{2}(-\d{2}(T[\d:.]+(Z|[+-]\d{2}:\d{2})?)?)?)?")
+_DATE = re.compile(r"\d{4}(-\d{2}(-\d{2})?)?")
+
+# is / as / ofType 的型別判斷：JSON 本身不帶型別，依值的形狀推斷
+_TYPE_TESTS = {
+    "boolean": lambda v: isinstance(v, bool),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "decimal": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "string": lambda v: isinstance(v, str),
+    "date": lambda v: isinstance(v, str) and _DATE.fullmatch(v) is not None,
+    "dateTime": lambda v: isinstance(v, str) and _DATE_TIME.fullmatch(v) is not None,
+    "Quantity": lambda v: isinstance(v, dict) and "value" in v and
+    any(k in v for k in ("unit", "code", "system", "comparator")),
+    "CodeableConcept": lambda v: isinstance(v, dict) and ("coding" in v or set(v) == {"text"}),
+    "Coding": lambda v: isinstance(v, dict) and "code" in v and "coding" not in v,
+    "Reference": lambda v: isinstance(v, dict) and any(k in v for k in ("reference", "identifier")) and
+    "resourceType" not in v,
+    "Period": lambda v: isinstance(v, dict) and set(v) <= {"id", "extension", "start", "end"} and bool(v),
+    "Range": lambda v: isinstance(v, dict) and set(v) <= {"id", "extension", "low", "high"} and bool(v)
+}
+
+
+def _tokenize(expression: str) -> List[tuple]:
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _TOKEN_PATTERN.match(expression, position)
+        if not match or match.end() == position:
+            raise FHIRPathError(f"無法解析的字元: {expression[position:position + 10]!r}")
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == "string":
+            text = re.sub(r"\\(.)", lambda m: _STRING_ESCAPES.get(m.group(1), m.group(1)), text[1:-1])
+        elif kind == "quoted":
+            kind, text = "identifier", text[1:-1]
+        tokens.append((kind, text))
+        position = match.end()
+    tokens.append(("end", None))
+    return tokens
+
+
+def _to_boolean(collection: List[Any]) -> Optional[bool]:
+    """集合轉布林：空集合為 None（未知），單一布林值取其值，其他單一值為 True"""
+    if not collection:
+        return None
+    if len(collection) > 1:
+        raise FHIRPathError("布林運算需要單一值")
+    value = collection[0]
+    return value if isinstance(value, bool) else True
+
+
+def _singleton(collection: List[Any]) -> Any:
+    if len(collection) > 1:
+        raise FHIRPathError("運算需要單一值")
+    return collection[0]
+
+
+def _navigate(focus: List[Any], name: str) -> List[Any]:
+    """取得子元素；找不到時嘗試選擇型別（例如 value → valueQuantity）"""
+    result = []
+    for item in focus:
+        if not isinstance(item, dict):
+            continue
+        if name in item:
+            value = item[name]
+        elif item.get("resourceType") == name:
+            value = item
+        else:
+            value = None
+            for key in item:
+                if key.startswith(name) and len(key) > len(name) and key[len(name)].isupper():
+                    value = item[key]
+                    break
+        if value is None:
+            continue
+        if isinstance(value, list):
+            result.extend(value)
+        else:
+            result.append(value)
+    return result
+
+
+def _union(left: List[Any], right: List[Any]) -> List[Any]:
+    result = []
+    for item in left + right:
+        if item not in result:
+            result.append(item)
+    return result
+
+
+def _has_type(value: Any, type_name: str) -> bool:
+    type_name = type_name.split(".")[-1]
+    test = _TYPE_TESTS.get(type_name) or _TYPE_TESTS.get(type_name[:1].lower() + type_name[1:])
+    if test is not None:
+        return test(value)
+    return isinstance(value, dict) and value.get("resourceType") == type_name
+
+
+class _Parser:
+    """遞迴下降 / Pratt 解析器，解析的同時直接產生閉包"""
+
+    def __init__(self, expression: str):
+        self.tokens = _tokenize(expression)
+        self.index = 0
+
+    def peek(self) -> tuple:
+        return self.tokens[self.index]
+
+    def advance(self) -> tuple:
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def expect(self, text: str):
+        kind, value = self.advance()
+        if value != text:
+            raise FHIRPathError(f"預期 {text!r}，實際為 {value!r}")
+
+    def parse(self) -> Evaluator:
+        evaluator = self.parse_expression(0)
+        if self.peek()[0] != "end":
+            raise FHIRPathError(f"多餘的符號: {self.peek()[1]!r}")
+        return evaluator
+
+    def parse_expression(self, min_precedence: int) -> Evaluator:
+        left = self.parse_unary()
+        while True:
+            kind, text = self.peek()
+            precedence = _BINARY_PRECEDENCE.get(text) if kind in ("operator", "identifier") else None
+            if precedence is None or precedence < min_precedence:
+                return left
+            self.advance()
+            if text in ("is", "as"):
+                left = self._type_operator(left, text, self.parse_type_name())
+            else:
+                right = self.parse_expression(precedence + 1)
+                left = self._binary(text, left, right)
+
+    def parse_type_name(self) -> str:
+        kind, name = self.advance()
+        if kind != "identifier":
+            raise FHIRPathError("預期型別名稱")
+        while self.peek()[1] == "." and self.tokens[self.index + 1][0] == "identifier":
+            self.advance()
+            name = name + "." + self.advance()[1]
+        return name
+
+    def parse_unary(self) -> Evaluator:
+        kind, text = self.peek()
+        if kind == "operator" and text in ("+", "-"):
+            self.advance()
+            operand = self.parse_unary()
+            if text == "+":
+                return operand
+            return lambda focus, env: [-value for value in operand(focus, env)]
+        return self.parse_postfix(self.parse_term())
+
+    def parse_term(self) -> Evaluator:
+        kind, text = self.advance()
+        if kind == "string":
+            return lambda focus, env, value=text: [value]
+        if kind == "number":
+            value = float(text) if "." in text else int(text)
+            return lambda focus, env: [value]
+        if kind == "variable":
+            return self._variable(text)
+        if kind == "operator" and text == "(":
+            inner = self.parse_expression(0)
+            self.expect(")")
+            return inner
+        if kind == "operator" and text == "{":
+            self.expect("}")
+            return lambda focus, env: []
+        if kind == "identifier":
+            if text in ("true", "false"):
+                value = text == "true"
+                return lambda focus, env: [value]
+            if self.peek()[1] == "(":
+                return self._function(text)
+            return lambda focus, env, name=text: _navigate(focus, name)
+        raise FHIRPathError(f"無法解析: {text!r}")
+
+    def parse_postfix(self, left: Evaluator) -> Evaluator:
+        while True:
+            kind, text = self.peek()
+            if text == ".":
+                self.advance()
+                name_kind, name = self.advance()
+                if name_kind != "identifier":
+                    raise FHIRPathError("'.' 之後必須是名稱")
+                if self.peek()[1] == "(":
+                    call = self._function(name)
+                    left = (lambda l, c: lambda focus, env: c(l(focus, env), env))(left, call)
+                else:
+                    left = (lambda l, n: lambda focus, env: _navigate(l(focus, env), n))(left, name)
+            elif text == "[":
+                self.advance()
+                index_expr = self.parse_expression(0)
+                self.expect("]")
+
+                def indexer(focus, env, l=left, i=index_expr):
+                    items = l(focus, env)
+                    index = i(focus, env)
+                    return [items[index[0]]] if index and 0 <= index[0] < len(items) else []
+
+                left = indexer
+            else:
+                return left
+
+    def _variable(self, name: str) -> Evaluator:
+        if name == "$this":
+            return lambda focus, env: focus
+        if name in ("%resource", "%rootResource"):
+            return lambda focus, env: [env["resource"]]
+        if name == "%ucum":
+            return lambda focus, env: ["http://unitsofmeasure.org"]
+        raise FHIRPathError(f"不支援的變數: {name}")
+
+    def _parse_arguments(self) -> List[Evaluator]:
+        self.expect("(")
+        arguments = []
+        if self.peek()[1] != ")":
+            while True:
+                arguments.append(self.parse_expression(0))
+                if self.peek()[1] != ",":
+                    break
+                self.advance()
+        self.expect(")")
+        return arguments
+
+    def _function(self, name: str) -> Evaluator:
+        """編譯函式呼叫，回傳 (輸入集合, 環境) → 結果集合"""
+        if name in ("is", "as", "ofType"):
+            self.expect("(")
+            type_name = self.parse_type_name()
+            self.expect(")")
+            if name == "ofType":
+                return lambda focus, env: [item for item in focus if _has_type(item, type_name)]
+            return self._type_operator(lambda focus, env: focus, name, type_name)
+
+        arguments = self._parse_arguments()
+        argument = arguments[0] if arguments else None
+
+        def each(item, env):
+            # where / all / select / exists 的參數以每個項目為 $this 重新計算
+            outer = env.get("this")
+            env["this"] = [item]
+            try:
+                return argument([item], env)
+            finally:
+                env["this"] = outer
+
+        def with_context(evaluate):
+            # 一般參數以呼叫時的 $this 計算
+            return lambda env: evaluate(env["this"], env)
+
+        if name == "exists":
+            if argument is None:
+                return lambda focus, env: [bool(focus)]
+            return lambda focus, env: [any(_to_boolean(each(item, env)) for item in focus)]
+        if name == "empty":
+            return lambda focus, env: [not focus]
+        if name == "not":
+            return lambda focus, env: [] if _to_boolean(focus) is None else [not _to_boolean(focus)]
+        if name == "where":
+            return lambda focus, env: [item for item in focus if _to_boolean(each(item, env))]
+        if name == "all":
+            return lambda focus, env: [all(_to_boolean(each(item, env)) for item in focus)]
+        if name == "select":
+            return lambda focus, env: [value for item in focus for value in each(item, env)]
+        if name == "count":
+            return lambda focus, env: [len(focus)]
+        if name == "first":
+            return lambda focus, env: focus[:1]
+        if name == "last":
+            return lambda focus, env: focus[-1:]
+        if name == "hasValue":
+            return lambda focus, env: [len(focus) == 1 and not isinstance(focus[0], (dict, list))]
+        if name == "children":
+            return lambda focus, env: [
+                value for item in focus if isinstance(item, dict)
+                for key in item if key != "resourceType"
+                for value in (item[key] if isinstance(item[key], list) else [item[key]])
+            ]
+        if name == "toString":
+            def to_string(focus, env):
+                if not focus:
+                    return []
+                value = _singleton(focus)
+                return [str(value).lower() if isinstance(value, bool) else str(value)]
+            return to_string
+        if name == "length":
+            return lambda focus, env: [len(_singleton(focus))] if focus else []
+        if name == "distinct":
+            return lambda focus, env: _union(focus, [])
+        if name == "isDistinct":
+            return lambda focus, env: [len(_union(focus, [])) == len(focus)]
+        if name == "allTrue":
+            return lambda focus, env: [all(item is True for item in focus)]
+        if name == "anyTrue":
+            return lambda focus, env: [any(item is True for item in focus)]
+        if name == "intersect":
+            other = with_context(argument)
+            return lambda focus, env: [item for item in _union(focus, []) if item in other(env)]
+        if name in ("matches", "startsWith", "contains"):
+            pattern_of = with_context(argument)
+
+            def string_function(focus, env):
+                if not focus:
+                    return []
+                value = _singleton(focus)
+                pattern = pattern_of(env)
+                if not pattern or not isinstance(value, str):
+                    return []
+                if name == "matches":
+                    return [re.search(pattern[0], value) is not None]
+                if name == "startsWith":
+                    return [value.startswith(pattern[0])]
+                return [pattern[0] in value]
+
+            return string_function
+        if name == "iif":
+            condition = arguments[0]
+            true_result = arguments[1]
+            false_result = arguments[2] if len(arguments) > 2 else (lambda focus, env: [])
+            return lambda focus, env: (
+                true_result(focus, env) if _to_boolean(condition(focus, env)) else false_result(focus, env)
+            )
+        raise FHIRPathError(f"不支援的函式: {name}()")
+
+    @staticmethod
+    def _type_operator(left: Evaluator, operator: str, type_name: str) -> Evaluator:
+        if operator == "is":
+            def is_type(focus, env):
+                values = left(focus, env)
+                return [_has_type(_singleton(values), type_name)] if values else []
+            return is_type
+        return lambda focus, env: [item for item in left(focus, env) if _has_type(item, type_name)]
+
+    @staticmethod
+    def _binary(operator: str, left: Evaluator, right: Evaluator) -> Evaluator:
+        if operator in ("and", "or", "xor", "implies"):
+            def logical(focus, env):
+                a = _to_boolean(left(focus, env))
+                if operator == "and":
+                    if a is False:
+                        return [False]
+                    b = _to_boolean(right(focus, env))
+                    if b is False:
+                        return [False]
+                    return [True] if a and b else []
+                if operator == "or":
+                    if a is True:
+                        return [True]
+                    b = _to_boolean(right(focus, env))
+                    if b is True:
+                        return [True]
+                    return [False] if a is False and b is False else []
+                if operator == "implies":
+                    if a is False:
+                        return [True]
+                    b = _to_boolean(right(focus, env))
+                    if b is True:
+                        return [True]
+                    return [False] if a is True and b is False else []
+                b = _to_boolean(right(focus, env))
+                return [] if a is None or b is None else [a != b]
+            return logical
+
+        if operator == "|":
+            return lambda focus, env: _union(left(focus, env), right(focus, env))
+        if operator in ("in", "contains"):
+            element, collection = (left, right) if operator == "in" else (right, left)
+
+            def membership(focus, env):
+                values = element(focus, env)
+                return [_singleton(values) in collection(focus, env)] if values else []
+            return membership
+        if operator == "&":
+            return lambda focus, env: ["".join(str(v[0]) if v else "" for v in (left(focus, env), right(focus, env)))]
+
+        def compare(focus, env):
+            a, b = left(focus, env), right(focus, env)
+            if operator in ("=", "!="):
+                if not a or not b:
+                    return []
+                return [(a == b) == (operator == "=")]
+            if operator in ("~", "!~"):
+                equivalent = [str(x).lower() for x in a] == [str(x).lower() for x in b]
+                return [equivalent == (operator == "~")]
+            if not a or not b:
+                return []
+            x, y = _singleton(a), _singleton(b)
+            if operator == ">":
+                return [x > y]
+            if operator == "<":
+                return [x < y]
+            if operator == ">=":
+                return [x >= y]
+            if operator == "<=":
+                return [x <= y]
+            if operator == "+":
+                return [x + y]
+            if operator == "-":
+                return [x - y]
+            if operator == "*":
+                return [x * y]
+            if operator == "/":
+                return [x / y] if y else []
+            if operator == "div":
+                return [x // y] if y else []
+            if operator == "mod":
+                return [x % y] if y else []
+            raise FHIRPathError(f"不支援的運算子: {operator}")
+
+        return compare
+
+
+@lru_cache(maxsize=None)
+def compile_expression(expression: str) -> Evaluator:
+    """
+    編譯 FHIRPath 運算式（相同文字只編譯一次）
+
+    Raises:
+        FHIRPathError: 運算式超出支援的子集或語法錯誤
+    """
+    evaluator = _Parser(expression).parse()
+
+    def evaluate(focus: List[Any], env: Dict[str, Any]) -> List[Any]:
+        outer = env.get("this")
+        env["this"] = focus
+        try:
+            return evaluator(focus, env)
+        finally:
+            env["this"] = outer
+
+    return evaluate
+
+
+def evaluate(expression: str, resource: Dict[str, Any], context: Any = None) -> List[Any]:
+    """
+    計算 FHIRPath 運算式
+
+    Args:
+        expression: 運算式
+        resource: 資源（%resource）
+        context: 起始節點，未指定時為資源本身
+
+    Returns:
+        結果集合
+    """
+    focus = [resource if context is None else context]
+    return compile_expression(expression)(focus, {"resource": resource})
+
+
+def is_true(expression: str, resource: Dict[str, Any], context: Any = None) -> bool:
+    """invariant 判斷：結果為空或 true 時視為成立"""
+    return _to_boolean(evaluate(expression, resource, context)) is not False
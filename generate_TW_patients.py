@@ -4,26 +4,150 @@
 修復了 Condition 和 Observation 上傳失敗的问题
 """
 
+import copy
 import json
 import requests
-import uuid
 import random
 from datetime import datetime, timedelta
 from pathlib import Path
 import time
 from config_loader import ConfigLoader
+from medication_registry import MedicationRegistry
+from id_generator import IDGenerator
+from taiwan_id import TaiwanIDAllocator
+from population_model import PopulationModel
+from physiology import (BMI_CODE, DIASTOLIC_CODE, MIN_PULSE_PRESSURE, SYSTOLIC_CODE, PhysiologyModel,
+                        observation_value)
+from longitudinal import DEFAULT_SPAN_DAYS, DEFAULT_VISIT_INTERVAL_DAYS, build_patient_series, visit_schedule
+from terminology import get_terminology_store
+from valueset import get_value_set_expander
+from conceptmap import get_concept_map_registry
+from profile_validator import get_profile_validator
+from timing import NULL_TIMER, StageTimer
+from metrics import (BYTES_WRITTEN, PATIENT_DATA_RESOURCE_TYPES, RESOURCES_GENERATED, UPLOAD_LATENCY,
+                     UPLOAD_REQUESTS, UPLOAD_RETRIES, record_patient_data)
+from records import PatientBatch
+
+# 三碼郵遞區號 CodeSystem（TW Core IG 套件）
+POSTAL_CODE_SYSTEM = "https://twcore.mohw.gov.tw/ig/twcore/CodeSystem/postal-code3-tw"
+# TW Core 生命徵象 ValueSet，用於判斷 Observation 類別
+VITAL_SIGNS_VALUE_SET = "https://twcore.mohw.gov.tw/ig/twcore/ValueSet/vital-signs-tw"
+OBSERVATION_CATEGORY_SYSTEM = "http://terminology.hl7.org/CodeSystem/observation-category"
+# 血壓以 TW Core 血壓 Profile 的 panel 呈現：收縮壓、舒張壓為 component
+BLOOD_PRESSURE_PANEL_CODE = "85354-9"
+BLOOD_PRESSURE_CODES = (BLOOD_PRESSURE_PANEL_CODE, SYSTOLIC_CODE, DIASTOLIC_CODE)
+BLOOD_PRESSURE_PROFILE = "https://twcore.mohw.gov.tw/ig/twcore/StructureDefinition/Observation-bloodPressure-twcore"
+BMI_PROFILE = "https://twcore.mohw.gov.tw/ig/twcore/StructureDefinition/Observation-bmi-twcore"
+
+# TW Core 健保代碼與對應的 ConceptMap（健保代碼 → HL7 / SNOMED CT）
+FREQUENCY_CODE_SYSTEM = "https://twcore.mohw.gov.tw/ig/twcore/CodeSystem/medication-frequency-nhi-tw"
+FREQUENCY_CONCEPT_MAP = "https://twcore.mohw.gov.tw/ig/twcore/ConceptMap/medication-frequency-tw"
+ROUTE_CODE_SYSTEM = "https://twcore.mohw.gov.tw/ig/twcore/CodeSystem/medication-path-tw"
+ROUTE_CONCEPT_MAP = "https://twcore.mohw.gov.tw/ig/twcore/ConceptMap/medication-path-tw"
+DEPARTMENT_CODE_SYSTEM = "https://twcore.mohw.gov.tw/ig/twcore/CodeSystem/medical-treatment-department-nhi-tw"
+DEPARTMENT_CONCEPT_MAP = "https://twcore.mohw.gov.tw/ig/twcore/ConceptMap/medical-treatment-department-nhi-tw"
+
+# 用藥指示: (說明, 健保用藥頻率代碼, frequency, period, periodUnit)
+DOSAGE_INSTRUCTIONS = (
+    ("每日一次，飯後服用", "QD", 1, 1, "d"),
+    ("每日兩次，早晚飯後服用", "BID", 2, 1, "d"),
+    ("每日三次，飯前服用", "TID", 3, 1, "d"),
+    ("每日四次，每6小時服用一次", "Q6H", 4, 1, "d"),
+    ("需要時服用，每日不超過4次", "PRN", 1, 1, "d"),
+    ("睡前服用", "HS", 1, 1, "d"),
+    ("每週一次", "QW", 1, 1, "wk")
+)
+
+# 劑型 (SNOMED CT) → 健保給藥途徑代碼
+DOSAGE_FORM_ROUTES = {
+    "385055001": "PO",    # Tablet
+    "385049006": "PO",    # Capsule
+    "421026006": "PO",    # Oral dose form
+    "385101003": "SKIN",  # Cream
+    "420317006": "INHL",  # Inhaler
+    "385023001": "OU"     # Eye drops
+}
+
+# 就診類型 → 可能的健保就醫科別代碼
+ENCOUNTER_DEPARTMENTS = {
+    "outpatient": ("01", "02", "03", "05", "06", "08", "09", "10", "11", "12", "13", "14"),
+    "emergency": ("22",),
+    "inpatient": ("02", "03", "06", "07", "08")
+}
+
+# 上傳每筆資源之間的間隔（秒），避免過於頻繁的請求
+UPLOAD_INTERVAL = 0.5
+# 伺服器回應 429 / 503 時的最大重試次數
+UPLOAD_MAX_RETRIES = 3
+
+# MedicationRequest 引用藥物的方式
+# reference: 另外建立 Medication 並以 medicationReference 引用
+# contained: 將 Medication 內嵌於 MedicationRequest.contained
+# codeable_concept: 直接使用 medicationCodeableConcept，不建立 Medication
+MEDICATION_MODES = ("reference", "contained", "codeable_concept")
+
+
+def default_reference_time(seed=None):
+    """
+    生成資料的預設基準時間
+
+    Args:
+        seed: 隨機種子
+
+    Returns:
+        指定種子時為今天 00:00（同一天以相同種子生成的資料相同）；否則為目前時間（取到秒）
+    """
+    now = datetime.now()
+    if seed is not None:
+        return datetime.combine(now.date(), datetime.min.time())
+    return now.replace(microsecond=0)
+
 
 class TWFHIRGeneratorFixed:
-    def __init__(self):
+    def __init__(self, medication_mode="reference", id_strategy="uuid4", seed=None, validate_profiles=True,
+                 upload_interval=UPLOAD_INTERVAL, timer=None, national_id_key=None, reference_time=None,
+                 shared_id_key=None):
         """
         初始化台灣 FHIR 資料生成器 - 修復版
+        
+        Args:
+            medication_mode: MedicationRequest 引用藥物的方式 (見 MEDICATION_MODES)
+            id_strategy: 資源 ID 策略 (見 id_generator.ID_STRATEGIES)
+            seed: deterministic ID 策略使用的種子
+            validate_profiles: 上傳前是否先以 TW Core Profile 驗證資源
+            upload_interval: 上傳每筆資源之間的間隔（秒）
+            timer: 記錄各資源類型生成與上傳耗時的 StageTimer，未指定時不計時
+            national_id_key: 身分證字號置換金鑰，未指定時使用 seed；
+                             多個程序依病人序號配置時必須傳入同一金鑰，否則不同程序的號碼可能重複
+            reference_time: 生成資料的基準時間（出生日期、就診與觀察日期都相對於此），未指定時使用目前時間；
+                            多個程序生成同一批資料時必須傳入同一時間（見 default_reference_time）
+            shared_id_key: 共用 Medication ID 的金鑰（見 IDGenerator）；多個程序生成同一批資料時必須傳入同一金鑰，
+                           同一藥物在各程序中才會使用同一個 Medication
         """
+        if medication_mode not in MEDICATION_MODES:
+            raise ValueError(f"不支援的藥物輸出模式: {medication_mode}")
+        self.medication_mode = medication_mode
+        self.upload_interval = upload_interval
+        self.timer = timer or NULL_TIMER
+        self.reference_time = reference_time
+        self.id_generator = IDGenerator(id_strategy, seed=seed, shared_key=shared_id_key)
+        # 指定病人序號時，身分證字號由序號決定（不同程序以相同種子生成時仍不重複）
+        self._national_id_index = None
+        self.taiwan_id_allocator = TaiwanIDAllocator(seed=seed if national_id_key is None else national_id_key)
+        
         # 載入配置檔案
         self.config_loader = ConfigLoader()
         self.conditions = self.config_loader.get_conditions()
         self.observations = self.config_loader.get_observations()
         self.medications = self.config_loader.get_medications()
         
+        # 同一藥物只建立一個 Medication，並快取各伺服器上的 ID
+        self.medication_registry = MedicationRegistry()
+        # 目錄中 (system, code) 重複的項目一律以第一個項目建立 Medication，內容與生成順序無關
+        self._catalog_medications = {}
+        for med_info in self.medications:
+            self._catalog_medications.setdefault(MedicationRegistry.medication_key(med_info), med_info)
+        
         # 台灣常見姓氏和名字
         self.surnames = [
             "陳", "林", "黃", "張", "李", "王", "吳", "劉", "蔡", "楊",
@@ -48,25 +172,68 @@ class TWFHIRGeneratorFixed:
             "基隆市", "新竹市", "嘉義市", "新竹縣", "苗栗縣", "彰化縣",
             "南投縣", "雲林縣", "嘉義縣", "屏東縣", "宜蘭縣", "花蓮縣"
         ]
-
-    def generate_taiwan_id(self, gender="random"):
-        """生成台灣身份证号"""
-        area_codes = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 
-                     'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z']
         
-        first_char = random.choice(area_codes)
+        # 人口分布模型：所有取樣表在此一次編譯，生成時每次取樣為 O(1)
+        population_config = self.config_loader.get_population() or \
+            PopulationModel.uniform_config(self.cities, self.surnames)
+        self.population_model = PopulationModel(population_config, self.conditions)
         
-        if gender == "random":
-            gender_code = random.choice([1, 2])
-        elif gender == "male":
-            gender_code = 1
-        else:
-            gender_code = 2
+        # 相關生理數值模型：每位病人取一組彼此相關的身高、體重、血壓、血糖、血脂
+        self.physiology_model = PhysiologyModel(self.observations)
+        self._physiology = None
         
-        numbers = [str(random.randint(0, 9)) for _ in range(7)]
-        check_digit = random.randint(0, 9)
+        # 縣市 → [(郵遞區號, 鄉鎮市區)]，第一次生成地址時才由術語庫載入
+        self._postal_areas = None
+        # 生命徵象 LOINC 代碼，第一次生成 Observation 時才展開 ValueSet
+        self._vital_sign_codes = None
+        # LOINC 代碼 → 觀察項目（縱向生成時建立）
+        self._observations_by_code = None
         
-        return first_char + str(gender_code) + ''.join(numbers) + str(check_digit)
+        # ConceptMap 轉換表與代碼顯示名稱（套件不存在時只輸出健保代碼）
+        try:
+            self.terminology = get_terminology_store()
+            self.concept_maps = get_concept_map_registry()
+        except FileNotFoundError:
+            self.terminology = None
+            self.concept_maps = None
+        self._coded_concepts = {}
+        
+        # 上傳前的 TW Core Profile 驗證（不符合的資源不送出請求）
+        self.profile_validator = None
+        if validate_profiles and self.terminology is not None:
+            self.profile_validator = get_profile_validator()
+
+    def _coded_concept(self, system, code, concept_map_url, display=None):
+        """
+        建立 CodeableConcept：來源代碼加上 ConceptMap 轉換後的代碼（每組代碼只轉換一次）
+        
+        Args:
+            system: 來源 CodeSystem
+            code: 來源代碼
+            concept_map_url: 使用的 ConceptMap
+            display: 術語庫查無顯示名稱時使用的名稱
+        """
+        key = (concept_map_url, system, code)
+        codings = self._coded_concepts.get(key)
+        if codings is None:
+            targets = ()
+            if self.concept_maps is not None:
+                display = self.terminology.lookup(system, code) or display
+                targets = self.concept_maps.translate(concept_map_url, system, code)
+            codings = ((system, code, display),) + tuple(target[:3] for target in targets)
+            self._coded_concepts[key] = codings
+        
+        return {
+            "coding": [
+                {"system": s, "code": c, **({"display": d} if d else {})}
+                for s, c, d in codings
+            ],
+            "text": codings[0][2] or code
+        }
+
+    def generate_taiwan_id(self, gender="random"):
+        """生成台灣身份证号（檢查碼正確，同一次執行中保證不重複）"""
+        return self.taiwan_id_allocator.allocate(gender, index=self._national_id_index)
 
     def generate_phone_number(self, phone_type="mobile"):
         """生成台灣电话号碼"""
@@ -81,10 +248,31 @@ class TWFHIRGeneratorFixed:
             number = f"{random.randint(1000, 9999)}-{random.randint(1000, 9999)}"
             return f"{area}-{number}"
 
+    def _get_postal_areas(self):
+        """由 TW Core 郵遞區號 CodeSystem 建立縣市對應的鄉鎮市區列表（套件不存在時為空）"""
+        if self._postal_areas is None:
+            self._postal_areas = {}
+            try:
+                concepts = get_terminology_store().get_concept_details(POSTAL_CODE_SYSTEM)
+            except FileNotFoundError:
+                concepts = []
+            for concept in concepts:
+                properties = concept["properties"]
+                if "district" in properties and "city" in properties:
+                    self._postal_areas.setdefault(properties["district"], []).append(
+                        (concept["code"], properties["city"])
+                    )
+        return self._postal_areas
+
     def generate_address(self):
-        """生成台灣地址"""
-        city = random.choice(self.cities)
-        district = f"{random.choice(['中', '東', '西', '南', '北'])}區"
+        """生成台灣地址（郵遞區號與鄉鎮市區取自 TW Core 郵遞區號代碼表）"""
+        city = self.population_model.sample_city()
+        areas = self._get_postal_areas().get(city.replace("台", "臺"))
+        if areas:
+            postal_code, district = random.choice(areas)
+        else:
+            district = f"{random.choice(['中', '東', '西', '南', '北'])}區"
+            postal_code = str(random.randint(100, 999))
         street_names = ["中山路", "中正路", "民生路", "民權路", "忠孝路", "仁愛路", "信義路", "和平路"]
         street = random.choice(street_names)
         section = random.randint(1, 5)
@@ -92,7 +280,6 @@ class TWFHIRGeneratorFixed:
         floor = random.randint(1, 20)
         
         full_address = f"{city}{district}{street}{section}段{number}號{floor}樓"
-        postal_code = str(random.randint(100, 999))
         
         return {
             "city": city,
@@ -104,7 +291,7 @@ class TWFHIRGeneratorFixed:
     def generate_patient(self):
         """生成符合 TWCORE 规范的 Patient 資源"""
         gender = random.choice(["male", "female"])
-        surname = random.choice(self.surnames)
+        surname = self.population_model.sample_surname()
         
         if gender == "male":
             given_name = random.choice(self.male_names)
@@ -114,15 +301,21 @@ class TWFHIRGeneratorFixed:
         full_name = surname + given_name
         taiwan_id = self.generate_taiwan_id(gender)
         
-        # 生成出生日期（18-80岁）
-        today = datetime.now()
-        birth_date = today - timedelta(days=random.randint(18 * 365, 80 * 365))
+        # 依年齡金字塔生成出生日期
+        today = self._now()
+        age = self.population_model.sample_age()
+        try:
+            last_birthday = today.replace(year=today.year - age)
+        except ValueError:  # 2月29日
+            last_birthday = today.replace(year=today.year - age, day=28)
+        birth_date = last_birthday - timedelta(days=random.randint(0, 364))
+        marital_code, marital_display = self.population_model.sample_marital_status(age)
         
         address_info = self.generate_address()
         mobile_phone = self.generate_phone_number("mobile")
         home_phone = self.generate_phone_number("home")
         
-        patient_id = str(uuid.uuid4())
+        patient_id = self.id_generator.new_id("Patient")
         
         # 创建 narrative 文本
         narrative_text = f"""
@@ -201,9 +394,9 @@ class TWFHIRGeneratorFixed:
             "maritalStatus": {
                 "coding": [
                     {
-                        "system": "http://terminology.hl7.org/CodeSystem/v3-MaritalStatus",
-                        "code": random.choice(["M", "S", "D", "W"]),
-                        "display": random.choice(["Married", "Never Married", "Divorced", "Widowed"])
+                        "system": self.population_model.marital_system,
+                        "code": marital_code,
+                        "display": marital_display
                     }
                 ]
             },
@@ -225,7 +418,7 @@ class TWFHIRGeneratorFixed:
         
         return patient
 
-    def generate_encounter(self, patient_id, patient_name, encounter_type="outpatient"):
+    def generate_encounter(self, patient_id, patient_name, encounter_type="outpatient", visit_date=None):
         """
         生成就診記錄 (Encounter) 資源
         
@@ -233,11 +426,12 @@ class TWFHIRGeneratorFixed:
             patient_id: 病人ID
             patient_name: 病人姓名
             encounter_type: 就診類型 ('outpatient': 門診, 'inpatient': 住院, 'emergency': 急診)
+            visit_date: 就診開始時間，未指定時為過去6個月內的隨機時間
             
         Returns:
             Encounter FHIR 資源
         """
-        encounter_id = str(uuid.uuid4())
+        encounter_id = self.id_generator.new_id("Encounter")
         
         # 定義就診類型的映射
         encounter_types = {
@@ -261,7 +455,8 @@ class TWFHIRGeneratorFixed:
         encounter_info = encounter_types.get(encounter_type, encounter_types["outpatient"])
         
         # 生成就診時間（過去6個月內的隨機時間）
-        visit_date = datetime.now() - timedelta(days=random.randint(1, 180))
+        if visit_date is None:
+            visit_date = self._now() - timedelta(days=random.randint(1, 180))
         
         # 根據就診類型設定就診時長
         if encounter_type == "outpatient":
@@ -314,6 +509,11 @@ class TWFHIRGeneratorFixed:
                     "text": encounter_info["display"]
                 }
             ],
+            "serviceType": self._coded_concept(
+                DEPARTMENT_CODE_SYSTEM,
+                random.choice(ENCOUNTER_DEPARTMENTS.get(encounter_type, ENCOUNTER_DEPARTMENTS["outpatient"])),
+                DEPARTMENT_CONCEPT_MAP
+            ),
             "subject": {
                 "reference": f"Patient/{patient_id}",
                 "display": patient_name
@@ -333,11 +533,11 @@ class TWFHIRGeneratorFixed:
 
     def generate_condition(self, patient_id, patient_name):
         """修復版：为指定病人生成 Condition 資源"""
-        condition_info = random.choice(self.conditions)
-        condition_id = str(uuid.uuid4())
+        condition_info = self.population_model.sample_condition()
+        condition_id = self.id_generator.new_id("Condition")
         
         # 隨機生成發病日期（過去2年內）
-        onset_date = datetime.now() - timedelta(days=random.randint(1, 730))
+        onset_date = self._now() - timedelta(days=random.randint(1, 730))
         
         narrative_text = f"""
         <div xmlns="http://www.w3.org/1999/xhtml">
@@ -376,6 +576,17 @@ class TWFHIRGeneratorFixed:
                     }
                 ]
             },
+            "category": [
+                {
+                    "coding": [
+                        {
+                            "system": "http://terminology.hl7.org/CodeSystem/condition-category",
+                            "code": "problem-list-item",
+                            "display": "Problem List Item"
+                        }
+                    ]
+                }
+            ],
             "code": {
                 "coding": [
                     {
@@ -390,17 +601,27 @@ class TWFHIRGeneratorFixed:
                 "reference": f"Patient/{patient_id}"
             },
             "onsetDateTime": onset_date.strftime("%Y-%m-%d"),
-            "recordedDate": datetime.now().strftime("%Y-%m-%d")
+            "recordedDate": self._now().strftime("%Y-%m-%d")
         }
         
         return condition
 
-    def generate_condition_with_info(self, patient_id, patient_name, condition_info):
-        """使用指定的疾病資訊生成 Condition 資源"""
-        condition_id = str(uuid.uuid4())
+    def generate_condition_with_info(self, patient_id, patient_name, condition_info, visit=None):
+        """
+        使用指定的疾病資訊生成 Condition 資源
         
-        # 隨機生成發病日期（過去2年內）
-        onset_date = datetime.now() - timedelta(days=random.randint(1, 730))
+        Args:
+            visit: (Encounter ID, 就診時間)；指定時引用該次就診，記錄日期為就診日、發病日期在就診日之前
+        """
+        condition_id = self.id_generator.new_id("Condition")
+        
+        if visit is None:
+            # 隨機生成發病日期（過去2年內）
+            onset_date = self._now() - timedelta(days=random.randint(1, 730))
+            recorded_date = self._now()
+        else:
+            recorded_date = visit[1]
+            onset_date = recorded_date - timedelta(days=random.randint(0, 730))
         
         narrative_text = f"""
         <div xmlns="http://www.w3.org/1999/xhtml">
@@ -439,6 +660,17 @@ class TWFHIRGeneratorFixed:
                     }
                 ]
             },
+            "category": [
+                {
+                    "coding": [
+                        {
+                            "system": "http://terminology.hl7.org/CodeSystem/condition-category",
+                            "code": "problem-list-item",
+                            "display": "Problem List Item"
+                        }
+                    ]
+                }
+            ],
             "code": {
                 "coding": [
                     {
@@ -453,28 +685,50 @@ class TWFHIRGeneratorFixed:
                 "reference": f"Patient/{patient_id}"
             },
             "onsetDateTime": onset_date.strftime("%Y-%m-%d"),
-            "recordedDate": datetime.now().strftime("%Y-%m-%d")
+            "recordedDate": recorded_date.strftime("%Y-%m-%d")
         }
+        if visit is not None:
+            condition["encounter"] = {"reference": f"Encounter/{visit[0]}"}
         
         return condition
 
+    def _get_observation_category(self, loinc_code):
+        """依 TW Core 生命徵象 ValueSet 判斷 Observation.category（其餘項目皆為檢驗）"""
+        if self._vital_sign_codes is None:
+            try:
+                expansion = get_value_set_expander().expand(VITAL_SIGNS_VALUE_SET)
+            except FileNotFoundError:
+                expansion = None
+            self._vital_sign_codes = expansion.codes("http://loinc.org") if expansion else set()
+        
+        if loinc_code in self._vital_sign_codes:
+            code, display = "vital-signs", "Vital Signs"
+        else:
+            code, display = "laboratory", "Laboratory"
+        return [
+            {
+                "coding": [
+                    {
+                        "system": OBSERVATION_CATEGORY_SYSTEM,
+                        "code": code,
+                        "display": display
+                    }
+                ]
+            }
+        ]
+
     def generate_observation(self, patient_id, patient_name):
         """修復版：为指定病人生成 Observation 資源"""
         obs_info = random.choice(self.observations)
-        observation_id = str(uuid.uuid4())
+        if obs_info["code"] in BLOOD_PRESSURE_CODES:
+            return self.generate_blood_pressure_panel(patient_id, patient_name)
+        observation_id = self.id_generator.new_id("Observation")
         
-        # 生成隨機值
-        if isinstance(obs_info["min_val"], float) or isinstance(obs_info["max_val"], float):
-            # 如果是浮點數，使用 uniform 並保留適當小數位
-            if obs_info["code"] == "8310-5":  # 體溫
-                value = round(random.uniform(obs_info["min_val"], obs_info["max_val"]), 1)
-            else:
-                value = round(random.uniform(obs_info["min_val"], obs_info["max_val"]), 2)
-        else:
-            value = random.randint(obs_info["min_val"], obs_info["max_val"])
+        # 相關模型中的項目使用病人的生理數值，其餘在參考範圍內隨機生成
+        value = observation_value(obs_info, self._physiology)
         
         # 隨機生成觀察日期（過去30天內）
-        observation_date = datetime.now() - timedelta(days=random.randint(1, 30))
+        observation_date = self._now() - timedelta(days=random.randint(1, 30))
         
         narrative_text = f"""
         <div xmlns="http://www.w3.org/1999/xhtml">
@@ -496,6 +750,7 @@ class TWFHIRGeneratorFixed:
                 "div": narrative_text
             },
             "status": "final",
+            "category": self._get_observation_category(obs_info["code"]),
             "code": {
                 "coding": [
                     {
@@ -520,22 +775,25 @@ class TWFHIRGeneratorFixed:
         
         return observation
 
-    def generate_observation_with_info(self, patient_id, patient_name, obs_info):
-        """使用指定的觀察信息生成 Observation 資源"""
-        observation_id = str(uuid.uuid4())
-        
-        # 生成隨機值
-        if isinstance(obs_info["min_val"], float) or isinstance(obs_info["max_val"], float):
-            # 如果是浮點數，使用 uniform 並保留適當小數位
-            if obs_info["code"] == "8310-5":  # 體溫
-                value = round(random.uniform(obs_info["min_val"], obs_info["max_val"]), 1)
-            else:
-                value = round(random.uniform(obs_info["min_val"], obs_info["max_val"]), 2)
-        else:
-            value = random.randint(obs_info["min_val"], obs_info["max_val"])
+    def generate_observation_with_info(self, patient_id, patient_name, obs_info, visit=None):
+        """
+        使用指定的觀察信息生成 Observation 資源（收縮壓、舒張壓一律以血壓 panel 呈現）
+        
+        Args:
+            visit: (Encounter ID, 就診時間)；指定時引用該次就診並以就診日為觀察日期
+        """
+        if obs_info["code"] in BLOOD_PRESSURE_CODES:
+            return self.generate_blood_pressure_panel(patient_id, patient_name, visit)
+        observation_id = self.id_generator.new_id("Observation")
+        
+        # 相關模型中的項目使用病人的生理數值，其餘在參考範圍內隨機生成
+        value = observation_value(obs_info, self._physiology)
         
         # 隨機生成觀察日期（過去30天內）
-        observation_date = datetime.now() - timedelta(days=random.randint(1, 30))
+        if visit is None:
+            observation_date = self._now() - timedelta(days=random.randint(1, 30))
+        else:
+            observation_date = visit[1]
         
         narrative_text = f"""
         <div xmlns="http://www.w3.org/1999/xhtml">
@@ -557,6 +815,7 @@ class TWFHIRGeneratorFixed:
                 "div": narrative_text
             },
             "status": "final",
+            "category": self._get_observation_category(obs_info["code"]),
             "code": {
                 "coding": [
                     {
@@ -578,62 +837,121 @@ class TWFHIRGeneratorFixed:
                 "code": obs_info["ucum_code"]  # 使用正确的 UCUM 代碼
             }
         }
+        if obs_info["code"] == BMI_CODE:
+            observation["meta"] = {"profile": [BMI_PROFILE]}
+        if visit is not None:
+            observation["encounter"] = {"reference": f"Encounter/{visit[0]}"}
         
         return observation
 
-    def generate_medication(self, patient_id, patient_name):
-        """生成 Medication 資源"""
-        med_info = random.choice(self.medications)
-        medication_id = str(uuid.uuid4())
+    @staticmethod
+    def _blood_pressure_components(systolic, diastolic):
+        """血壓 panel 的收縮壓、舒張壓 component"""
+        return [
+            {
+                "code": {
+                    "coding": [{"system": "http://loinc.org", "code": code, "display": display}],
+                    "text": display
+                },
+                "valueQuantity": {
+                    "value": value,
+                    "unit": "mmHg",
+                    "system": "http://unitsofmeasure.org",
+                    "code": "mm[Hg]"
+                }
+            }
+            for code, display, value in ((SYSTOLIC_CODE, "Systolic blood pressure", systolic),
+                                         (DIASTOLIC_CODE, "Diastolic blood pressure", diastolic))
+        ]
+
+    def generate_blood_pressure_panel(self, patient_id, patient_name, visit=None):
+        """
+        生成血壓 Observation（TW Core 血壓 Profile：LOINC 85354-9 panel，收縮壓與舒張壓為 component）
+        
+        數值取自病人的相關生理數值，舒張壓必定低於收縮壓
+        
+        Args:
+            visit: (Encounter ID, 就診時間)；指定時引用該次就診並以就診日為觀察日期
+        """
+        observation_id = self.id_generator.new_id("Observation")
+        profile = self._physiology or self.physiology_model.next_profile()
+        systolic, diastolic = int(round(profile[SYSTOLIC_CODE])), int(round(profile[DIASTOLIC_CODE]))
+        if visit is None:
+            observation_date = self._now() - timedelta(days=random.randint(1, 30))
+        else:
+            observation_date = visit[1]
         
         narrative_text = f"""
         <div xmlns="http://www.w3.org/1999/xhtml">
-            <p><strong>藥物資訊</strong></p>
+            <p><strong>觀察記錄</strong></p>
             <ul>
-                <li>藥物名稱: {med_info['display']}</li>
-                <li>類別: {med_info['category']}</li>
-                <li>劑型: {med_info['dosage_form']}</li>
-                <li>強度: {med_info['strength']}</li>
-                <li>ATC代碼: {med_info['atc']}</li>
+                <li>病人: {patient_name}</li>
+                <li>項目: 血壓</li>
+                <li>數值: {systolic}/{diastolic} mmHg</li>
+                <li>觀察日期: {observation_date.strftime('%Y-%m-%d')}</li>
             </ul>
         </div>
         """.strip()
         
-        medication = {
-            "resourceType": "Medication",
-            "id": medication_id,
+        observation = {
+            "resourceType": "Observation",
+            "id": observation_id,
+            "meta": {"profile": [BLOOD_PRESSURE_PROFILE]},
             "text": {
                 "status": "generated",
                 "div": narrative_text
             },
+            "status": "final",
+            "category": self._get_observation_category(SYSTOLIC_CODE),
             "code": {
                 "coding": [
                     {
-                        "system": med_info["system"],
-                        "code": med_info["code"],
-                        "display": med_info["display"]
+                        "system": "http://loinc.org",
+                        "code": BLOOD_PRESSURE_PANEL_CODE,
+                        "display": "Blood pressure panel with all children optional"
                     }
                 ],
-                "text": med_info["display"]
+                "text": "血壓"
             },
-            "status": "active",
-            "form": {
-                "coding": [
-                    {
-                        "system": "http://snomed.info/sct",
-                        "code": self._get_dosage_form_code(med_info["dosage_form"]),
-                        "display": self._get_dosage_form_display(med_info["dosage_form"])
-                    }
-                ],
-                "text": self._get_dosage_form_display(med_info["dosage_form"])
-            }
+            "subject": {
+                "reference": f"Patient/{patient_id}"
+            },
+            "effectiveDateTime": observation_date.strftime("%Y-%m-%d"),
+            "component": self._blood_pressure_components(systolic, diastolic)
         }
-        
-        return medication
+        if visit is not None:
+            observation["encounter"] = {"reference": f"Encounter/{visit[0]}"}
+        return observation
+
+    @staticmethod
+    def _drop_repeated_blood_pressure(observations):
+        """同一病人選到多個血壓項目時只保留一個血壓 panel"""
+        kept, seen_panel = [], False
+        for observation in observations:
+            if observation["code"]["coding"][0]["code"] == BLOOD_PRESSURE_PANEL_CODE:
+                if seen_panel:
+                    continue
+                seen_panel = True
+            kept.append(observation)
+        return kept
+
+    def generate_medication(self, patient_id, patient_name):
+        """生成 Medication 資源"""
+        med_info = random.choice(self.medications)
+        return self.generate_medication_with_info(patient_id, patient_name, med_info)
 
     def generate_medication_with_info(self, patient_id, patient_name, med_info):
-        """使用指定的藥物資訊生成 Medication 資源"""
-        medication_id = str(uuid.uuid4())
+        """
+        使用指定的藥物資訊取得 Medication 資源
+        
+        Medication 內容只取決於藥物目錄項目，因此同一次執行中所有病人共用同一個資源與 ID
+        """
+        med_info = self._catalog_medications.get(MedicationRegistry.medication_key(med_info), med_info)
+        return self.medication_registry.get_or_create(med_info, self._build_medication)
+
+    def _build_medication(self, med_info):
+        """建立藥物目錄項目對應的 Medication 資源"""
+        medication_id = self.id_generator.stable_id("Medication", med_info["system"], med_info["code"])
         
         narrative_text = f"""
         <div xmlns="http://www.w3.org/1999/xhtml">
@@ -680,36 +998,32 @@ class TWFHIRGeneratorFixed:
         
         return medication
 
-    def generate_medication_request(self, patient_id, patient_name, medication_id, medication_display):
-        """生成 MedicationRequest 資源"""
-        med_request_id = str(uuid.uuid4())
+    def generate_medication_request(self, patient_id, patient_name, medication_id, medication_display, medication=None,
+                                    visit=None):
+        """
+        生成 MedicationRequest 資源
+        
+        Args:
+            patient_id: 病人ID
+            patient_name: 病人姓名
+            medication_id: Medication ID (reference 模式使用)
+            medication_display: 藥物顯示名稱
+            medication: Medication 資源 (contained 與 codeable_concept 模式必須提供)
+            visit: (Encounter ID, 就診時間)；指定時引用該次就診並以就診日為處方日期
+            
+        Returns:
+            MedicationRequest FHIR 資源
+        """
+        med_request_id = self.id_generator.new_id("MedicationRequest")
         
         # 隨機生成處方日期（過去30天內）
-        authored_date = datetime.now() - timedelta(days=random.randint(1, 30))
+        if visit is None:
+            authored_date = self._now() - timedelta(days=random.randint(1, 30))
+        else:
+            authored_date = visit[1]
         
         # 隨機生成用藥指示
-        dosage_instructions = [
-            "每日一次，飯後服用",
-            "每日兩次，早晚飯後服用",
-            "每日三次，飯前服用",
-            "每日四次，每6小時服用一次",
-            "需要時服用，每日不超過4次",
-            "睡前服用",
-            "每週一次"
-        ]
-        
-        frequency_codes = {
-            "每日一次，飯後服用": {"frequency": 1, "period": 1, "periodUnit": "d"},
-            "每日兩次，早晚飯後服用": {"frequency": 2, "period": 1, "periodUnit": "d"},
-            "每日三次，飯前服用": {"frequency": 3, "period": 1, "periodUnit": "d"},
-            "每日四次，每6小時服用一次": {"frequency": 4, "period": 1, "periodUnit": "d"},
-            "需要時服用，每日不超過4次": {"frequency": 1, "period": 1, "periodUnit": "d"},
-            "睡前服用": {"frequency": 1, "period": 1, "periodUnit": "d"},
-            "每週一次": {"frequency": 1, "period": 1, "periodUnit": "wk"}
-        }
-        
-        selected_instruction = random.choice(dosage_instructions)
-        frequency_info = frequency_codes[selected_instruction]
+        selected_instruction, frequency_code, frequency, period, period_unit = random.choice(DOSAGE_INSTRUCTIONS)
         
         narrative_text = f"""
         <div xmlns="http://www.w3.org/1999/xhtml">
@@ -733,10 +1047,6 @@ class TWFHIRGeneratorFixed:
             },
             "status": "active",
             "intent": "order",
-            "medicationReference": {
-                "reference": f"Medication/{medication_id}",
-                "display": medication_display
-            },
             "subject": {
                 "reference": f"Patient/{patient_id}",
                 "display": patient_name
@@ -747,17 +1057,52 @@ class TWFHIRGeneratorFixed:
                     "text": selected_instruction,
                     "timing": {
                         "repeat": {
-                            "frequency": frequency_info["frequency"],
-                            "period": frequency_info["period"],
-                            "periodUnit": frequency_info["periodUnit"]
-                        }
+                            "frequency": frequency,
+                            "period": period,
+                            "periodUnit": period_unit
+                        },
+                        "code": self._coded_concept(FREQUENCY_CODE_SYSTEM, frequency_code, FREQUENCY_CONCEPT_MAP)
                     }
                 }
             ]
         }
         
+        dosage = medication_request["dosageInstruction"][0]
+        if frequency_code == "PRN":
+            dosage["asNeededBoolean"] = True
+        form_codings = (medication or {}).get("form", {}).get("coding", [])
+        route_code = DOSAGE_FORM_ROUTES.get(form_codings[0]["code"]) if form_codings else None
+        if route_code:
+            dosage["route"] = self._coded_concept(ROUTE_CODE_SYSTEM, route_code, ROUTE_CONCEPT_MAP)
+        
+        if self.medication_mode == "reference":
+            medication_request["medicationReference"] = {
+                "reference": f"Medication/{medication_id}",
+                "display": medication_display
+            }
+        elif self.medication_mode == "contained":
+            # 登錄器中的 Medication 由所有處方共用，複製後再內嵌，之後修改單一處方不影響其他處方
+            contained_medication = copy.deepcopy({k: v for k, v in medication.items() if k != "text"})
+            contained_medication["id"] = "med"
+            medication_request["contained"] = [contained_medication]
+            medication_request["medicationReference"] = {
+                "reference": "#med",
+                "display": medication_display
+            }
+        else:
+            medication_request["medicationCodeableConcept"] = copy.deepcopy(medication["code"])
+        if visit is not None:
+            medication_request["encounter"] = {"reference": f"Encounter/{visit[0]}"}
+        
         return medication_request
 
+    @staticmethod
+    def _get_medication_request_display(med_request):
+        """獲取 MedicationRequest 的藥物顯示名稱（適用所有輸出模式）"""
+        if "medicationReference" in med_request:
+            return med_request["medicationReference"].get("display", "")
+        return med_request.get("medicationCodeableConcept", {}).get("text", "")
+
     def _get_dosage_form_code(self, dosage_form):
         """獲取劑型的 SNOMED CT 代碼"""
         form_codes = {
@@ -793,21 +1138,53 @@ class TWFHIRGeneratorFixed:
         unit = re.sub(r'\d+(?:\.\d+)?', '', strength).strip()
         return unit if unit else "mg"
 
-    def generate_complete_patient_data(self, num_conditions=2, num_observations=3, num_medications=2, num_encounters=1):
-        """生成一個完整的病人資料（包含 Patient、Encounter、Condition、Observation、Medication、MedicationRequest）- 確保不重复"""
+    def _generate_encounters(self, patient_id, patient_name, num_encounters, link_encounters=False):
+        """
+        生成病人的就診記錄
+        
+        Args:
+            link_encounters: 為 True 時先排定就診時間（由早到晚），並回傳供臨床資源引用的就診
+            
+        Returns:
+            (Encounter 列表, [(Encounter ID, 就診時間)]；未連結時為空列表)
+        """
+        encounters, visits = [], []
+        if num_encounters <= 0:
+            return encounters, visits
+        encounter_types = ["outpatient", "outpatient", "outpatient", "emergency", "inpatient"]  # 門診機率較高
+        if link_encounters:
+            visit_dates = sorted(self._now() - timedelta(days=random.randint(1, 180)) for _ in range(num_encounters))
+        else:
+            visit_dates = [None] * num_encounters
+        for visit_date in visit_dates:
+            encounter_type = random.choice(encounter_types)
+            with self.timer.span("generate.Encounter"):
+                encounter = self.generate_encounter(patient_id, patient_name, encounter_type, visit_date)
+            encounters.append(encounter)
+            if link_encounters:
+                visits.append((encounter["id"], visit_date))
+        return encounters, visits
+
+    def generate_complete_patient_data(self, num_conditions=2, num_observations=3, num_medications=2, num_encounters=1,
+                                       patient_index=None, link_encounters=False):
+        """
+        生成一個完整的病人資料（包含 Patient、Encounter、Condition、Observation、Medication、MedicationRequest）- 確保不重复
+        
+        link_encounters 為 True 時先排定病人的就診時間軸，臨床資源在生成當下即引用其中一次就診並使用該次就診的日期
+        """
+        # 病人序號決定 deterministic 策略下的資源 ID
+        self.id_generator.begin_patient(patient_index)
+        self._national_id_index = patient_index
+        self._physiology = self.physiology_model.next_profile()
+        
         # 生成 Patient
-        patient = self.generate_patient()
+        with self.timer.span("generate.Patient"):
+            patient = self.generate_patient()
         patient_id = patient["id"]
         patient_name = patient["name"][0]["text"]
         
         # 生成 Encounters (就診記錄)
-        encounters = []
-        if num_encounters > 0:
-            encounter_types = ["outpatient", "outpatient", "outpatient", "emergency", "inpatient"]  # 門診機率較高
-            for _ in range(num_encounters):
-                encounter_type = random.choice(encounter_types)
-                encounter = self.generate_encounter(patient_id, patient_name, encounter_type)
-                encounters.append(encounter)
+        encounters, visits = self._generate_encounters(patient_id, patient_name, num_encounters, link_encounters)
         
         # 生成不重複的 Conditions
         conditions = []
@@ -816,10 +1193,12 @@ class TWFHIRGeneratorFixed:
                 print(f"⚠️  警告：要求生成 {num_conditions} 個疾病，但只有 {len(self.conditions)} 種疾病類型，將生成全部")
                 num_conditions = len(self.conditions)
             
-            # 隨機選擇不重複的疾病類型
-            selected_conditions = random.sample(self.conditions, num_conditions)
+            # 依年齡層盛行率選擇不重複的疾病類型
+            selected_conditions = self.population_model.sample_conditions(self._get_patient_age(patient), num_conditions)
             for condition_info in selected_conditions:
-                condition = self.generate_condition_with_info(patient_id, patient_name, condition_info)
+                with self.timer.span("generate.Condition"):
+                    condition = self.generate_condition_with_info(
+                        patient_id, patient_name, condition_info, random.choice(visits) if visits else None)
                 conditions.append(condition)
         
         # 生成不重複的 Observations
@@ -832,8 +1211,11 @@ class TWFHIRGeneratorFixed:
             # 隨機選擇不重複的觀察类型
             selected_observations = random.sample(self.observations, num_observations)
             for obs_info in selected_observations:
-                observation = self.generate_observation_with_info(patient_id, patient_name, obs_info)
+                with self.timer.span("generate.Observation"):
+                    observation = self.generate_observation_with_info(
+                        patient_id, patient_name, obs_info, random.choice(visits) if visits else None)
                 observations.append(observation)
+            observations = self._drop_repeated_blood_pressure(observations)
         
         # 生成不重複的 Medications 和 MedicationRequests
         medications = []
@@ -846,16 +1228,20 @@ class TWFHIRGeneratorFixed:
             # 隨機選擇不重複的藥物類型
             selected_medications = random.sample(self.medications, num_medications)
             for med_info in selected_medications:
-                medication = self.generate_medication_with_info(patient_id, patient_name, med_info)
-                medications.append(medication)
+                with self.timer.span("generate.Medication"):
+                    medication = self.generate_medication_with_info(patient_id, patient_name, med_info)
+                if self.medication_mode == "reference":
+                    medications.append(medication)
                 
                 # 為每個藥物生成對應的處方
-                medication_request = self.generate_medication_request(
-                    patient_id, patient_name, medication["id"], medication["code"]["text"]
-                )
+                with self.timer.span("generate.MedicationRequest"):
+                    medication_request = self.generate_medication_request(
+                        patient_id, patient_name, medication["id"], medication["code"]["text"], medication,
+                        random.choice(visits) if visits else None
+                    )
                 medication_requests.append(medication_request)
         
-        return {
+        patient_data = {
             "patient": patient,
             "encounters": encounters,
             "conditions": conditions,
@@ -863,8 +1249,11 @@ class TWFHIRGeneratorFixed:
             "medications": medications,
             "medication_requests": medication_requests
         }
+        record_patient_data(patient_data)
+        return patient_data
 
-    def generate_custom_patient_data(self, selected_conditions=None, selected_observations=None, selected_medications=None, num_encounters=1):
+    def generate_custom_patient_data(self, selected_conditions=None, selected_observations=None, selected_medications=None, num_encounters=1, patient_index=None,
+                                     link_encounters=False):
         """
         生成自定義的單一病人資料
         
@@ -873,23 +1262,23 @@ class TWFHIRGeneratorFixed:
             selected_observations: 指定的觀察項目列表 (可以是索引或觀察代碼)
             selected_medications: 指定的藥物列表 (可以是索引或藥物代碼)
             num_encounters: 要生成的就診記錄數量 (預設1)
+            patient_index: 病人序號 (deterministic ID 策略使用，未指定時自動遞增)
+            link_encounters: 是否讓臨床資源引用本次生成的就診並使用就診日期
             
         Returns:
             完整的病人資料字典
         """
+        self.id_generator.begin_patient(patient_index)
+        self._national_id_index = patient_index
+        self._physiology = self.physiology_model.next_profile()
+        
         # 生成 Patient
         patient = self.generate_patient()
         patient_id = patient["id"]
         patient_name = patient["name"][0]["text"]
         
         # 生成 Encounters (就診記錄)
-        encounters = []
-        if num_encounters > 0:
-            encounter_types = ["outpatient", "outpatient", "outpatient", "emergency", "inpatient"]  # 門診機率較高
-            for _ in range(num_encounters):
-                encounter_type = random.choice(encounter_types)
-                encounter = self.generate_encounter(patient_id, patient_name, encounter_type)
-                encounters.append(encounter)
+        encounters, visits = self._generate_encounters(patient_id, patient_name, num_encounters, link_encounters)
         
         # 處理指定的 Conditions
         conditions = []
@@ -899,17 +1288,20 @@ class TWFHIRGeneratorFixed:
                     # 如果是索引
                     if 0 <= item < len(self.conditions):
                         condition_info = self.conditions[item]
-                        condition = self.generate_condition_with_info(patient_id, patient_name, condition_info)
+                        condition = self.generate_condition_with_info(
+                            patient_id, patient_name, condition_info, random.choice(visits) if visits else None)
                         conditions.append(condition)
                 elif isinstance(item, str):
                     # 如果是代碼，查找對應的疾病
                     condition_info = self._find_condition_by_code(item)
                     if condition_info:
-                        condition = self.generate_condition_with_info(patient_id, patient_name, condition_info)
+                        condition = self.generate_condition_with_info(
+                            patient_id, patient_name, condition_info, random.choice(visits) if visits else None)
                         conditions.append(condition)
                 elif isinstance(item, dict):
                     # 如果直接提供疾病資訊
-                    condition = self.generate_condition_with_info(patient_id, patient_name, item)
+                    condition = self.generate_condition_with_info(
+                        patient_id, patient_name, item, random.choice(visits) if visits else None)
                     conditions.append(condition)
         
         # 處理指定的 Observations
@@ -920,18 +1312,22 @@ class TWFHIRGeneratorFixed:
                     # 如果是索引
                     if 0 <= item < len(self.observations):
                         obs_info = self.observations[item]
-                        observation = self.generate_observation_with_info(patient_id, patient_name, obs_info)
+                        observation = self.generate_observation_with_info(
+                            patient_id, patient_name, obs_info, random.choice(visits) if visits else None)
                         observations.append(observation)
                 elif isinstance(item, str):
                     # 如果是代碼，查找對應的觀察項目
                     obs_info = self._find_observation_by_code(item)
                     if obs_info:
-                        observation = self.generate_observation_with_info(patient_id, patient_name, obs_info)
+                        observation = self.generate_observation_with_info(
+                            patient_id, patient_name, obs_info, random.choice(visits) if visits else None)
                         observations.append(observation)
                 elif isinstance(item, dict):
                     # 如果直接提供觀察資訊
-                    observation = self.generate_observation_with_info(patient_id, patient_name, item)
+                    observation = self.generate_observation_with_info(
+                        patient_id, patient_name, item, random.choice(visits) if visits else None)
                     observations.append(observation)
+            observations = self._drop_repeated_blood_pressure(observations)
         
         # 處理指定的 Medications 和 MedicationRequests
         medications = []
@@ -952,15 +1348,17 @@ class TWFHIRGeneratorFixed:
                 
                 if med_info:
                     medication = self.generate_medication_with_info(patient_id, patient_name, med_info)
-                    medications.append(medication)
+                    if self.medication_mode == "reference":
+                        medications.append(medication)
                     
                     # 為每個藥物生成對應的處方
                     medication_request = self.generate_medication_request(
-                        patient_id, patient_name, medication["id"], medication["code"]["text"]
+                        patient_id, patient_name, medication["id"], medication["code"]["text"], medication,
+                        random.choice(visits) if visits else None
                     )
                     medication_requests.append(medication_request)
         
-        return {
+        patient_data = {
             "patient": patient,
             "encounters": encounters,
             "conditions": conditions,
@@ -968,6 +1366,186 @@ class TWFHIRGeneratorFixed:
             "medications": medications,
             "medication_requests": medication_requests
         }
+        record_patient_data(patient_data)
+        return patient_data
+
+    def generate_longitudinal_patient_data(self, span_days=DEFAULT_SPAN_DAYS, visit_interval_days=DEFAULT_VISIT_INTERVAL_DAYS,
+                                           num_conditions=2, num_medications=2, lab_schedule=None, patient_index=None):
+        """
+        生成縱向病人資料：追蹤期間內的多次門診、每次門診的生命徵象，以及定期檢驗（例如每 3 個月一次 HbA1c）
+        
+        數值為圍繞病人相關生理基準值的隨機漫步（見 longitudinal.py），血壓以每次就診一個 panel 呈現；
+        為了大量生成，這些 Observation 不含 narrative
+        
+        Args:
+            span_days: 追蹤期間（天），結束於今天
+            visit_interval_days: 平均就診間隔（天）
+            num_conditions: 疾病數量
+            num_medications: 藥物數量
+            lab_schedule: 定期檢驗 LOINC 代碼 → 間隔天數，未指定時使用 longitudinal.LAB_SCHEDULE
+            patient_index: 病人在整批資料中的序號
+            
+        Returns:
+            病人資料（格式同 generate_complete_patient_data）
+        """
+        patient_data = self.generate_complete_patient_data(num_conditions, 0, num_medications, 0,
+                                                           patient_index=patient_index)
+        patient_id = patient_data["patient"]["id"]
+        patient_name = patient_data["patient"]["name"][0]["text"]
+        start = self._now() - timedelta(days=span_days)
+        
+        visit_times = visit_schedule(span_days, visit_interval_days)
+        encounters = patient_data["encounters"]
+        for seconds in visit_times:
+            with self.timer.span("generate.Encounter"):
+                encounters.append(self.generate_encounter(
+                    patient_id, patient_name, "outpatient", start + timedelta(seconds=seconds)))
+        
+        if self._observations_by_code is None:
+            self._observations_by_code = {obs_info["code"]: obs_info for obs_info in self.observations}
+        
+        series_start = time.perf_counter()
+        series = build_patient_series(self._observations_by_code, visit_times, span_days,
+                                      lab_schedule=lab_schedule, baselines=self._physiology)
+        observations = patient_data["observations"]
+        visit_encounters = encounters[len(encounters) - len(visit_times):]
+        subject = {"reference": f"Patient/{patient_id}"}
+        
+        # 收縮壓、舒張壓序列合併為每次就診一個血壓 panel
+        blood_pressure = {item.code: item for item in series if item.code in (SYSTOLIC_CODE, DIASTOLIC_CODE)}
+        if len(blood_pressure) == 2:
+            series = [item for item in series if item.code not in blood_pressure]
+            category = self._get_observation_category(SYSTOLIC_CODE)
+            code = {
+                "coding": [{"system": "http://loinc.org", "code": BLOOD_PRESSURE_PANEL_CODE,
+                            "display": "Blood pressure panel with all children optional"}],
+                "text": "血壓"
+            }
+            meta = {"profile": [BLOOD_PRESSURE_PROFILE]}
+            for seconds, systolic, diastolic, encounter in zip(
+                    visit_times, blood_pressure[SYSTOLIC_CODE].values, blood_pressure[DIASTOLIC_CODE].values,
+                    visit_encounters):
+                systolic = int(round(systolic))
+                observations.append({
+                    "resourceType": "Observation",
+                    "id": self.id_generator.new_id("Observation"),
+                    "meta": meta,
+                    "status": "final",
+                    "category": category,
+                    "code": code,
+                    "subject": subject,
+                    "encounter": {"reference": f"Encounter/{encounter['id']}"},
+                    "effectiveDateTime": (start + timedelta(seconds=seconds)).strftime("%Y-%m-%dT%H:%M:%S+08:00"),
+                    "component": self._blood_pressure_components(
+                        systolic, min(int(round(diastolic)), systolic - MIN_PULSE_PRESSURE))
+                })
+        
+        for item in series:
+            obs_info = self._observations_by_code[item.code]
+            is_vital_sign = item.times is visit_times
+            # 同一序列的 Observation 共用不變的 category / code / subject
+            category = self._get_observation_category(item.code)
+            code = {
+                "coding": [{"system": "http://loinc.org", "code": item.code, "display": obs_info["display"]}],
+                "text": obs_info["display"]
+            }
+            if isinstance(obs_info["min_val"], float) or isinstance(obs_info["max_val"], float):
+                digits = 1 if item.code == "8310-5" else 2
+            else:
+                digits = None
+            date_format = "%Y-%m-%dT%H:%M:%S+08:00" if is_vital_sign else "%Y-%m-%d"
+            
+            for i, (seconds, value) in enumerate(zip(item.times, item.values)):
+                observation = {
+                    "resourceType": "Observation",
+                    "id": self.id_generator.new_id("Observation"),
+                    "status": "final",
+                    "category": category,
+                    "code": code,
+                    "subject": subject,
+                    "effectiveDateTime": (start + timedelta(seconds=seconds)).strftime(date_format),
+                    "valueQuantity": {
+                        "value": round(value) if digits is None else round(value, digits),
+                        "unit": obs_info["unit"],
+                        "system": "http://unitsofmeasure.org",
+                        "code": obs_info["ucum_code"]
+                    }
+                }
+                if is_vital_sign:
+                    observation["encounter"] = {"reference": f"Encounter/{visit_encounters[i]['id']}"}
+                observations.append(observation)
+        self.timer.add("generate.Observation", time.perf_counter() - series_start, len(observations))
+        
+        RESOURCES_GENERATED.inc(len(visit_times), "Encounter")
+        RESOURCES_GENERATED.inc(len(observations), "Observation")
+        return patient_data
+
+    def generate_followup_data(self, patient_id, patient_key, visit_dates, observation_infos, medication_infos,
+                               observations_per_visit=3, medication_probability=0.5):
+        """
+        為既有病人生成一段期間內的新就診活動（增量生成使用，不生成 Patient 與 Condition）
+        
+        Args:
+            patient_id: 既有病人的 ID
+            patient_key: deterministic ID 策略的病人鍵，需與原世代及其他增量批次不同
+            visit_dates: 就診時間列表
+            observation_infos: 可選的觀察項目（例如進行中疾病的追蹤檢驗）
+            medication_infos: 可選的藥物
+            observations_per_visit: 每次就診的觀察數
+            medication_probability: 每次就診開立處方的機率
+            
+        Returns:
+            {"patient_id", "encounters", "conditions"（空）, "observations", "medications", "medication_requests"}，
+            所有臨床資源皆引用其所屬的就診
+        """
+        self.id_generator.begin_patient(patient_key)
+        self._physiology = self.physiology_model.next_profile()
+        
+        encounters, observations, medications, medication_requests = [], [], [], []
+        for visit_date in sorted(visit_dates):
+            encounter_type = random.choice(("outpatient", "outpatient", "outpatient", "emergency", "inpatient"))
+            with self.timer.span("generate.Encounter"):
+                encounter = self.generate_encounter(patient_id, patient_id, encounter_type, visit_date)
+            encounters.append(encounter)
+            visit = (encounter["id"], visit_date)
+            
+            visit_observations = []
+            for obs_info in random.sample(observation_infos, min(observations_per_visit, len(observation_infos))):
+                with self.timer.span("generate.Observation"):
+                    visit_observations.append(self.generate_observation_with_info(patient_id, patient_id, obs_info, visit))
+            observations.extend(self._drop_repeated_blood_pressure(visit_observations))
+            
+            if medication_infos and random.random() < medication_probability:
+                with self.timer.span("generate.Medication"):
+                    medication = self.generate_medication_with_info(patient_id, patient_id, random.choice(medication_infos))
+                if self.medication_mode == "reference":
+                    medications.append(medication)
+                with self.timer.span("generate.MedicationRequest"):
+                    medication_requests.append(self.generate_medication_request(
+                        patient_id, patient_id, medication["id"], medication["code"]["text"], medication, visit))
+        
+        followup_data = {
+            "patient_id": patient_id,
+            "encounters": encounters,
+            "conditions": [],
+            "observations": observations,
+            "medications": medications,
+            "medication_requests": medication_requests
+        }
+        for key, resource_type in PATIENT_DATA_RESOURCE_TYPES:
+            if followup_data[key]:
+                RESOURCES_GENERATED.inc(len(followup_data[key]), resource_type)
+        return followup_data
+
+    def _now(self) -> datetime:
+        """生成資料使用的「現在」：指定基準時間時固定為該時間"""
+        return self.reference_time or datetime.now()
+
+    def _get_patient_age(self, patient):
+        """根據 Patient.birthDate 計算基準時間的年齡"""
+        birth_date = datetime.strptime(patient["birthDate"], "%Y-%m-%d")
+        today = self._now()
+        return today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
 
     def _find_condition_by_code(self, code):
         """根據代碼查找疾病"""
@@ -1156,6 +1734,13 @@ class TWFHIRGeneratorFixed:
     def upload_resource_to_server(self, resource, server_url):
         """上傳单個資源到 FHIR 伺服器"""
         resource_type = resource["resourceType"]
+        
+        if self.profile_validator is not None:
+            with self.timer.span(f"validate.{resource_type}"):
+                issues = self.profile_validator.validate(resource)
+            if issues:
+                summary = "; ".join(f"{location}: {message}" for location, message in issues[:3])
+                return False, f"TW Core Profile 驗證失敗 ({len(issues)} 項): {summary}"
         url = f"{server_url}/{resource_type}"
         
         headers = {
@@ -1164,7 +1749,18 @@ class TWFHIRGeneratorFixed:
         }
         
         try:
-            response = requests.post(url, json=resource, headers=headers, timeout=60)  # 增加超時時間到60秒
+            for attempt in range(UPLOAD_MAX_RETRIES + 1):
+                request_start = time.perf_counter()
+                with self.timer.span(f"upload.{resource_type}"):
+                    response = requests.post(url, json=resource, headers=headers, timeout=60)  # 增加超時時間到60秒
+                UPLOAD_LATENCY.observe(time.perf_counter() - request_start, resource_type)
+                UPLOAD_REQUESTS.inc(1, resource_type, str(response.status_code))
+                if response.status_code not in [429, 503] or attempt == UPLOAD_MAX_RETRIES:
+                    break
+                UPLOAD_RETRIES.inc()
+                # 伺服器限流：依 Retry-After 等待後重試
+                retry_after = response.headers.get('Retry-After', '')
+                time.sleep(float(retry_after) if retry_after.replace('.', '', 1).isdigit() else 2 ** attempt)
             
             if response.status_code in [200, 201]:
                 response_data = response.json()
@@ -1174,10 +1770,46 @@ class TWFHIRGeneratorFixed:
                 return False, f"HTTP {response.status_code}: {response.text[:200]}"
                 
         except Exception as e:
+            UPLOAD_REQUESTS.inc(1, resource_type, "error")
             return False, str(e)
 
-    def upload_patient_data_to_server(self, patient_data, server_url):
-        """上傳完整的病人資料到伺服器"""
+    def _medication_exists_on_server(self, server_url, medication_id):
+        """
+        確認快取的 Medication ID 仍存在於伺服器（每次執行每個 ID 只查詢一次）
+        
+        Returns:
+            伺服器回應 404 / 410 時為 False；其他回應或連線失敗時沿用快取
+        """
+        if self.medication_registry.is_verified(server_url, medication_id):
+            return True
+        try:
+            response = requests.get(f"{server_url}/Medication/{medication_id}",
+                                    headers={'Accept': 'application/fhir+json'}, timeout=60)
+        except requests.RequestException:
+            return True
+        if response.status_code in (404, 410):
+            return False
+        if response.status_code == 200:
+            self.medication_registry.mark_verified(server_url, medication_id)
+        return True
+
+    @staticmethod
+    def _remap_encounter_reference(resource, encounter_id_map):
+        """將 encounter 引用改為伺服器配置的 Encounter ID"""
+        if 'encounter' in resource:
+            encounter_id = resource['encounter']['reference'].split('/')[-1]
+            if encounter_id in encounter_id_map:
+                resource['encounter'] = {"reference": f"Encounter/{encounter_id_map[encounter_id]}"}
+
+    def upload_patient_data_to_server(self, patient_data, server_url, existing_patient_id=None):
+        """
+        上傳完整的病人資料到伺服器
+        
+        Args:
+            patient_data: 病人資料；增量資料（generate_followup_data）不含 Patient
+            server_url: FHIR 伺服器 URL
+            existing_patient_id: 病人已存在於伺服器時的 Patient ID，指定時不上傳 Patient
+        """
         results = {
             "patient": None,
             "encounters": [],
@@ -1189,17 +1821,22 @@ class TWFHIRGeneratorFixed:
         }
         
         # 上傳 Patient
-        print(f"📤 上傳 Patient: {patient_data['patient']['name'][0]['text']}")
-        success, result = self.upload_resource_to_server(patient_data['patient'], server_url)
+        if existing_patient_id:
+            success, result = True, existing_patient_id
+        else:
+            print(f"📤 上傳 Patient: {patient_data['patient']['name'][0]['text']}")
+            success, result = self.upload_resource_to_server(patient_data['patient'], server_url)
         
         if success:
             results["patient"] = result
-            print(f"   ✅ Patient 上傳成功，ID: {result}")
+            if not existing_patient_id:
+                print(f"   ✅ Patient 上傳成功，ID: {result}")
             
             # 更新 Patient ID 引用
             new_patient_id = result
             
             # 上傳 Encounters (就診記錄)
+            encounter_id_map = {}
             if 'encounters' in patient_data:
                 for i, encounter in enumerate(patient_data['encounters']):
                     encounter['subject']['reference'] = f"Patient/{new_patient_id}"
@@ -1208,16 +1845,18 @@ class TWFHIRGeneratorFixed:
                     success, result = self.upload_resource_to_server(encounter, server_url)
                     if success:
                         results["encounters"].append(result)
+                        encounter_id_map[encounter['id']] = result
                         print(f"   ✅ Encounter 上傳成功，ID: {result}")
                     else:
                         results["errors"].append(f"Encounter {i+1}: {result}")
                         print(f"   ❌ Encounter 上傳失敗: {result}")
                     
-                    time.sleep(0.5)  # 避免過於頻繁的請求
+                    time.sleep(self.upload_interval)
             
             # 上傳 Conditions
             for i, condition in enumerate(patient_data['conditions']):
                 condition['subject']['reference'] = f"Patient/{new_patient_id}"
+                self._remap_encounter_reference(condition, encounter_id_map)
                 print(f"📤 上傳 Condition {i+1}: {condition['code']['text']}")
                 
                 success, result = self.upload_resource_to_server(condition, server_url)
@@ -1228,11 +1867,12 @@ class TWFHIRGeneratorFixed:
                     results["errors"].append(f"Condition {i+1}: {result}")
                     print(f"   ❌ Condition 上傳失敗: {result}")
                 
-                time.sleep(0.5)  # 避免过于频繁的请求
+                time.sleep(self.upload_interval)
             
             # 上傳 Observations
             for i, observation in enumerate(patient_data['observations']):
                 observation['subject']['reference'] = f"Patient/{new_patient_id}"
+                self._remap_encounter_reference(observation, encounter_id_map)
                 print(f"📤 上傳 Observation {i+1}: {observation['code']['text']}")
                 
                 success, result = self.upload_resource_to_server(observation, server_url)
@@ -1243,32 +1883,61 @@ class TWFHIRGeneratorFixed:
                     results["errors"].append(f"Observation {i+1}: {result}")
                     print(f"   ❌ Observation 上傳失敗: {result}")
                 
-                time.sleep(0.5)
+                time.sleep(self.upload_interval)
             
-            # 上傳 Medications
+            # 上傳 Medications（同一伺服器上已存在的藥物直接重用 ID）
+            medication_id_map = {}
             if 'medications' in patient_data:
                 for i, medication in enumerate(patient_data['medications']):
+                    local_id = medication['id']
+                    if local_id in medication_id_map:
+                        continue
+                    
+                    coding = medication['code']['coding'][0]
+                    med_key = self.medication_registry.key_for_id(local_id) or (coding['system'], coding['code'])
+                    cached_id = self.medication_registry.get_server_id(server_url, med_key)
+                    if cached_id and not self._medication_exists_on_server(server_url, cached_id):
+                        print(f"⚠️  快取的 Medication/{cached_id} 已不存在於伺服器，重新建立")
+                        self.medication_registry.forget_server_id(server_url, med_key)
+                        cached_id = None
+                    if cached_id:
+                        medication_id_map[local_id] = cached_id
+                        results["medications"].append(cached_id)
+                        print(f"♻️  Medication {i+1} 已存在於伺服器，重用 ID: {cached_id}")
+                        continue
+                    
                     print(f"📤 上傳 Medication {i+1}: {medication['code']['text']}")
                     
                     success, result = self.upload_resource_to_server(medication, server_url)
                     if success:
+                        medication_id_map[local_id] = result
+                        self.medication_registry.set_server_id(server_url, med_key, result)
                         results["medications"].append(result)
                         print(f"   ✅ Medication 上傳成功，ID: {result}")
                     else:
                         results["errors"].append(f"Medication {i+1}: {result}")
                         print(f"   ❌ Medication 上傳失敗: {result}")
                     
-                    time.sleep(0.5)
+                    time.sleep(self.upload_interval)
             
             # 上傳 MedicationRequests
             if 'medication_requests' in patient_data:
                 for i, med_request in enumerate(patient_data['medication_requests']):
                     # 更新 Patient 和 Medication 的引用
                     med_request['subject']['reference'] = f"Patient/{new_patient_id}"
-                    if i < len(results["medications"]):
-                        med_request['medicationReference']['reference'] = f"Medication/{results['medications'][i]}"
+                    self._remap_encounter_reference(med_request, encounter_id_map)
+                    local_reference = med_request.get('medicationReference', {}).get('reference', '')
+                    if local_reference.startswith('Medication/'):
+                        local_id = local_reference.split('/', 1)[1]
+                        if local_id in medication_id_map:
+                            med_request['medicationReference']['reference'] = f"Medication/{medication_id_map[local_id]}"
+                        else:
+                            # 對應的 Medication 未能上傳，避免送出懸空引用
+                            results["errors"].append(f"MedicationRequest {i+1}: 對應的 Medication 未上傳成功，已略過")
+                            print(f"   ❌ MedicationRequest {i+1} 略過: 對應的 Medication 未上傳成功")
+                            continue
                     
-                    print(f"📤 上傳 MedicationRequest {i+1}: {med_request['medicationReference']['display']}")
+                    print(f"📤 上傳 MedicationRequest {i+1}: {self._get_medication_request_display(med_request)}")
                     
                     success, result = self.upload_resource_to_server(med_request, server_url)
                     if success:
@@ -1278,7 +1947,7 @@ class TWFHIRGeneratorFixed:
                         results["errors"].append(f"MedicationRequest {i+1}: {result}")
                         print(f"   ❌ MedicationRequest 上傳失敗: {result}")
                 
-                time.sleep(0.5)
+                time.sleep(self.upload_interval)
         else:
             results["errors"].append(f"Patient: {result}")
             print(f"   ❌ Patient 上傳失敗: {result}")
@@ -1513,7 +2182,8 @@ def main():
     """
     主函數 - 修復版的台灣 FHIR 資料生成和上傳
     """
-    generator = TWFHIRGeneratorFixed()
+    timer = StageTimer()
+    generator = TWFHIRGeneratorFixed(timer=timer)
     
     print("🏥 台灣 FHIR 病人資料完整生成器 - 修復版")
     print("=" * 60)
@@ -1610,16 +2280,22 @@ def main():
         num_observations = int(input("請輸入每個病人的觀察記錄數量 (Z，可設為0): ") or "3")
         num_medications = int(input("請輸入每個病人的藥物數量 (M，可設為0): ") or "2")
         
+        if num_medications > 0:
+            print("藥物輸出模式: 1. 獨立 Medication 資源  2. 內嵌 (contained)  3. 僅使用藥物代碼 (CodeableConcept)")
+            mode_input = input("請選擇藥物輸出模式 (1-3): ") or "1"
+            generator.medication_mode = {"2": "contained", "3": "codeable_concept"}.get(mode_input, "reference")
+        
         print(f"\n📋 將生成 {num_patients} 個病人，每人有 {num_conditions} 個疾病、{num_observations} 個觀察記錄和 {num_medications} 個藥物")
         print(f"📊 總計資源: {num_patients} Patient + {num_patients * num_conditions} Condition + {num_patients * num_observations} Observation + {num_patients * num_medications} Medication + {num_patients * num_medications} MedicationRequest")
         
         # 生成資料
         print(f"\n🎲 开始生成資料...")
-        all_patient_data = []
+        all_patient_data = PatientBatch()
+        stage_start = time.perf_counter()
         
         for i in range(num_patients):
             print(f"👤 生成第 {i+1} 個病人...")
-            patient_data = generator.generate_complete_patient_data(num_conditions, num_observations, num_medications)
+            patient_data = generator.generate_complete_patient_data(num_conditions, num_observations, num_medications, patient_index=i)
             all_patient_data.append(patient_data)
             
             patient_name = patient_data['patient']['name'][0]['text']
@@ -1628,6 +2304,7 @@ def main():
             print(f"   觀察: {len(patient_data['observations'])} 個")
             print(f"   藥物: {len(patient_data['medications'])} 個")
             print(f"   處方: {len(patient_data['medication_requests'])} 個")
+        timer.add("generation", time.perf_counter() - stage_start)
         
         # 儲存到檔案
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -1637,19 +2314,11 @@ def main():
         filename = f"tw_complete_patients_fixed_{timestamp}.json"
         filepath = output_dir / filename
         
-        # 转换为可儲存的格式
-        save_data = []
-        for data in all_patient_data:
-            save_data.append({
-                "patient": data["patient"],
-                "conditions": data["conditions"],
-                "observations": data["observations"],
-                "medications": data["medications"],
-                "medication_requests": data["medication_requests"]
-            })
-        
+        # 只寫入可儲存的資源清單，逐位病人還原與序列化
         with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(save_data, f, ensure_ascii=False, indent=2)
+            all_patient_data.write_json(f, keys=("patient", "conditions", "observations", "medications",
+                                                 "medication_requests"), timer=timer)
+        BYTES_WRITTEN.inc(filepath.stat().st_size)
         
         print(f"\n💾 資料已儲存到: {filepath}")
         
@@ -1670,6 +2339,7 @@ def main():
             server_url = input("請輸入 FHIR 伺服器地址: ")
         else:
             print("✅ 資料生成完成，未上傳到伺服器")
+            print(f"\n⏱️  各階段耗時:\n{timer.format_summary()}")
             return
         
         print(f"\n🌐 目標伺服器: {server_url}")
@@ -1683,11 +2353,13 @@ def main():
         # 開始上傳
         print(f"\n📤 開始上傳修復版資料到伺服器...")
         upload_results = []
+        stage_start = time.perf_counter()
         
-        for i, patient_data in enumerate(all_patient_data):
+        for i, patient_data in enumerate(all_patient_data.patient_data()):
             print(f"\n👤 上傳第 {i+1}/{num_patients} 個病人...")
             result = generator.upload_patient_data_to_server(patient_data, server_url)
             upload_results.append(result)
+        timer.add("upload", time.perf_counter() - stage_start)
         
         # 统计上傳结果
         successful_patients = sum(1 for r in upload_results if r["patient"])
@@ -1720,10 +2392,12 @@ def main():
                     "medication_requests": total_medication_requests,
                     "errors": total_errors
                 },
+                "timing": timer.summary(),
                 "results": upload_results
             }, f, ensure_ascii=False, indent=2)
         
         print(f"📁 上傳結果已儲存: {upload_result_file}")
+        print(f"\n⏱️  各階段耗時:\n{timer.format_summary()}")
         
         if successful_patients > 0:
             print(f"\n🎉 修復版上傳成功！您可以訪問:")
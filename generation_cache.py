@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+生成結果快取模組
+以 (生成器程式版本, 目錄與術語套件內容, 參數, 種子) 的雜湊為鍵保存已生成的輸出檔；
+相同的固定資料請求直接取回先前的檔案，快取超過容量上限時刪除最久未使用的項目（LRU）
+
+只有指定種子且使用 deterministic ID 策略的請求會使用快取；其他請求的輸出（資料或 ID）本來就不可重現
+"""
+
+import ast
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from metrics import CACHE_LOOKUPS
+
+# 預設快取目錄與容量上限（位元組）
+CACHE_DIR = Path("output/cache")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+# 產生輸出的進入點模組；連同它們（遞迴）匯入的專案模組一起雜湊，任一內容改變時既有快取自動失效
+GENERATOR_ENTRY_MODULES = ("generate_TW_patients.py", "batch_cli.py", "app.py")
+
+# TW Core IG 套件目錄（地址郵遞區號、ConceptMap 等術語內容會影響輸出）
+PACKAGE_DIR = "package"
+
+# 每個快取項目目錄中的描述檔
+ENTRY_FILE = "entry.json"
+
+
+def _digest_files(paths: Iterable[Path]) -> str:
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(path.name.encode("utf-8") + b"\0")
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def generator_modules(base: Path, entry_modules: Iterable[str] = GENERATOR_ENTRY_MODULES) -> List[Path]:
+    """
+    由進入點模組解析 import 敘述，找出所有（遞迴）匯入的專案模組
+
+    Returns:
+        依檔名排序的模組路徑
+    """
+    found = {}
+    pending = [base / name for name in entry_modules]
+    while pending:
+        path = pending.pop()
+        if path.name in found or not path.exists():
+            continue
+        found[path.name] = path
+        tree = ast.parse(path.read_bytes(), filename=str(path))
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            pending.extend(base / f"{name.split('.')[0]}.py" for name in names)
+    return [found[name] for name in sorted(found)]
+
+
+@lru_cache(maxsize=1)
+def generator_version() -> str:
+    """生成器程式碼的雜湊（同一程序內只計算一次）"""
+    return _digest_files(generator_modules(Path(__file__).resolve().parent))
+
+
+def catalog_version(config_dir: str = "config") -> str:
+    """設定目錄中所有 JSON 目錄檔內容的雜湊"""
+    return _digest_files(sorted(Path(config_dir).glob("*.json")))
+
+
+# (套件目錄, 各檔案 (名稱, mtime_ns, 大小)) → 內容雜湊；檔案狀態未變時不重新讀取 19 MB 的套件
+_package_digests: Dict[Tuple[str, Tuple], str] = {}
+
+
+def package_version(package_dir: str = PACKAGE_DIR) -> Optional[str]:
+    """
+    IG 套件所有檔案內容的雜湊（含 .index.json）
+
+    Returns:
+        十六進位字串；套件不存在時為 None
+    """
+    directory = Path(package_dir)
+    if not directory.is_dir():
+        return None
+    paths = sorted(path for path in directory.iterdir() if path.is_file())
+    stats = tuple((path.name, path.stat().st_mtime_ns, path.stat().st_size) for path in paths)
+    key = (str(directory.resolve()), stats)
+    if key not in _package_digests:
+        _package_digests.clear()
+        _package_digests[key] = _digest_files(paths)
+    return _package_digests[key]
+
+
+def cache_key(parameters: Mapping[str, Any], seed: int, config_dir: str = "config") -> str:
+    """
+    計算生成請求的快取鍵
+
+    Args:
+        parameters: 影響輸出的所有參數（需可 JSON 序列化）
+        seed: 隨機種子
+        config_dir: 設定目錄
+
+    Returns:
+        SHA-256 十六進位字串
+    """
+    payload = json.dumps({
+        "generator": generator_version(),
+        "catalog": catalog_version(config_dir),
+        "package": package_version(),
+        "parameters": parameters,
+        "seed": seed
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """以目錄保存的生成結果快取：每個鍵一個子目錄，內含輸出檔與 entry.json"""
+
+    def __init__(self, directory: Path = CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Args:
+            directory: 快取目錄
+            max_bytes: 容量上限，超過時依最後使用時間淘汰
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.directory / key
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        查詢快取，命中時更新最後使用時間
+
+        Returns:
+            項目描述（"files" 為 角色 → 檔案路徑，"meta" 為寫入時附帶的資訊）；未命中為 None
+        """
+        entry_path = self._entry_dir(key) / ENTRY_FILE
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(entry_path)
+        except (OSError, ValueError):
+            CACHE_LOOKUPS.inc(1, "miss")
+            return None
+        entry["files"] = {role: entry_path.parent / role for role in entry["files"]}
+        if not all(path.exists() for path in entry["files"].values()):
+            CACHE_LOOKUPS.inc(1, "miss")
+            return None
+        CACHE_LOOKUPS.inc(1, "hit")
+        return entry
+
+    def put(self, key: str, files: Mapping[str, Path], meta: Optional[Mapping[str, Any]] = None) -> Path:
+        """
+        將輸出檔複製到快取；先寫到暫存目錄再改名，其他程序不會讀到寫到一半的項目
+
+        Args:
+            key: cache_key() 的結果
+            files: 角色 → 輸出檔路徑，例如 {"data": ..., "index": ...}
+            meta: 命中時需要的附帶資訊（病人數、資源數等）
+
+        Returns:
+            快取項目目錄
+        """
+        entry_dir = self._entry_dir(key)
+        staging = self.directory / f".{key}.{os.getpid()}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        for role, path in files.items():
+            shutil.copyfile(path, staging / role)
+        with open(staging / ENTRY_FILE, 'w', encoding='utf-8') as f:
+            json.dump({
+                "key": key,
+                "files": {role: Path(path).name for role, path in files.items()},
+                "meta": dict(meta or {}),
+                "created_at": datetime.now().astimezone().isoformat(timespec="seconds")
+            }, f, ensure_ascii=False, indent=2)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        try:
+            staging.rename(entry_dir)
+        except OSError:
+            # 其他程序同時寫入了相同的鍵，內容相同，保留對方的結果
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict(keep=key)
+        return entry_dir
+
+    @staticmethod
+    def restore(entry: Mapping[str, Any], role: str, destination: Path) -> Path:
+        """將快取項目中的檔案複製到輸出位置"""
+        destination = Path(destination)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(entry["files"][role], destination)
+        return destination
+
+    def _entries(self):
+        """(最後使用時間, 大小, 目錄) 列表"""
+        entries = []
+        if not self.directory.exists():
+            return entries
+        for entry_dir in self.directory.iterdir():
+            entry_path = entry_dir / ENTRY_FILE
+            if entry_dir.name.startswith(".") or not entry_path.exists():
+                continue
+            try:
+                size = sum(path.stat().st_size for path in entry_dir.iterdir())
+                entries.append((entry_path.stat().st_mtime, size, entry_dir))
+            except OSError:
+                continue
+        return entries
+
+    def size(self) -> int:
+        """快取目前佔用的位元組數"""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """
+        刪除最久未使用的項目直到低於容量上限
+
+        Args:
+            keep: 不刪除的鍵（剛寫入的項目）
+
+        Returns:
+            刪除的項目數
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, entry_dir in entries:
+            if total <= self.max_bytes:
+                break
+            if entry_dir.name == keep:
+                continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        """清空快取"""
+        shutil.rmtree(self.directory, ignore_errors=True)
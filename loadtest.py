@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Web API 負載測試模組
+依設定的比例重複呼叫 app.py 的各個端點（Flask test client 或對本地伺服器發送真實 HTTP 請求），
+回報整體吞吐量與各路由的 p50/p95/p99 延遲
+
+使用方法:
+    python loadtest.py                                   # 以 Flask test client 測試預設組合
+    python loadtest.py --requests 2000 --concurrency 8   # 指定總請求數與並行數
+    python loadtest.py --mix search=5,statistics=1       # 自訂各路由比例
+    python loadtest.py --url http://localhost:5000       # 對執行中的伺服器發送 HTTP 請求
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmark import percentile
+
+SEARCH_QUERIES = ("糖尿病", "高血壓", "血糖", "血壓", "aspirin", "心臟", "膽固醇", "感冒")
+
+# 路由名稱 → (預設比例, HTTP 方法, 路徑)
+ROUTES = {
+    "search": (30, "GET", "/api/search"),
+    "conditions": (25, "GET", "/api/conditions"),
+    "statistics": (20, "GET", "/api/statistics"),
+    "generate_custom": (20, "POST", "/generate_custom"),
+    "generate": (5, "POST", "/generate")
+}
+
+
+def _build_request(route: str, rng: random.Random) -> Tuple[str, str, Dict[str, Any]]:
+    """建立單一請求: (方法, 路徑, 請求參數)"""
+    _, method, path = ROUTES[route]
+    if route == "search":
+        return method, path, {"params": {"query": rng.choice(SEARCH_QUERIES), "type": "all"}}
+    if route == "conditions":
+        return method, path, {"params": {"limit": 20}}
+    if route == "generate_custom":
+        return method, path, {"json": {
+            "conditions": rng.sample(range(10), 2),
+            "observations": rng.sample(range(10), 3),
+            "medications": rng.sample(range(10), 2)
+        }}
+    if route == "generate":
+        return method, path, {"data": {"num_patients": 2, "server_choice": "none"}}
+    return method, path, {}
+
+
+class _TestClientTransport:
+    """以 Flask test client 在同一程序內呼叫"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def send(self, method: str, path: str, options: Dict[str, Any]) -> int:
+        response = self.client.open(path, method=method, query_string=options.get("params"),
+                                    json=options.get("json"), data=options.get("data"))
+        response.get_data()
+        return response.status_code
+
+
+class _HTTPTransport:
+    """對執行中的伺服器發送 HTTP 請求"""
+
+    def __init__(self, base_url: str):
+        import requests
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def send(self, method: str, path: str, options: Dict[str, Any]) -> int:
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=60, **options)
+            return response.status_code
+        except Exception:
+            return 0
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """解析 "search=5,statistics=1" 形式的路由比例"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ROUTES:
+            raise ValueError(f"未知的路由: {name}（可用: {', '.join(ROUTES)}）")
+        mix[name] = float(weight) if weight else 1.0
+    return mix
+
+
+def run_load_test(total_requests: int = 500, concurrency: int = 4, mix: Optional[Dict[str, float]] = None,
+                  base_url: Optional[str] = None, duration: Optional[float] = None,
+                  seed: Optional[int] = None) -> Dict[str, Any]:
+    """
+    執行負載測試
+
+    Args:
+        total_requests: 總請求數（指定 duration 時為上限）
+        concurrency: 並行的工作執行緒數
+        mix: 路由比例，未指定時使用 ROUTES 的預設比例
+        base_url: 伺服器 URL；未指定時以 Flask test client 在程序內測試
+        duration: 測試時間上限（秒）
+        seed: 隨機種子
+
+    Returns:
+        整體與各路由的吞吐量、延遲百分位數與狀態碼統計
+    """
+    mix = mix or {name: weight for name, (weight, _, _) in ROUTES.items()}
+    routes, weights = list(mix), list(mix.values())
+
+    if base_url:
+        def make_transport():
+            return _HTTPTransport(base_url)
+    else:
+        from app import app
+
+        def make_transport():
+            return _TestClientTransport(app)
+
+    samples: List[Tuple[str, int, float]] = []
+    samples_lock = threading.Lock()
+    remaining = [total_requests]
+    deadline = time.perf_counter() + duration if duration else None
+
+    def worker(worker_index: int):
+        rng = random.Random(None if seed is None else seed + worker_index)
+        transport = make_transport()
+        local_samples = []
+        while True:
+            with samples_lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            if deadline and time.perf_counter() > deadline:
+                break
+            route = rng.choices(routes, weights)[0]
+            method, path, options = _build_request(route, rng)
+            start = time.perf_counter()
+            status = transport.send(method, path, options)
+            local_samples.append((route, status, time.perf_counter() - start))
+        with samples_lock:
+            samples.extend(local_samples)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    def summarize(route_samples):
+        latencies = sorted(latency for _, _, latency in route_samples)
+        statuses: Dict[str, int] = {}
+        for _, status, _ in route_samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return {
+            "requests": len(route_samples),
+            "requests_per_second": round(len(route_samples) / elapsed, 1) if elapsed else 0.0,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 50) * 1000, 2),
+                "p95": round(percentile(latencies, 95) * 1000, 2),
+                "p99": round(percentile(latencies, 99) * 1000, 2),
+                "max": round(latencies[-1] * 1000, 2) if latencies else 0.0
+            },
+            "status": statuses
+        }
+
+    return {
+        "target": base_url or "flask-test-client",
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "total": summarize(samples),
+        "routes": {route: summarize([s for s in samples if s[0] == route]) for route in routes}
+    }
+
+
+def print_report(result: Dict[str, Any]):
+    """以表格輸出負載測試結果"""
+    total = result["total"]
+    print(f"\n📊 {result['target']}，並行 {result['concurrency']}，{result['elapsed_seconds']} 秒")
+    print(f"{'路由':<18}{'請求數':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  狀態碼")
+    for name, summary in list(result["routes"].items()) + [("total", total)]:
+        latency = summary["latency_ms"]
+        print(f"{name:<18}{summary['requests']:>8}{summary['requests_per_second']:>10.1f}"
+              f"{latency['p50']:>10.2f}{latency['p95']:>10.2f}{latency['p99']:>10.2f}  {summary['status']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Web API 負載測試 / Load test for the web endpoints')
+    parser.add_argument('--url', help='伺服器 URL（未指定時以 Flask test client 在程序內測試）')
+    parser.add_argument('--requests', type=int, help='總請求數（預設 500；指定 --duration 時不限）')
+    parser.add_argument('--duration', type=float, help='測試時間上限（秒）')
+    parser.add_argument('--concurrency', type=int, default=4, help='並行數')
+    parser.add_argument('--mix', help=f'路由比例，例如 search=5,statistics=1（可用: {", ".join(ROUTES)}）')
+    parser.add_argument('--seed', type=int, help='隨機種子')
+    parser.add_argument('--json', action='store_true', help='以 JSON 輸出結果')
+    args = parser.parse_args()
+
+    total_requests = args.requests or (10 ** 9 if args.duration else 500)
+    result = run_load_test(total_requests, args.concurrency, parse_mix(args.mix) if args.mix else None,
+                           args.url, args.duration, args.seed)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
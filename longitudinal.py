@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+縱向時間序列模組
+在一段追蹤期間內為病人排定就診與定期檢驗，並以圍繞病人基準值的均值回歸隨機漫步產生數值；
+時間與數值以 array('d') 欄位保存，供生成器批次轉換為 Observation 或直接供分析使用
+"""
+
+import bisect
+import random
+from array import array
+from itertools import accumulate
+from typing import Any, Dict, List, Mapping, Optional
+
+SECONDS_PER_DAY = 86400
+
+# 預設追蹤期間（天）與平均就診間隔（天）
+DEFAULT_SPAN_DAYS = 5 * 365
+DEFAULT_VISIT_INTERVAL_DAYS = 30
+
+# 每次就診都量測的生命徵象 LOINC 代碼 → 每步漂移量（相對於參考範圍寬度）
+VISIT_VITAL_SIGNS = {
+    "8302-2": 0.002,  # 身高幾乎不變
+    "29463-7": 0.02,  # 體重
+    "8480-6": 0.08,   # 收縮壓
+    "8462-4": 0.08,   # 舒張壓
+    "8867-4": 0.10,   # 心跳
+    "8310-5": 0.15,   # 體溫
+    "9279-1": 0.10,   # 呼吸速率
+    "2710-2": 0.10    # 血氧飽和度
+}
+
+# 定期檢驗 LOINC 代碼 → 檢驗間隔（天）
+LAB_SCHEDULE = {
+    "17856-6": 90,   # HbA1c 每 3 個月
+    "1558-6": 90,    # 空腹血糖
+    "2093-3": 180,   # 總膽固醇
+    "2089-1": 180,   # LDL
+    "2160-0": 180,   # 肌酸酐
+    "718-7": 365     # 血色素
+}
+# 定期檢驗日期的前後浮動（天）
+LAB_JITTER_DAYS = 7
+# 定期檢驗的每步漂移量
+LAB_STEP = 0.08
+
+# 均值回歸係數：每一步向基準值拉回的比例
+WALK_REVERSION = 0.1
+# 數值可超出參考範圍的比例（相對於範圍寬度），超出部分截斷
+WALK_MARGIN = 0.25
+
+
+class Series:
+    """單一項目的時間序列：times 為距追蹤起點的秒數，values 為數值"""
+
+    __slots__ = ("code", "times", "values")
+
+    def __init__(self, code: str, times: array, values: array):
+        self.code = code
+        self.times = times
+        self.values = values
+
+    def __len__(self):
+        return len(self.times)
+
+
+def visit_schedule(span_days: float, mean_interval_days: float) -> array:
+    """
+    排定就診時間（就診間隔為指數分布）
+
+    Returns:
+        距追蹤起點的秒數，由小到大
+    """
+    span = span_days * SECONDS_PER_DAY
+    rate = 1 / (mean_interval_days * SECONDS_PER_DAY)
+    # 預先抽出足夠的間隔再一次累加，超過追蹤期間的部分捨棄
+    expected = int(span_days / mean_interval_days * 1.5) + 8
+    times = array('d', accumulate(random.expovariate(rate) for _ in range(expected)))
+    while times[-1] < span:
+        last = times[-1]
+        times.extend(last + offset for offset in accumulate(random.expovariate(rate) for _ in range(expected)))
+    return times[:bisect.bisect_left(times, span)]
+
+
+def periodic_schedule(span_days: float, interval_days: float, jitter_days: float = LAB_JITTER_DAYS) -> array:
+    """
+    排定定期檢驗時間（固定間隔加上前後浮動）
+
+    Returns:
+        距追蹤起點的秒數，由小到大
+    """
+    count = int(span_days // interval_days)
+    first = random.uniform(0, interval_days)
+    return array('d', sorted(
+        min(span_days, max(0.0, first + i * interval_days + random.uniform(-jitter_days, jitter_days))) * SECONDS_PER_DAY
+        for i in range(count)
+    ))
+
+
+def random_walk(count: int, baseline: float, step: float, low: float, high: float,
+                reversion: float = WALK_REVERSION) -> array:
+    """
+    均值回歸隨機漫步: x[t] = baseline + (1 - reversion) * (x[t-1] - baseline) + N(0, step)
+
+    Args:
+        count: 點數
+        baseline: 病人基準值
+        step: 每步雜訊標準差
+        low: 數值下限
+        high: 數值上限
+        reversion: 均值回歸係數
+
+    Returns:
+        數值序列
+    """
+    if count <= 0:
+        return array('d')
+    keep = 1 - reversion
+    noise = [random.gauss(0, step) for _ in range(count - 1)]
+    walk = accumulate(noise, lambda previous, eps: baseline + keep * (previous - baseline) + eps, initial=baseline)
+    return array('d', (low if value < low else high if value > high else value for value in walk))
+
+
+def _walk_for(obs_info: Mapping[str, Any], count: int, step_fraction: float,
+              baseline: Optional[float] = None) -> array:
+    low, high = float(obs_info["min_val"]), float(obs_info["max_val"])
+    width = high - low
+    if baseline is None:
+        baseline = random.uniform(low, high)
+    return random_walk(count, baseline, width * step_fraction,
+                       max(0.0, low - width * WALK_MARGIN), high + width * WALK_MARGIN)
+
+
+def build_patient_series(observations_by_code: Mapping[str, Mapping[str, Any]], visit_times: array,
+                         span_days: float, vital_signs: Optional[Mapping[str, float]] = None,
+                         lab_schedule: Optional[Mapping[str, float]] = None,
+                         baselines: Optional[Mapping[str, float]] = None) -> List[Series]:
+    """
+    建立一位病人的所有時間序列
+
+    Args:
+        observations_by_code: LOINC 代碼 → 觀察項目設定（需有 min_val / max_val）
+        visit_times: 就診時間（距追蹤起點的秒數）
+        span_days: 追蹤期間（天）
+        vital_signs: 每次就診量測的項目 → 每步漂移量，預設 VISIT_VITAL_SIGNS
+        lab_schedule: 定期檢驗項目 → 間隔天數，預設 LAB_SCHEDULE
+        baselines: 病人基準值（例如 PhysiologyModel.next_profile()），未列出的項目在參考範圍內隨機取基準值
+
+    Returns:
+        各項目的 Series（目錄中不存在的代碼略過）
+    """
+    vital_signs = VISIT_VITAL_SIGNS if vital_signs is None else vital_signs
+    lab_schedule = LAB_SCHEDULE if lab_schedule is None else lab_schedule
+    baselines = baselines or {}
+
+    series = []
+    for code, step_fraction in vital_signs.items():
+        obs_info = observations_by_code.get(code)
+        if obs_info is not None and len(visit_times):
+            series.append(Series(code, visit_times, _walk_for(obs_info, len(visit_times), step_fraction,
+                                                              baselines.get(code))))
+    for code, interval_days in lab_schedule.items():
+        obs_info = observations_by_code.get(code)
+        if obs_info is None:
+            continue
+        times = periodic_schedule(span_days, interval_days)
+        if len(times):
+            series.append(Series(code, times, _walk_for(obs_info, len(times), LAB_STEP, baselines.get(code))))
+    return series
+
+
+def series_to_columns(series: List[Series]) -> Dict[str, Dict[str, array]]:
+    """將 Series 清單轉為 {代碼: {"times": ..., "values": ...}}，供分析使用"""
+    return {item.code: {"times": item.times, "values": item.values} for item in series}
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+藥物資源登錄器模組
+同一藥物目錄項目在一次執行中只建立一個 Medication，並記住各伺服器上已上傳的 ID；
+快取的 ID 每次執行第一次使用前會向伺服器確認仍然存在（公開測試伺服器會定期清除資料）
+"""
+
+import json
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Any, Optional, Set, Tuple
+
+# 跨執行個體共用的檔案鎖，避免 Web 背景執行緒與 CLI 同時寫入快取檔
+_cache_lock = threading.Lock()
+
+
+class MedicationRegistry:
+    """藥物資源登錄器"""
+
+    def __init__(self, cache_file: str = "output/medication_server_ids.json"):
+        """
+        初始化藥物資源登錄器
+
+        Args:
+            cache_file: 伺服器 ID 快取檔案路徑（以伺服器與藥物代碼為鍵）
+        """
+        self.cache_file = Path(cache_file)
+        self._medications: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._keys_by_id: Dict[str, Tuple[str, str]] = {}
+        self._server_ids: Optional[Dict[str, Dict[str, str]]] = None
+        # 本次執行已向伺服器確認存在的 (伺服器, ID)
+        self._verified: Set[Tuple[str, str]] = set()
+
+    @staticmethod
+    def medication_key(med_info: Dict[str, Any]) -> Tuple[str, str]:
+        """藥物目錄項目的唯一鍵 (system, code)"""
+        return med_info["system"], med_info["code"]
+
+    def get_or_create(self, med_info: Dict[str, Any],
+                      builder: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        取得藥物目錄項目對應的 Medication，第一次使用時才建立
+
+        Args:
+            med_info: 藥物目錄項目
+            builder: 建立 Medication 資源的函式
+
+        Returns:
+            本次執行共用的 Medication 資源
+        """
+        key = self.medication_key(med_info)
+        medication = self._medications.get(key)
+        if medication is None:
+            medication = builder(med_info)
+            self._medications[key] = medication
+            self._keys_by_id[medication["id"]] = key
+        return medication
+
+    def clear(self):
+        """清除已建立的 Medication（伺服器 ID 快取保留）"""
+        self._medications.clear()
+        self._keys_by_id.clear()
+
+    def get_medications(self):
+        """本次執行已建立的所有 Medication"""
+        return list(self._medications.values())
+
+    def key_for_id(self, medication_id: str) -> Optional[Tuple[str, str]]:
+        """根據本機 Medication ID 反查藥物鍵"""
+        return self._keys_by_id.get(medication_id)
+
+    def _load_server_ids(self) -> Dict[str, Dict[str, str]]:
+        """延遲載入伺服器 ID 快取"""
+        if self._server_ids is None:
+            self._server_ids = {}
+            if self.cache_file.exists():
+                try:
+                    with open(self.cache_file, 'r', encoding='utf-8') as f:
+                        self._server_ids = json.load(f)
+                except (json.JSONDecodeError, OSError) as e:
+                    print(f"⚠️  藥物 ID 快取讀取失敗，將重新建立: {e}")
+        return self._server_ids
+
+    @staticmethod
+    def _cache_code(key: Tuple[str, str]) -> str:
+        return f"{key[0]}|{key[1]}"
+
+    def get_server_id(self, server_url: str, key: Tuple[str, str]) -> Optional[str]:
+        """
+        查詢藥物在指定伺服器上的 ID
+
+        Args:
+            server_url: FHIR 伺服器地址
+            key: 藥物鍵 (system, code)
+
+        Returns:
+            伺服器端 Medication ID，尚未上傳則為 None
+        """
+        server_ids = self._load_server_ids()
+        return server_ids.get(server_url.rstrip('/'), {}).get(self._cache_code(key))
+
+    def set_server_id(self, server_url: str, key: Tuple[str, str], server_id: str):
+        """記錄藥物在指定伺服器上的 ID 並寫回快取檔"""
+        server_ids = self._load_server_ids()
+        server_ids.setdefault(server_url.rstrip('/'), {})[self._cache_code(key)] = server_id
+        self._save_server_ids()
+
+    def is_verified(self, server_url: str, server_id: str) -> bool:
+        """快取的 ID 在本次執行中是否已向伺服器確認存在"""
+        return (server_url.rstrip('/'), server_id) in self._verified
+
+    def mark_verified(self, server_url: str, server_id: str):
+        self._verified.add((server_url.rstrip('/'), server_id))
+
+    def forget_server_id(self, server_url: str, key: Tuple[str, str]):
+        """清除單一藥物在指定伺服器上的快取 ID（例如伺服器已刪除該 Medication）"""
+        server = server_url.rstrip('/')
+        server_ids = self._load_server_ids()
+        server_ids.get(server, {}).pop(self._cache_code(key), None)
+        self._save_server_ids(drop_entry=(server, self._cache_code(key)))
+
+    def forget_server(self, server_url: str):
+        """清除指定伺服器的快取（例如伺服器資料已重置）"""
+        server_ids = self._load_server_ids()
+        server_ids.pop(server_url.rstrip('/'), None)
+        self._verified = {item for item in self._verified if item[0] != server_url.rstrip('/')}
+        self._save_server_ids(drop_server=server_url.rstrip('/'))
+
+    def _save_server_ids(self, drop_server: Optional[str] = None, drop_entry: Optional[Tuple[str, str]] = None):
+        """合併其他執行個體的寫入後，原子性寫入快取檔（drop_server / drop_entry 不從檔案合併回來）"""
+        with _cache_lock:
+            if self.cache_file.exists():
+                try:
+                    with open(self.cache_file, 'r', encoding='utf-8') as f:
+                        on_disk = json.load(f)
+                    for server, ids in on_disk.items():
+                        if server == drop_server:
+                            continue
+                        merged = dict(ids)
+                        if drop_entry is not None and server == drop_entry[0]:
+                            merged.pop(drop_entry[1], None)
+                        merged.update(self._server_ids.get(server, {}))
+                        self._server_ids[server] = merged
+                except (json.JSONDecodeError, OSError):
+                    pass
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.cache_file.with_suffix('.tmp')
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self._server_ids, f, ensure_ascii=False, indent=2)
+            tmp_file.replace(self.cache_file)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+執行期指標模組
+以程序內的計數器、量表與直方圖記錄生成與上傳的遙測資料，並輸出 Prometheus 文字格式（/metrics）
+"""
+
+import bisect
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+# 上傳延遲直方圖的區間上限（秒）
+UPLOAD_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 病人資料中各資源清單對應的資源類型
+PATIENT_DATA_RESOURCE_TYPES = (
+    ("encounters", "Encounter"),
+    ("conditions", "Condition"),
+    ("observations", "Observation"),
+    ("medications", "Medication"),
+    ("medication_requests", "MedicationRequest")
+)
+
+
+def _format_labels(label_names: Sequence[str], label_values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    """指標基底類別：每個指標一把鎖，只在更新數值時短暫持有"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"
+                for labels, value in values]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """只增不減的計數器"""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, *label_values: str):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+
+class Gauge(Counter):
+    """可增可減的量表"""
+
+    type = "gauge"
+
+    def dec(self, amount: float = 1, *label_values: str):
+        self.inc(-amount, *label_values)
+
+    def set(self, value: float, *label_values: str):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(_Metric):
+    """累積區間直方圖"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = UPLOAD_LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # labels → [各區間計數..., +Inf 計數, 總和]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            series_items = sorted((labels, list(series)) for labels, series in self._series.items())
+        lines = []
+        for labels, series in series_items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                bucket_labels = _format_labels(self.label_names, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """指標登錄器"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"指標名稱重複: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = UPLOAD_LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> str:
+        """輸出 Prometheus 文字格式 (version 0.0.4)"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+PATIENTS_GENERATED = REGISTRY.counter(
+    "twcore_patients_generated_total", "已生成的病人數")
+RESOURCES_GENERATED = REGISTRY.counter(
+    "twcore_resources_generated_total", "已生成的 FHIR 資源數", ("resource_type",))
+BYTES_WRITTEN = REGISTRY.counter(
+    "twcore_bytes_written_total", "寫入輸出檔案的位元組數")
+UPLOAD_REQUESTS = REGISTRY.counter(
+    "twcore_upload_requests_total", "上傳請求數（依資源類型與 HTTP 狀態碼，連線失敗為 error）",
+    ("resource_type", "status"))
+UPLOAD_LATENCY = REGISTRY.histogram(
+    "twcore_upload_latency_seconds", "單次上傳請求延遲（秒）", ("resource_type",))
+UPLOAD_RETRIES = REGISTRY.counter(
+    "twcore_upload_retries_total", "因 429 / 503 而重試的上傳請求數")
+QUEUE_DEPTH = REGISTRY.gauge(
+    "twcore_generation_queue_depth", "進行中任務尚待生成的病人數")
+ACTIVE_JOBS = REGISTRY.gauge(
+    "twcore_active_jobs", "進行中的生成任務數", ("kind",))
+CACHE_LOOKUPS = REGISTRY.counter(
+    "twcore_generation_cache_lookups_total", "生成快取查詢次數（hit / miss）", ("result",))
+
+
+def record_patient_data(patient_data: Dict) -> None:
+    """記錄一位病人資料中各類資源的生成數量"""
+    PATIENTS_GENERATED.inc()
+    RESOURCES_GENERATED.inc(1, "Patient")
+    for key, resource_type in PATIENT_DATA_RESOURCE_TYPES:
+        count = len(patient_data.get(key, ()))
+        if count:
+            RESOURCES_GENERATED.inc(count, resource_type)
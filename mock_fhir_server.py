@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+本地模擬 FHIR 伺服器
+在背景執行緒中啟動輕量的 FHIR 伺服器（create / update / read / batch / transaction），
+可設定延遲分布、錯誤率、429 限流與斷線，用於離線測量上傳效能
+
+使用方法:
+    python mock_fhir_server.py --port 8090                       # 啟動伺服器
+    python mock_fhir_server.py --bench --patients 20 --error-rate 0.05   # 上傳效能測試
+"""
+
+import argparse
+import json
+import math
+import random
+import socket
+import threading
+import time
+import uuid
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+# 支援的延遲分布
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+
+
+class FaultProfile:
+    """延遲與故障注入設定"""
+
+    def __init__(self, latency_ms=0.0, distribution="fixed", latency_sigma=0.5, error_rate=0.0,
+                 throttle_rate=0.0, retry_after=0.0, drop_rate=0.0, seed=None):
+        """
+        Args:
+            latency_ms: 平均回應延遲（毫秒）
+            distribution: 延遲分布 (見 LATENCY_DISTRIBUTIONS)
+            latency_sigma: lognormal 分布的 sigma
+            error_rate: 回應 500 的機率
+            throttle_rate: 回應 429 的機率
+            retry_after: 429 回應的 Retry-After 秒數
+            drop_rate: 不回應直接斷線的機率
+            seed: 隨機種子
+        """
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"不支援的延遲分布: {distribution}")
+        self.latency_ms = latency_ms
+        self.distribution = distribution
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.drop_rate = drop_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_latency(self) -> float:
+        """抽樣一次回應延遲（秒）"""
+        if self.latency_ms <= 0:
+            return 0.0
+        with self._lock:
+            if self.distribution == "uniform":
+                latency = self._random.uniform(0, 2 * self.latency_ms)
+            elif self.distribution == "exponential":
+                latency = self._random.expovariate(1 / self.latency_ms)
+            elif self.distribution == "lognormal":
+                # 調整 mu 使平均值等於 latency_ms
+                mu = math.log(self.latency_ms) - self.latency_sigma ** 2 / 2
+                latency = self._random.lognormvariate(mu, self.latency_sigma)
+            else:
+                latency = self.latency_ms
+        return latency / 1000
+
+    def sample_fault(self) -> Optional[str]:
+        """抽樣本次請求的故障："drop"、"throttle"、"error" 或 None"""
+        with self._lock:
+            roll = self._random.random()
+        for fault, rate in (("drop", self.drop_rate), ("throttle", self.throttle_rate), ("error", self.error_rate)):
+            if roll < rate:
+                return fault
+            roll -= rate
+        return None
+
+
+class MockFHIRServer:
+    """記憶體內的模擬 FHIR 伺服器"""
+
+    def __init__(self, host="127.0.0.1", port=0, faults: Optional[FaultProfile] = None):
+        """
+        Args:
+            host: 監聽位址
+            port: 監聽埠號，0 表示自動選擇
+            faults: 延遲與故障注入設定，未指定時不注入
+        """
+        self.faults = faults or FaultProfile()
+        self.resources: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.stats: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockFHIRServer":
+        """在背景執行緒啟動伺服器"""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """在目前執行緒啟動伺服器（阻塞）"""
+        self._httpd.serve_forever()
+
+    def stop(self):
+        """停止伺服器"""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self.stats[outcome] = self.stats.get(outcome, 0) + 1
+
+    def _store(self, resource: Dict[str, Any], resource_id: Optional[str] = None) -> Tuple[Dict[str, Any], bool]:
+        """儲存資源，回傳 (儲存後的資源, 是否為新建)"""
+        resource = dict(resource)
+        resource["id"] = resource_id or str(uuid.uuid4())
+        key = (resource["resourceType"], resource["id"])
+        with self._lock:
+            created = key not in self.resources
+            version = 1 if created else int(self.resources[key]["meta"]["versionId"]) + 1
+            resource["meta"] = dict(resource.get("meta", {}), versionId=str(version),
+                                    lastUpdated=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+            self.resources[key] = resource
+        return resource, created
+
+    def _process_bundle(self, bundle: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """處理 batch / transaction Bundle"""
+        bundle_type = bundle.get("type")
+        if bundle_type not in ("batch", "transaction"):
+            return 400, _operation_outcome(f"不支援的 Bundle 類型: {bundle_type}")
+        entries = bundle.get("entry", [])
+
+        if bundle_type == "transaction":
+            # 先為 POST 的 urn:uuid 指派伺服器 ID，再改寫所有引用
+            assigned = {}
+            for entry in entries:
+                request = entry.get("request", {})
+                if request.get("method") == "POST" and str(entry.get("fullUrl", "")).startswith("urn:"):
+                    assigned[entry["fullUrl"]] = f"{entry['resource']['resourceType']}/{uuid.uuid4()}"
+            entries = [_rewrite_references(entry, assigned) for entry in entries]
+        else:
+            assigned = {}
+
+        responses = []
+        for entry in entries:
+            assigned_id = assigned[entry["fullUrl"]].split("/", 1)[1] if entry.get("fullUrl") in assigned else None
+            status, body = self._handle(entry.get("request", {}).get("method", ""),
+                                        entry.get("request", {}).get("url", ""), entry.get("resource"), assigned_id)
+            if bundle_type == "transaction" and status >= 400:
+                return status, body
+            response = {"status": f"{status} {HTTPStatus(status).phrase}"}
+            if status in (200, 201):
+                response["location"] = f"{body['resourceType']}/{body['id']}/_history/{body['meta']['versionId']}"
+            responses.append({"response": response, "resource": body} if status < 400 else {"response": response})
+        return 200, {
+            "resourceType": "Bundle",
+            "type": f"{bundle_type}-response",
+            "entry": responses
+        }
+
+    def _handle(self, method: str, path: str, body: Optional[Dict[str, Any]],
+                assigned_id: Optional[str] = None) -> Tuple[int, Dict[str, Any]]:
+        """依 FHIR RESTful 語意處理單一請求（assigned_id 為 transaction 預先指派的 ID）"""
+        parts = [p for p in path.split("?", 1)[0].strip("/").split("/") if p]
+        if method == "GET" and parts == ["metadata"]:
+            return 200, {"resourceType": "CapabilityStatement", "status": "active", "kind": "instance",
+                         "fhirVersion": "4.0.1", "format": ["json"]}
+        if method == "GET" and len(parts) == 2:
+            resource = self.resources.get((parts[0], parts[1]))
+            if resource is None:
+                return 404, _operation_outcome(f"{parts[0]}/{parts[1]} 不存在", "not-found")
+            return 200, resource
+        if method == "POST" and not parts:
+            if not body or body.get("resourceType") != "Bundle":
+                return 400, _operation_outcome("伺服器根路徑只接受 batch / transaction Bundle")
+            return self._process_bundle(body)
+        if method == "POST" and len(parts) == 1:
+            if not body or body.get("resourceType") != parts[0]:
+                return 400, _operation_outcome("資源類型與 URL 不符")
+            resource, _ = self._store(body, assigned_id)
+            return 201, resource
+        if method == "PUT" and len(parts) == 2:
+            if not body or body.get("resourceType") != parts[0] or body.get("id", parts[1]) != parts[1]:
+                return 400, _operation_outcome("資源類型或 ID 與 URL 不符")
+            resource, created = self._store(body, parts[1])
+            return (201 if created else 200), resource
+        return 400, _operation_outcome(f"不支援的請求: {method} /{'/'.join(parts)}", "not-supported")
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _serve(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                time.sleep(server.faults.sample_latency())
+
+                fault = server.faults.sample_fault()
+                if fault == "drop":
+                    server._count("drop")
+                    self.close_connection = True
+                    try:
+                        self.connection.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+                    return
+                headers = {}
+                if fault == "throttle":
+                    status, body = 429, _operation_outcome("請求過於頻繁", "throttled")
+                    headers["Retry-After"] = f"{server.faults.retry_after:g}"
+                elif fault == "error":
+                    status, body = 500, _operation_outcome("模擬伺服器錯誤", "exception")
+                else:
+                    try:
+                        payload = json.loads(raw) if raw else None
+                    except json.JSONDecodeError:
+                        status, body = 400, _operation_outcome("無效的 JSON")
+                    else:
+                        status, body = server._handle(method, self.path, payload)
+                server._count(str(status))
+
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/fhir+json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                if status == 201:
+                    self.send_header("Location", f"{server.url}/{body['resourceType']}/{body['id']}")
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._serve("GET")
+
+            def do_POST(self):
+                self._serve("POST")
+
+            def do_PUT(self):
+                self._serve("PUT")
+
+        return Handler
+
+
+def _operation_outcome(message: str, code: str = "invalid") -> Dict[str, Any]:
+    return {
+        "resourceType": "OperationOutcome",
+        "issue": [{"severity": "error", "code": code, "diagnostics": message}]
+    }
+
+
+def _rewrite_references(node: Any, assigned: Dict[str, str]) -> Any:
+    """將 transaction 中的 urn:uuid 引用改寫為伺服器指派的 ID"""
+    if isinstance(node, dict):
+        return {key: (assigned.get(value, value) if key == "reference" and isinstance(value, str)
+                      else _rewrite_references(value, assigned)) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_rewrite_references(item, assigned) for item in node]
+    return node
+
+
+def run_upload_benchmark(num_patients=10, num_conditions=2, num_observations=3, num_medications=2,
+                         num_encounters=1, faults: Optional[FaultProfile] = None, medication_mode="reference",
+                         validate_profiles=True, seed=None) -> Dict[str, Any]:
+    """
+    以模擬伺服器測量 upload_patient_data_to_server 的吞吐量與延遲
+
+    Args:
+        num_patients: 上傳的病人數
+        num_conditions / num_observations / num_medications / num_encounters: 每位病人的資源數
+        faults: 伺服器的延遲與故障注入設定
+        medication_mode: MedicationRequest 引用藥物的方式
+        validate_profiles: 上傳前是否驗證 TW Core Profile
+        seed: 資料生成種子
+
+    Returns:
+        測試結果（resources/s、延遲百分位數、伺服器回應統計）
+    """
+    import contextlib
+    import io
+    from benchmark import percentile
+    from generate_TW_patients import TWFHIRGeneratorFixed
+
+    generator = TWFHIRGeneratorFixed(medication_mode=medication_mode, seed=seed,
+                                     validate_profiles=validate_profiles, upload_interval=0)
+    if seed is not None:
+        random.seed(seed)
+    patients = [generator.generate_complete_patient_data(num_conditions, num_observations, num_medications,
+                                                         num_encounters, patient_index=i)
+                for i in range(num_patients)]
+
+    latencies: List[float] = []
+    upload_resource = generator.upload_resource_to_server
+
+    def timed_upload(resource, server_url):
+        start = time.perf_counter()
+        try:
+            return upload_resource(resource, server_url)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    generator.upload_resource_to_server = timed_upload
+
+    with MockFHIRServer(faults=faults) as server:
+        errors = 0
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for patient_data in patients:
+                errors += len(generator.upload_patient_data_to_server(patient_data, server.url)["errors"])
+        elapsed = time.perf_counter() - start
+        server_stats = dict(server.stats)
+        stored = len(server.resources)
+
+    latencies.sort()
+    return {
+        "patients": num_patients,
+        "requests": len(latencies),
+        "stored_resources": stored,
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "resources_per_second": round(stored / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0
+        },
+        "server_responses": server_stats
+    }
+
+
+def _fault_profile_from_args(args) -> FaultProfile:
+    return FaultProfile(latency_ms=args.latency, distribution=args.distribution, latency_sigma=args.sigma,
+                        error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                        retry_after=args.retry_after, drop_rate=args.drop_rate, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模擬 FHIR 伺服器 / Mock FHIR server')
+    parser.add_argument('--host', default='127.0.0.1', help='監聽位址')
+    parser.add_argument('--port', type=int, default=8090, help='監聽埠號')
+    parser.add_argument('--latency', type=float, default=0.0, help='平均回應延遲（毫秒）')
+    parser.add_argument('--distribution', choices=LATENCY_DISTRIBUTIONS, default='fixed', help='延遲分布')
+    parser.add_argument('--sigma', type=float, default=0.5, help='lognormal 分布的 sigma')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='回應 500 的機率')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='回應 429 的機率')
+    parser.add_argument('--retry-after', type=float, default=0.0, help='429 回應的 Retry-After 秒數')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='直接斷線的機率')
+    parser.add_argument('--seed', type=int, help='隨機種子')
+    parser.add_argument('--bench', action='store_true', help='執行上傳效能測試後結束')
+    parser.add_argument('--patients', type=int, default=10, help='效能測試的病人數')
+    parser.add_argument('--no-validate', action='store_true', help='效能測試時不驗證 TW Core Profile')
+    args = parser.parse_args()
+
+    faults = _fault_profile_from_args(args)
+    if args.bench:
+        print("⏱️  執行上傳效能測試...")
+        result = run_upload_benchmark(num_patients=args.patients, faults=faults,
+                                      validate_profiles=not args.no_validate, seed=args.seed)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+
+    server = MockFHIRServer(args.host, args.port, faults)
+    print(f"🧪 模擬 FHIR 伺服器: {server.url}")
+    print("⏹️  按 Ctrl+C 停止伺服器")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 伺服器已停止")
+
+
+if __name__ == "__main__":
+    main()
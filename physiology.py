@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+生理數值相關模型
+以多變量常態分布（Cholesky 分解）一次為一批病人抽出相關的身高、體重、血壓、血糖、血脂等數值，
+截斷在觀察項目的參考範圍內，並由身高體重推導 BMI、保證舒張壓低於收縮壓
+"""
+
+import math
+import random
+from array import array
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+# 變數: LOINC 代碼 → (平均值, 標準差)，依台灣成人分布概略設定
+MARGINALS = {
+    "8302-2": (163.0, 8.5),    # 身高 cm
+    "29463-7": (65.0, 12.0),   # 體重 kg
+    "8480-6": (122.0, 15.0),   # 收縮壓 mmHg
+    "8462-4": (77.0, 10.0),    # 舒張壓 mmHg
+    "8867-4": (74.0, 10.0),    # 心跳 /min
+    "1558-6": (98.0, 18.0),    # 空腹血糖 mg/dL
+    "17856-6": (5.7, 0.7),     # HbA1c %
+    "2093-3": (190.0, 35.0),   # 總膽固醇 mg/dL
+    "2089-1": (115.0, 30.0),   # LDL mg/dL
+    "2085-9": (52.0, 13.0),    # HDL mg/dL
+    "2571-8": (125.0, 60.0)    # 三酸甘油酯 mg/dL
+}
+
+# 變數間的相關係數（未列出者為 0）
+CORRELATIONS = {
+    ("8302-2", "29463-7"): 0.50,
+    ("29463-7", "8480-6"): 0.30,
+    ("29463-7", "8462-4"): 0.25,
+    ("29463-7", "1558-6"): 0.25,
+    ("29463-7", "17856-6"): 0.20,
+    ("29463-7", "2571-8"): 0.30,
+    ("29463-7", "2085-9"): -0.30,
+    ("8480-6", "8462-4"): 0.70,
+    ("8480-6", "8867-4"): 0.15,
+    ("8462-4", "8867-4"): 0.15,
+    ("8480-6", "1558-6"): 0.15,
+    ("8480-6", "2093-3"): 0.15,
+    ("1558-6", "17856-6"): 0.75,
+    ("1558-6", "2571-8"): 0.25,
+    ("17856-6", "2571-8"): 0.20,
+    ("2093-3", "2089-1"): 0.85,
+    ("2093-3", "2085-9"): 0.20,
+    ("2093-3", "2571-8"): 0.35,
+    ("2089-1", "2571-8"): 0.20,
+    ("2085-9", "2571-8"): -0.40
+}
+
+HEIGHT_CODE = "8302-2"
+WEIGHT_CODE = "29463-7"
+BMI_CODE = "39156-5"
+SYSTOLIC_CODE = "8480-6"
+DIASTOLIC_CODE = "8462-4"
+
+# 收縮壓與舒張壓的最小差距（脈壓，mmHg）
+MIN_PULSE_PRESSURE = 20
+
+# 每批抽樣的病人數
+PHYSIOLOGY_BLOCK_SIZE = 128
+
+
+def cholesky(matrix: Sequence[Sequence[float]]) -> List[List[float]]:
+    """
+    Cholesky 分解（下三角）
+
+    Raises:
+        ValueError: 矩陣不是正定矩陣
+    """
+    size = len(matrix)
+    lower = [[0.0] * size for _ in range(size)]
+    for i in range(size):
+        for j in range(i + 1):
+            total = matrix[i][j] - sum(lower[i][k] * lower[j][k] for k in range(j))
+            if i == j:
+                if total <= 0:
+                    raise ValueError("相關係數矩陣不是正定矩陣")
+                lower[i][j] = math.sqrt(total)
+            else:
+                lower[i][j] = total / lower[j][j]
+    return lower
+
+
+class PhysiologyModel:
+    """相關生理數值模型：整批抽樣，逐一取出每位病人的數值"""
+
+    def __init__(self, observations: Sequence[Mapping[str, Any]], block_size: int = PHYSIOLOGY_BLOCK_SIZE):
+        """
+        Args:
+            observations: 觀察項目設定，用於截斷範圍（目錄中沒有的變數不截斷）
+            block_size: 每批抽樣的病人數
+        """
+        self.codes = tuple(MARGINALS)
+        self.block_size = block_size
+        ranges = {obs_info["code"]: (float(obs_info["min_val"]), float(obs_info["max_val"]))
+                  for obs_info in observations}
+        self._ranges = [ranges.get(code, (-math.inf, math.inf)) for code in self.codes]
+        # 參考範圍為整數的項目在抽樣時即取整數，推導值（BMI）與輸出的數值一致
+        integer_codes = {obs_info["code"] for obs_info in observations
+                         if isinstance(obs_info["min_val"], int) and isinstance(obs_info["max_val"], int)}
+        self._integer = [code in integer_codes for code in self.codes]
+        index = {code: i for i, code in enumerate(self.codes)}
+        correlation = [[1.0 if i == j else 0.0 for j in range(len(self.codes))] for i in range(len(self.codes))]
+        for (first, second), value in CORRELATIONS.items():
+            correlation[index[first]][index[second]] = correlation[index[second]][index[first]] = value
+        self._cholesky = cholesky(correlation)
+
+        self._block: Dict[str, array] = {}
+        self._position = 0
+        self._size = 0
+
+    def draw_block(self, size: int) -> Dict[str, array]:
+        """
+        抽出一批病人的相關數值
+
+        Returns:
+            LOINC 代碼 → 各病人數值的欄位（含推導的 BMI）
+        """
+        normals = [[random.gauss(0.0, 1.0) for _ in range(size)] for _ in self.codes]
+        columns = {}
+        for i, code in enumerate(self.codes):
+            combined = [0.0] * size
+            for j in range(i + 1):
+                weight = self._cholesky[i][j]
+                if weight:
+                    combined = [total + weight * z for total, z in zip(combined, normals[j])]
+            mean, sd = MARGINALS[code]
+            low, high = self._ranges[i]
+            if self._integer[i]:
+                columns[code] = array('d', (round(min(high, max(low, mean + sd * z))) for z in combined))
+            else:
+                columns[code] = array('d', (min(high, max(low, mean + sd * z)) for z in combined))
+
+        columns[DIASTOLIC_CODE] = array('d', (
+            min(diastolic, systolic - MIN_PULSE_PRESSURE)
+            for systolic, diastolic in zip(columns[SYSTOLIC_CODE], columns[DIASTOLIC_CODE])
+        ))
+        columns[BMI_CODE] = array('d', (
+            weight / (height / 100) ** 2 for height, weight in zip(columns[HEIGHT_CODE], columns[WEIGHT_CODE])
+        ))
+        return columns
+
+    def clear(self):
+        """丟棄尚未取出的數值，下一位病人重新抽樣"""
+        self._block = {}
+        self._position = self._size = 0
+
+    def next_profile(self) -> Dict[str, float]:
+        """
+        取出下一位病人的數值
+
+        Returns:
+            LOINC 代碼 → 數值
+        """
+        if self._position >= self._size:
+            self._block = self.draw_block(self.block_size)
+            self._position, self._size = 0, self.block_size
+        position = self._position
+        self._position += 1
+        return {code: column[position] for code, column in self._block.items()}
+
+
+def observation_value(obs_info: Mapping[str, Any], profile: Optional[Mapping[str, float]] = None):
+    """
+    取得觀察項目的數值：相關模型中有的項目使用病人的數值，其餘在參考範圍內均勻抽樣
+
+    Args:
+        obs_info: 觀察項目設定
+        profile: PhysiologyModel.next_profile() 的結果
+
+    Returns:
+        依項目精度四捨五入的數值
+    """
+    is_float = isinstance(obs_info["min_val"], float) or isinstance(obs_info["max_val"], float)
+    value = profile.get(obs_info["code"]) if profile else None
+    if value is None:
+        if not is_float:
+            return random.randint(obs_info["min_val"], obs_info["max_val"])
+        value = random.uniform(obs_info["min_val"], obs_info["max_val"])
+    if obs_info["code"] in ("8310-5", BMI_CODE):  # 體溫、BMI 取一位小數
+        return round(value, 1)
+    return round(value, 2) if is_float else int(round(value))
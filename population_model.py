@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+人口分布模型模組
+將 config/population.json 的加權分布預先編譯為別名法 (alias method) 取樣表，每次取樣為 O(1)
+"""
+
+import random
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+class AliasSampler:
+    """Vose 別名法取樣器：建表 O(n)，每次取樣只需一次亂數"""
+
+    def __init__(self, items: Sequence[Any], weights: Sequence[float]):
+        """
+        建立取樣表
+
+        Args:
+            items: 取樣項目
+            weights: 對應的非負權重（總和須大於 0）
+        """
+        if len(items) != len(weights) or not items:
+            raise ValueError("取樣項目與權重數量必須相同且不可為空")
+        total = float(sum(weights))
+        if total <= 0:
+            raise ValueError("權重總和必須大於 0")
+
+        n = len(items)
+        self.items = list(items)
+        self._n = n
+        self._prob = [0.0] * n
+        self._alias = list(range(n))
+
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self._prob[s] = scaled[s]
+            self._alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        for i in large + small:
+            self._prob[i] = 1.0
+
+    def sample_index(self, rand=random.random) -> int:
+        """取樣一個索引"""
+        u = rand() * self._n
+        i = int(u)
+        return i if u - i < self._prob[i] else self._alias[i]
+
+    def sample(self, rand=random.random) -> Any:
+        """取樣一個項目"""
+        return self.items[self.sample_index(rand)]
+
+
+class PopulationModel:
+    """台灣人口分布模型"""
+
+    def __init__(self, config: Dict[str, Any], conditions: Optional[List[Dict[str, Any]]] = None):
+        """
+        編譯人口分布取樣表
+
+        Args:
+            config: population.json 內容
+            conditions: 疾病目錄（用於依年齡加權的疾病取樣）
+        """
+        bands = config["age_bands"]
+        self._age_band_sampler = AliasSampler(
+            [(band["min"], band["max"]) for band in bands],
+            [band["weight"] for band in bands]
+        )
+        self.min_age = min(band["min"] for band in bands)
+        self.max_age = max(band["max"] for band in bands)
+
+        cities = config["cities"]
+        self._city_sampler = AliasSampler(list(cities), list(cities.values()))
+
+        surnames = config["surnames"]
+        self._surname_sampler = AliasSampler(list(surnames), list(surnames.values()))
+
+        # 婚姻狀況的代碼與顯示名稱成對取樣，避免兩者不一致
+        marital = config["marital_status"]
+        self.marital_system = marital["system"]
+        self._marital_samplers = []
+        for group in marital["by_age"]:
+            codes = [code for code, weight in group["weights"].items() if weight > 0]
+            self._marital_samplers.append((
+                group["max_age"],
+                AliasSampler([(code, marital["codes"][code]) for code in codes],
+                             [group["weights"][code] for code in codes])
+            ))
+
+        self._condition_samplers = []
+        self._overall_condition_sampler = None
+        if conditions:
+            category_sizes = {}
+            for condition in conditions:
+                key = condition.get("category_key")
+                category_sizes[key] = category_sizes.get(key, 0) + 1
+            overall_weights = [0.0] * len(conditions)
+            prevalence = config.get("condition_prevalence") or {"by_age": [{"max_age": 200, "weights": {}}]}
+            for group in prevalence["by_age"]:
+                category_weights = group["weights"]
+                if category_weights:
+                    weights = [
+                        category_weights.get(c.get("category_key"), 1) / category_sizes[c.get("category_key")]
+                        for c in conditions
+                    ]
+                else:
+                    weights = [1.0] * len(conditions)
+                overall_weights = [a + b for a, b in zip(overall_weights, weights)]
+                self._condition_samplers.append((group["max_age"], AliasSampler(conditions, weights)))
+            self._overall_condition_sampler = AliasSampler(conditions, overall_weights)
+
+    @staticmethod
+    def uniform_config(cities: List[str], surnames: List[str], min_age: int = 18, max_age: int = 80) -> Dict[str, Any]:
+        """建立均勻分布的人口配置（未提供 population.json 時使用）"""
+        return {
+            "age_bands": [{"min": min_age, "max": max_age, "weight": 1}],
+            "cities": {city: 1 for city in cities},
+            "surnames": {surname: 1 for surname in surnames},
+            "marital_status": {
+                "system": "http://terminology.hl7.org/CodeSystem/v3-MaritalStatus",
+                "codes": {"M": "Married", "S": "Never Married", "D": "Divorced", "W": "Widowed"},
+                "by_age": [{"max_age": 200, "weights": {"M": 1, "S": 1, "D": 1, "W": 1}}]
+            }
+        }
+
+    @staticmethod
+    def _for_age(samplers: List[Tuple[int, AliasSampler]], age: int) -> AliasSampler:
+        for max_age, sampler in samplers:
+            if age <= max_age:
+                return sampler
+        return samplers[-1][1]
+
+    def sample_age(self) -> int:
+        """依年齡金字塔取樣年齡（歲）"""
+        low, high = self._age_band_sampler.sample()
+        return random.randint(low, high)
+
+    def sample_city(self) -> str:
+        """依縣市人口取樣居住縣市"""
+        return self._city_sampler.sample()
+
+    def sample_surname(self) -> str:
+        """依姓氏頻率取樣姓氏"""
+        return self._surname_sampler.sample()
+
+    def sample_marital_status(self, age: int) -> Tuple[str, str]:
+        """依年齡取樣婚姻狀況，回傳 (code, display)"""
+        return self._for_age(self._marital_samplers, age).sample()
+
+    def sample_condition(self, age: Optional[int] = None) -> Dict[str, Any]:
+        """依年齡層盛行率取樣一種疾病；未提供年齡時使用整體分布"""
+        if age is None:
+            return self._overall_condition_sampler.sample()
+        return self._for_age(self._condition_samplers, age).sample()
+
+    def sample_conditions(self, age: int, count: int) -> List[Dict[str, Any]]:
+        """
+        依年齡層盛行率取樣多種不重複的疾病
+
+        Args:
+            age: 病人年齡
+            count: 疾病數量（不可超過疾病目錄大小）
+
+        Returns:
+            疾病資訊列表
+        """
+        sampler = self._for_age(self._condition_samplers, age)
+        chosen = {}
+        # 重複時拒絕重抽；抽樣數量接近目錄大小時改以剩餘項目補足
+        attempts = count * 8
+        while len(chosen) < count and attempts > 0:
+            index = sampler.sample_index()
+            chosen.setdefault(index, sampler.items[index])
+            attempts -= 1
+        if len(chosen) < count:
+            remaining = [i for i in range(len(sampler.items)) if i not in chosen]
+            for index in random.sample(remaining, count - len(chosen)):
+                chosen[index] = sampler.items[index]
+        return list(chosen.values())
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+TW Core Profile 驗證模組
+將 StructureDefinition 的 snapshot 編譯為巢狀檢查函式（每個 Profile 只編譯一次），
+檢查基數、型別、固定值 / pattern、required binding 與 constraint invariant（FHIRPath），
+可批次驗證並選擇使用多個行程
+"""
+
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fhirpath import FHIRPathError, compile_expression
+from terminology import TerminologyStore, get_terminology_store
+from valueset import ValueSetExpander
+
+PROFILE_BASE_URL = "https://twcore.mohw.gov.tw/ig/twcore/StructureDefinition/"
+
+# Observation 依類別選擇 Profile，其他資源使用 <resourceType>-twcore
+OBSERVATION_CATEGORY_PROFILES = {
+    "vital-signs": PROFILE_BASE_URL + "Observation-vitalSigns-twcore",
+    "laboratory": PROFILE_BASE_URL + "Observation-laboratoryResult-twcore"
+}
+OBSERVATION_DEFAULT_PROFILE = PROFILE_BASE_URL + "Observation-simple-twcore"
+
+_DATE_PATTERN = r"([0-9]([0-9]([0-9][1-9]|[1-9]0)|[1-9]00)|[1-9]000)(-(0[1-9]|1[0-2])(-(0[1-9]|[1-2][0-9]|3[0-1]))?)?"
+_TIME_PATTERN = r"([01][0-9]|2[0-3]):[0-5][0-9]:([0-5][0-9]|60)(\.[0-9]+)?"
+_ZONE_PATTERN = r"(Z|(\+|-)((0[0-9]|1[0-3]):[0-5][0-9]|14:00))"
+
+_REGEX_TYPES = {
+    "date": re.compile(_DATE_PATTERN),
+    "dateTime": re.compile(f"{_DATE_PATTERN}(T{_TIME_PATTERN}{_ZONE_PATTERN})?"),
+    "instant": re.compile(f"{_DATE_PATTERN}T{_TIME_PATTERN}{_ZONE_PATTERN}"),
+    "time": re.compile(_TIME_PATTERN),
+    "code": re.compile(r"[^\s]+( [^\s]+)*"),
+    "id": re.compile(r"[A-Za-z0-9\-\.]{1,64}")
+}
+_STRING_TYPES = {
+    "string", "uri", "url", "canonical", "markdown", "oid", "uuid", "base64Binary", "xhtml",
+    "http://hl7.org/fhirpath/System.String"
+}
+_INTEGER_TYPES = {"integer": None, "positiveInt": 1, "unsignedInt": 0}
+
+# (資源中的位置, 訊息)
+Issue = Tuple[str, str]
+# (節點, 位置, 問題列表, FHIRPath 環境)
+Checker = Callable[[Any, str, List[Issue], Dict[str, Any]], None]
+
+
+def _type_checker(type_code: Optional[str]) -> Optional[Callable[[Any], bool]]:
+    """建立單一型別的值檢查函式"""
+    if type_code is None:
+        return None
+    if type_code == "boolean":
+        return lambda value: isinstance(value, bool)
+    if type_code in _INTEGER_TYPES:
+        minimum = _INTEGER_TYPES[type_code]
+        return lambda value: isinstance(value, int) and not isinstance(value, bool) and \
+            (minimum is None or value >= minimum)
+    if type_code == "decimal":
+        return lambda value: isinstance(value, (int, float)) and not isinstance(value, bool)
+    if type_code in _REGEX_TYPES:
+        pattern = _REGEX_TYPES[type_code]
+        return lambda value: isinstance(value, str) and pattern.fullmatch(value) is not None
+    if type_code in _STRING_TYPES:
+        return lambda value: isinstance(value, str)
+    if type_code == "Resource":
+        return lambda value: isinstance(value, dict) and "resourceType" in value
+    # 複合型別
+    return lambda value: isinstance(value, dict)
+
+
+def _matches_pattern(value: Any, pattern: Any) -> bool:
+    """pattern[x] 比對：pattern 中出現的欄位都必須相符，陣列中每個項目都要有相符的值"""
+    if isinstance(pattern, dict):
+        return isinstance(value, dict) and all(
+            key in value and _matches_pattern(value[key], item) for key, item in pattern.items()
+        )
+    if isinstance(pattern, list):
+        return isinstance(value, list) and all(
+            any(_matches_pattern(candidate, item) for candidate in value) for item in pattern
+        )
+    return value == pattern
+
+
+class CompiledProfile:
+    """編譯後的 Profile 檢查器"""
+
+    def __init__(self, structure_definition: Dict[str, Any], expander: ValueSetExpander):
+        """
+        編譯 StructureDefinition snapshot
+
+        Args:
+            structure_definition: StructureDefinition 資源內容（須含 snapshot）
+            expander: 用於 required binding 的 ValueSet 展開引擎
+        """
+        self.url = structure_definition["url"]
+        self.type = structure_definition["type"]
+        self._expander = expander
+
+        # slice 的規則需要 discriminator 判斷，這裡只檢查未切片的元素
+        self._children: Dict[str, List[Dict[str, Any]]] = {}
+        self._root_invariants = []
+        for element in structure_definition["snapshot"]["element"]:
+            if ":" in element["id"]:
+                continue
+            if "." not in element["path"]:
+                self._root_invariants = self._compile_invariants(element)
+                continue
+            parent = element["path"].rsplit(".", 1)[0]
+            self._children.setdefault(parent, []).append(element)
+
+        self._check_root = self._compile_node(self.type, is_root=True)
+        self._children = None
+
+    def validate(self, resource: Dict[str, Any]) -> List[Issue]:
+        """
+        驗證單一資源
+
+        Returns:
+            問題列表 [(位置, 訊息)]，符合時為空列表
+        """
+        issues: List[Issue] = []
+        if resource.get("resourceType") != self.type:
+            issues.append((self.type, f"resourceType 應為 {self.type}"))
+            return issues
+        env = {"resource": resource}
+        self._check_invariants(self._root_invariants, resource, self.type, issues, env)
+        self._check_root(resource, self.type, issues, env)
+        return issues
+
+    @staticmethod
+    def _compile_invariants(element: Dict[str, Any]) -> List[Tuple[str, str, Callable]]:
+        """編譯元素上 severity 為 error 的 invariant；超出 FHIRPath 子集的運算式略過"""
+        invariants = []
+        for constraint in element.get("constraint", []):
+            if constraint.get("severity") != "error" or not constraint.get("expression"):
+                continue
+            try:
+                evaluator = compile_expression(constraint["expression"])
+            except FHIRPathError:
+                continue
+            invariants.append((constraint["key"], constraint.get("human", ""), evaluator))
+        return invariants
+
+    @staticmethod
+    def _check_invariants(invariants, node: Any, location: str, issues: List[Issue], env: Dict[str, Any]):
+        for key, human, evaluator in invariants:
+            try:
+                result = evaluator([node], env)
+            except FHIRPathError:
+                continue
+            if result == [False]:
+                issues.append((location, f"違反 {key}: {human}"))
+
+    def _compile_node(self, path: str, is_root: bool = False) -> Optional[Checker]:
+        """編譯一個複合元素：逐一檢查子元素，並回報 snapshot 未定義的欄位"""
+        child_elements = self._children.get(path)
+        if not child_elements:
+            return None
+
+        checkers = []
+        allowed_keys = {"resourceType"} if is_root else set()
+        for element in child_elements:
+            keys, checker = self._compile_element(element)
+            allowed_keys.update(keys)
+            allowed_keys.update("_" + key for key in keys)
+            checkers.append(checker)
+
+        def check_node(node: Dict[str, Any], location: str, issues: List[Issue], env: Dict[str, Any]):
+            for checker in checkers:
+                checker(node, location, issues, env)
+            for key in node:
+                if key not in allowed_keys:
+                    issues.append((f"{location}.{key}", "Profile 未定義此元素"))
+
+        return check_node
+
+    def _compile_element(self, element: Dict[str, Any]) -> Tuple[List[str], Checker]:
+        """編譯單一元素定義，回傳 (JSON 欄位名稱, 檢查函式)"""
+        path = element["path"]
+        name = path.rsplit(".", 1)[1]
+        minimum = element.get("min", 0)
+        maximum = element.get("max", "*")
+        max_count = None if maximum == "*" else int(maximum)
+        # JSON 是否為陣列取決於基礎資源定義，而非 Profile 限縮後的基數
+        is_array = element.get("base", {}).get("max", maximum) != "1"
+        type_codes = [t["code"] for t in element.get("type", [])]
+
+        if name.endswith("[x]"):
+            base = name[:-3]
+            keys = {base + code[0].upper() + code[1:]: code for code in type_codes}
+        else:
+            keys = {name: type_codes[0] if len(type_codes) == 1 else None}
+        type_checks = {key: _type_checker(code) for key, code in keys.items()}
+
+        fixed = pattern = None
+        for key, value in element.items():
+            if key.startswith("fixed"):
+                fixed = (value,)
+            elif key.startswith("pattern"):
+                pattern = (value,)
+
+        binding_check = self._compile_binding(element.get("binding"))
+        child_check = self._compile_node(path) if "contentReference" not in element else None
+        invariants = self._compile_invariants(element)
+        check_invariants = self._check_invariants
+
+        def check_element(node: Dict[str, Any], location: str, issues: List[Issue], env: Dict[str, Any]):
+            present = [key for key in keys if key in node]
+            if not present:
+                if minimum > 0:
+                    issues.append((f"{location}.{name}", f"至少需要 {minimum} 個"))
+                return
+            if len(present) > 1:
+                issues.append((f"{location}.{name}", "選擇型別只能出現一種"))
+
+            key = present[0]
+            value = node[key]
+            is_list = isinstance(value, list)
+            if is_list and not is_array:
+                issues.append((f"{location}.{key}", "不可為陣列"))
+            elif is_array and not is_list:
+                issues.append((f"{location}.{key}", "必須為陣列"))
+            values = value if is_list else [value]
+            if len(values) < minimum:
+                issues.append((f"{location}.{key}", f"至少需要 {minimum} 個，實際 {len(values)} 個"))
+            if max_count is not None and len(values) > max_count:
+                issues.append((f"{location}.{key}", f"最多 {max_count} 個，實際 {len(values)} 個"))
+
+            type_check = type_checks[key]
+            for index, item in enumerate(values):
+                item_location = f"{location}.{key}[{index}]" if is_list else f"{location}.{key}"
+                if type_check is not None and not type_check(item):
+                    issues.append((item_location, f"型別不符，應為 {keys[key]}"))
+                    continue
+                if fixed is not None and item != fixed[0]:
+                    issues.append((item_location, f"必須固定為 {fixed[0]!r}"))
+                if pattern is not None and not _matches_pattern(item, pattern[0]):
+                    issues.append((item_location, f"不符合 pattern {pattern[0]!r}"))
+                if binding_check is not None and not binding_check(item):
+                    issues.append((item_location, "代碼不在 required binding 的 ValueSet 中"))
+                if invariants:
+                    check_invariants(invariants, item, item_location, issues, env)
+                if child_check is not None and isinstance(item, dict):
+                    child_check(item, item_location, issues, env)
+
+        return list(keys), check_element
+
+    def _compile_binding(self, binding: Optional[Dict[str, Any]]) -> Optional[Callable[[Any], bool]]:
+        """
+        編譯 required binding；只有能以本地術語完整展開的 ValueSet 才檢查，
+        其他（例如 HL7 核心 ValueSet、SNOMED CT）交由伺服器判斷
+        """
+        if not binding or binding.get("strength") != "required" or "valueSet" not in binding:
+            return None
+        expansion = self._expander.expand(binding["valueSet"])
+        if expansion is None or not expansion.complete:
+            return None
+        codes = expansion.codes()
+
+        def coding_ok(coding):
+            return isinstance(coding, dict) and expansion.has_code(coding.get("system"), coding.get("code"))
+
+        def check_binding(value):
+            if isinstance(value, str):
+                return value in codes
+            if isinstance(value, dict) and "coding" in value:
+                return any(coding_ok(coding) for coding in value["coding"])
+            if isinstance(value, dict) and "code" in value:
+                return coding_ok(value)
+            # 只有 text 的 CodeableConcept 等情況不在此判斷
+            return True
+
+        return check_binding
+
+
+class ProfileValidator:
+    """TW Core Profile 驗證器"""
+
+    def __init__(self, store: Optional[TerminologyStore] = None, expander: Optional[ValueSetExpander] = None):
+        """
+        Args:
+            store: 術語庫，未指定時使用共用術語庫
+            expander: ValueSet 展開引擎，未指定時建立新的
+        """
+        self.store = store or get_terminology_store()
+        self.expander = expander or ValueSetExpander(self.store)
+        self._compiled: Dict[str, Optional[CompiledProfile]] = {}
+        self._lock = threading.RLock()
+
+    def get_profile(self, url: str) -> Optional[CompiledProfile]:
+        """取得編譯後的 Profile，套件中不存在時為 None"""
+        url = url.split("|", 1)[0]
+        if url in self._compiled:
+            return self._compiled[url]
+        with self._lock:
+            if url not in self._compiled:
+                structure_definition = self.store.load_resource("StructureDefinition", url)
+                compiled = None
+                if structure_definition and "snapshot" in structure_definition:
+                    compiled = CompiledProfile(structure_definition, self.expander)
+                self._compiled[url] = compiled
+        return self._compiled[url]
+
+    @staticmethod
+    def default_profile_url(resource: Dict[str, Any]) -> str:
+        """依資源類型（Observation 另依類別）決定適用的 TW Core Profile"""
+        resource_type = resource.get("resourceType", "")
+        if resource_type == "Observation":
+            for category in resource.get("category", []):
+                for coding in category.get("coding", []):
+                    if coding.get("code") in OBSERVATION_CATEGORY_PROFILES:
+                        return OBSERVATION_CATEGORY_PROFILES[coding["code"]]
+            return OBSERVATION_DEFAULT_PROFILE
+        return f"{PROFILE_BASE_URL}{resource_type}-twcore"
+
+    def validate(self, resource: Dict[str, Any]) -> List[Issue]:
+        """
+        以 meta.profile（未宣告時使用預設 TW Core Profile）驗證單一資源
+
+        Returns:
+            問題列表 [(位置, 訊息)]
+        """
+        profile_urls = resource.get("meta", {}).get("profile") or [self.default_profile_url(resource)]
+        issues: List[Issue] = []
+        for url in profile_urls:
+            profile = self.get_profile(url)
+            if profile is not None:
+                issues.extend(profile.validate(resource))
+        return issues
+
+    def validate_batch(self, resources: List[Dict[str, Any]], processes: int = 1,
+                       chunk_size: int = 500) -> List[List[Issue]]:
+        """
+        批次驗證
+
+        Args:
+            resources: 資源列表
+            processes: 行程數，大於 1 時使用 ProcessPoolExecutor（各行程自行編譯 Profile）
+            chunk_size: 每個工作單位的資源數量
+
+        Returns:
+            與 resources 對應的問題列表
+        """
+        if processes <= 1 or len(resources) <= chunk_size:
+            return [self.validate(resource) for resource in resources]
+
+        chunks = [resources[i:i + chunk_size] for i in range(0, len(resources), chunk_size)]
+        package_dir = str(self.store.package_dir)
+        results: List[List[Issue]] = []
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for chunk_result in executor.map(_validate_chunk, [package_dir] * len(chunks), chunks):
+                results.extend(chunk_result)
+        return results
+
+
+def _validate_chunk(package_dir: str, resources: List[Dict[str, Any]]) -> List[List[Issue]]:
+    """行程池工作函式（每個行程共用一個驗證器）"""
+    validator = get_profile_validator(package_dir)
+    return [validator.validate(resource) for resource in resources]
+
+
+@lru_cache(maxsize=None)
+def get_profile_validator(package_dir: str = "package") -> ProfileValidator:
+    """取得共用的 Profile 驗證器（同一程序內只建立一次）"""
+    return ProfileValidator(get_terminology_store(package_dir))
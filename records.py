@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+精簡病人記錄模組
+批次生成時每位病人的 FHIR 資源原本以巢狀 dict 一直保存到寫檔與上傳為止（每人約 30 KB），
+其中大部分是每筆資源都重複的子結構（system URL、category、status 等）；
+PatientRecord 只保存壓縮後的精簡 JSON 與各類資源數量（每人約 3 KB），
+寫檔或上傳時才逐一還原成 dict
+"""
+
+import json
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Sequence, TextIO
+
+from metrics import PATIENT_DATA_RESOURCE_TYPES
+from timing import NULL_TIMER
+
+# 病人資料中保存的鍵
+PATIENT_DATA_KEYS = ("patient",) + tuple(key for key, _ in PATIENT_DATA_RESOURCE_TYPES)
+
+# zlib 壓縮等級：重複子結構在最低等級就能去除大部分，較高等級只多省數個百分比卻慢數倍
+COMPRESSION_LEVEL = 1
+
+# write_json 每次序列化後寫入的病人數
+WRITE_CHUNK_SIZE = 100
+
+
+class PatientRecord:
+    """一位病人的精簡記錄"""
+
+    __slots__ = ("patient_id", "counts", "_payload")
+
+    def __init__(self, patient_data: Dict[str, Any], level: int = COMPRESSION_LEVEL):
+        """
+        Args:
+            patient_data: generate_*_patient_data() 的結果
+            level: zlib 壓縮等級
+        """
+        self.patient_id = patient_data["patient"]["id"]
+        # 各類資源數量，不需還原即可統計
+        self.counts = tuple(len(patient_data.get(key, ())) for key, _ in PATIENT_DATA_RESOURCE_TYPES)
+        data = {key: patient_data[key] for key in PATIENT_DATA_KEYS if key in patient_data}
+        self._payload = zlib.compress(
+            json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), level)
+
+    def count(self, key: str) -> int:
+        """資源清單（例如 "observations"）的數量"""
+        for (name, _), count in zip(PATIENT_DATA_RESOURCE_TYPES, self.counts):
+            if name == key:
+                return count
+        raise KeyError(key)
+
+    @property
+    def nbytes(self) -> int:
+        """壓縮後的大小"""
+        return len(self._payload)
+
+    def to_patient_data(self) -> Dict[str, Any]:
+        """還原成與 generate_*_patient_data() 相同結構的 dict"""
+        return json.loads(zlib.decompress(self._payload).decode("utf-8"))
+
+
+class PatientBatch:
+    """依序保存多位病人的精簡記錄"""
+
+    __slots__ = ("_records", "level")
+
+    def __init__(self, level: int = COMPRESSION_LEVEL):
+        self._records: List[PatientRecord] = []
+        self.level = level
+
+    def append(self, patient_data: Dict[str, Any]) -> PatientRecord:
+        record = PatientRecord(patient_data, self.level)
+        self._records.append(record)
+        return record
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self) -> Iterator[PatientRecord]:
+        return iter(self._records)
+
+    def patient_data(self) -> Iterator[Dict[str, Any]]:
+        """逐一還原病人資料（同時只有一位病人的 dict 在記憶體中）"""
+        for record in self._records:
+            yield record.to_patient_data()
+
+    def count(self, key: str) -> int:
+        """所有病人某類資源的總數"""
+        return sum(record.count(key) for record in self._records)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(record.nbytes for record in self._records)
+
+    def write_json(self, f: TextIO, keys: Optional[Sequence[str]] = None, indent: int = 2, timer=NULL_TIMER):
+        """
+        以病人資料陣列寫入 JSON，輸出與 json.dumps(list, ensure_ascii=False, indent=indent) 相同
+
+        Args:
+            f: 文字檔
+            keys: 只寫入這些鍵（預設全部）
+            indent: 縮排空格數
+            timer: StageTimer；還原與序列化記在 serialization，寫檔記在 file_write
+        """
+        if not self._records:
+            with timer.span("file_write"):
+                f.write("[]")
+                f.flush()
+            return
+        pad = " " * indent
+        for start in range(0, len(self._records), WRITE_CHUNK_SIZE):
+            with timer.span("serialization"):
+                parts = []
+                for record in self._records[start:start + WRITE_CHUNK_SIZE]:
+                    data = record.to_patient_data()
+                    if keys is not None:
+                        data = {key: data[key] for key in keys}
+                    parts.append(pad + json.dumps(data, ensure_ascii=False, indent=indent).replace("\n", "\n" + pad))
+                text = ("[\n" if start == 0 else ",\n") + ",\n".join(parts)
+            with timer.span("file_write"):
+                f.write(text)
+        with timer.span("file_write"):
+            f.write("\n]")
+            f.flush()
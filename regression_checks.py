@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+回歸檢查模組
+以少量資料快速驗證容易在重構時悄悄壞掉的性質（不需網路或 FHIR 伺服器，CI 每次都會執行）：
+身分證字號置換的一對一性與檢查碼、FHIRPath 運算子優先順序、多程序批次生成與單程序輸出一致、
+bundle 輸出中每種藥物只有一個 Medication
+
+使用方法:
+    python regression_checks.py
+"""
+
+import json
+import random
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+import taiwan_id
+from fhirpath import evaluate
+from taiwan_id import (ID_SPACE_PER_GENDER, LETTER_CODES, TaiwanIDAllocator, compute_check_digit,
+                       is_valid_taiwan_id)
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# 公開範例中常見、檢查碼正確的身分證字號
+KNOWN_VALID_IDS = ("A123456789", "A223456781", "Z100000002")
+
+# 置換抽樣檢查的序號數（全空間 2.6 億，逐一檢查太慢）
+PERMUTATION_SAMPLE = 200000
+# 縮小的 Feistel 寬度：6 位元一半、12 位元全域，號碼空間 3000，可窮舉
+REDUCED_HALF_BITS = 6
+REDUCED_SPACE = 3000
+
+# FHIRPath 運算子優先順序：(運算式, 預期結果)；每個運算式在優先順序或結合方向錯誤時都會得到不同結果
+FHIRPATH_PRECEDENCE_CASES = (
+    ("1 + 2 * 3 = 7", [True]),
+    ("10 - 2 - 3 = 5", [True]),
+    ("12 / 2 / 3 = 2", [True]),
+    ("7 mod 4 + 1 = 4", [True]),
+    ("-2 + 5 = 3", [True]),
+    ("'a' & 'b' = 'ab'", [True]),
+    ("1 + 1 is Integer", [True]),
+    ("1 | 2 = 2", [False]),
+    ("1 < 2 = true", [True]),
+    ("'A' in name.given and false", [False]),
+    ("true or false and false", [True]),
+    ("true xor true and false", [True]),
+    ("true or false implies false", [False]),
+    ("(true or false) and false", [False]),
+    ("name.where(use = 'official').given.count() = 2 and name.given.count() = 3", [True]),
+)
+FHIRPATH_RESOURCE = {
+    "resourceType": "Patient",
+    "name": [{"use": "official", "given": ["A", "B"]}, {"given": ["C"]}]
+}
+
+# 多程序一致性檢查：跨越多個區塊，讓每個 worker 都分到工作
+WORKER_CHECK_PATIENTS = 250
+WORKER_CHECK_WORKERS = 3
+
+
+def _run_batch(*arguments: str):
+    """以子程序執行 batch_cli.py，失敗時附上輸出"""
+    result = subprocess.run([sys.executable, str(BASE_DIR / "batch_cli.py"), "--progress", "none", "--no-cache"]
+                            + list(arguments),
+                            cwd=BASE_DIR, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    assert result.returncode == 0, f"batch_cli.py {' '.join(arguments)} 結束碼 {result.returncode}:\n{result.stdout[-2000:]}"
+
+
+def _reference_check_digit(taiwan_id_value: str) -> int:
+    """依內政部規則逐位計算檢查碼（不使用查表，作為對照）"""
+    code = LETTER_CODES[taiwan_id_value[0]]
+    digits = [code // 10, code % 10] + [int(c) for c in taiwan_id_value[1:9]]
+    weights = [1, 9, 8, 7, 6, 5, 4, 3, 2, 1]
+    return (10 - sum(d * w for d, w in zip(digits, weights)) % 10) % 10
+
+
+def check_feistel_bijection_reduced():
+    """縮小號碼空間時窮舉：置換（含循環步進）是 0..N-1 上的一對一對應"""
+    original = (taiwan_id._HALF_BITS, taiwan_id._HALF_MASK, taiwan_id.ID_SPACE_PER_GENDER)
+    taiwan_id._HALF_BITS = REDUCED_HALF_BITS
+    taiwan_id._HALF_MASK = (1 << REDUCED_HALF_BITS) - 1
+    taiwan_id.ID_SPACE_PER_GENDER = REDUCED_SPACE
+    try:
+        for seed in range(5):
+            allocator = TaiwanIDAllocator(seed=seed)
+            images = [allocator._permute(value) for value in range(REDUCED_SPACE)]
+            assert sorted(images) == list(range(REDUCED_SPACE)), f"種子 {seed} 的置換不是一對一"
+    finally:
+        taiwan_id._HALF_BITS, taiwan_id._HALF_MASK, taiwan_id.ID_SPACE_PER_GENDER = original
+
+
+def check_feistel_full_space_sample():
+    """完整號碼空間：頭尾各一段序號的置換結果互不相同且都在空間內"""
+    allocator = TaiwanIDAllocator(seed=42)
+    half = PERMUTATION_SAMPLE // 2
+    values = list(range(half)) + list(range(ID_SPACE_PER_GENDER - half, ID_SPACE_PER_GENDER))
+    images = [allocator._permute(value) for value in values]
+    assert all(0 <= image < ID_SPACE_PER_GENDER for image in images), "置換結果超出號碼空間"
+    assert len(set(images)) == len(images), "置換結果重複"
+
+
+def check_known_ids():
+    """已知正確的身分證字號通過檢查，改動任一位數字後不通過"""
+    for value in KNOWN_VALID_IDS:
+        assert is_valid_taiwan_id(value), f"{value} 應為正確的身分證字號"
+        check = int(value[9])
+        assert not is_valid_taiwan_id(value[:9] + str((check + 1) % 10)), f"{value} 改動檢查碼後仍通過"
+        serial = int(value[2])
+        assert not is_valid_taiwan_id(value[:2] + str((serial + 1) % 10) + value[3:]), f"{value} 改動流水號後仍通過"
+    assert not is_valid_taiwan_id("A323456789"), "性別碼只能是 1 或 2"
+
+
+def check_check_digit_tables():
+    """查表計算的檢查碼與逐位計算一致，配置出的號碼都通過檢查且不重複"""
+    rng = random.Random(0)
+    for _ in range(20000):
+        letter = rng.choice(sorted(LETTER_CODES))
+        gender_code = rng.choice((1, 2))
+        serial = f"{rng.randrange(10 ** 7):07d}"
+        expected = _reference_check_digit(f"{letter}{gender_code}{serial}0")
+        assert compute_check_digit(letter, gender_code, serial) == expected
+        assert taiwan_id._check_digit_fast(letter, gender_code, int(serial)) == expected
+
+    allocator = TaiwanIDAllocator(seed=7)
+    allocated = [allocator.allocate(gender, index) for gender in ("male", "female") for index in range(20000)]
+    assert all(is_valid_taiwan_id(value) for value in allocated), "配置出檢查碼錯誤的身分證字號"
+    assert len(set(allocated)) == len(allocated), "配置出重複的身分證字號"
+    assert all(value[1] == "1" for value in allocated[:20000]) and all(value[1] == "2" for value in allocated[20000:])
+
+
+def check_fhirpath_precedence():
+    """FHIRPath 中序運算子依規格的優先順序與左結合計算"""
+    for expression, expected in FHIRPATH_PRECEDENCE_CASES:
+        result = evaluate(expression, FHIRPATH_RESOURCE)
+        assert result == expected, f"{expression!r} 結果 {result}，預期 {expected}"
+
+
+def check_workers_match_single_process():
+    """指定種子、基準時間與 deterministic ID 時，--workers N 的輸出與 --workers 1 逐位元組相同"""
+    with tempfile.TemporaryDirectory() as tmp:
+        outputs = []
+        for workers in (1, WORKER_CHECK_WORKERS):
+            output = Path(tmp) / f"workers_{workers}.ndjson"
+            _run_batch("--patients", str(WORKER_CHECK_PATIENTS),
+                       "--seed", "20240601", "--reference-time", "2024-06-01T09:30:00",
+                       "--id-strategy", "deterministic", "--workers", str(workers),
+                       "--format", "ndjson", "--output", str(output))
+            outputs.append(output.read_bytes())
+        assert outputs[0], "批次生成沒有輸出"
+        assert outputs[0] == outputs[1], f"--workers {WORKER_CHECK_WORKERS} 與 --workers 1 的輸出不同"
+
+
+def check_bundle_shares_medications():
+    """uuid4 ID 的多程序 bundle 輸出：每種藥物只有一個 Medication，所有 medicationReference 都能解析"""
+    with tempfile.TemporaryDirectory() as tmp:
+        output = Path(tmp) / "bundle.json"
+        _run_batch("--patients", str(WORKER_CHECK_PATIENTS), "--workers", "2",
+                   "--id-strategy", "uuid4", "--format", "bundle", "--output", str(output))
+        with open(output, 'r', encoding='utf-8') as f:
+            entries = json.load(f)["entry"]
+    medications = [entry for entry in entries if entry["resource"]["resourceType"] == "Medication"]
+    codes = {(coding["system"], coding["code"])
+             for entry in medications for coding in entry["resource"]["code"]["coding"][:1]}
+    assert medications, "bundle 中沒有 Medication"
+    assert len(medications) == len(codes), f"{len(codes)} 種藥物寫出 {len(medications)} 個 Medication"
+    full_urls = {entry["fullUrl"] for entry in entries}
+    for entry in entries:
+        resource = entry["resource"]
+        if resource["resourceType"] == "MedicationRequest":
+            reference = resource["medicationReference"]["reference"]
+            assert entry["fullUrl"].replace(f"MedicationRequest/{resource['id']}", reference) in full_urls, \
+                f"無法解析的引用: {reference}"
+
+
+CHECKS: List[Tuple[str, Callable[[], None]]] = [
+    ("Feistel 置換窮舉一對一（縮小空間）", check_feistel_bijection_reduced),
+    ("Feistel 置換抽樣不重複（完整空間）", check_feistel_full_space_sample),
+    ("已知身分證字號檢查碼", check_known_ids),
+    ("檢查碼查表與配置結果", check_check_digit_tables),
+    ("FHIRPath 運算子優先順序", check_fhirpath_precedence),
+    ("多程序輸出與單程序一致", check_workers_match_single_process),
+    ("bundle 共用 Medication（uuid4）", check_bundle_shares_medications),
+]
+
+
+def main() -> int:
+    """
+    執行所有回歸檢查
+
+    Returns:
+        程式結束碼：有任何檢查失敗時為 1
+    """
+    failures = 0
+    for name, check in CHECKS:
+        try:
+            check()
+        except Exception as e:
+            failures += 1
+            print(f"❌ {name}: {e!r}")
+        else:
+            print(f"✅ {name}")
+    if failures:
+        print(f"\n⚠️  {failures}/{len(CHECKS)} 項回歸檢查失敗")
+        return 1
+    print(f"\n🎉 {len(CHECKS)} 項回歸檢查全部通過")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,6 +6,9 @@ Taiwan FHIR Patient Data Generator - Startup Script
 使用方法 / Usage:
     python run.py          # 啟動Web界面 / Start Web UI
     python run.py --cli     # 使用命令列模式 / Use CLI mode
+    python run.py --bench   # 執行效能測試 / Run benchmarks
+    python run.py --cli --profile  # 以 cProfile 剖析執行 / Profile the run
+    python run.py --batch --patients 1000  # 非互動式批量生成 / Headless batch run
     python run.py --help    # 顯示幫助 / Show help
 """
 
@@ -24,6 +27,14 @@ def main():
   python run.py --cli              # 使用命令列模式
   python run.py --port 8080        # 指定Web伺服器埠號
   python run.py --host 0.0.0.0     # 允許外部連線
+  python run.py --bench            # 執行效能測試並與基準線比較
+  python run.py --bench --save-baseline  # 將本次結果存為基準線
+  python run.py --cli --profile    # 剖析命令列執行，輸出到 output/profiles/
+  python run.py --profile          # 剖析每個 Web 生成任務
+  python run.py --batch --patients 1000 --workers 4 --seed 42
+                                   # 非互動式批量生成（其餘參數見 python batch_cli.py --help）
+  python run.py --batch --patients 1000000 --seed 42 --shard-index 0 --shard-count 8
+                                   # 多台機器各生成同一世代的一個分片
         """
     )
     
@@ -59,7 +70,47 @@ def main():
         help='啟用除錯模式 / Enable debug mode'
     )
     
-    args = parser.parse_args()
+    parser.add_argument(
+        '--bench',
+        action='store_true',
+        help='執行生成器效能測試 / Run generator benchmarks'
+    )
+    
+    parser.add_argument(
+        '--baseline',
+        default='output/benchmarks/baseline.json',
+        help='效能基準線檔案 (預設: output/benchmarks/baseline.json) / Benchmark baseline file'
+    )
+    
+    parser.add_argument(
+        '--save-baseline',
+        action='store_true',
+        help='將效能測試結果存為基準線 / Save benchmark results as the baseline'
+    )
+    
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.10,
+        help='視為效能退步的比例 (預設: 0.10) / Regression threshold (default: 0.10)'
+    )
+    
+    parser.add_argument(
+        '--batch',
+        action='store_true',
+        help='非互動式批量生成，其餘參數交給 batch_cli.py / Headless batch generation'
+    )
+    
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='以 cProfile 剖析執行並輸出到 output/profiles/；--batch 時固定以單一程序生成 (--workers 1) / '
+             'Profile runs with cProfile; batch runs use a single worker'
+    )
+    
+    args, batch_args = parser.parse_known_args()
+    if batch_args and not args.batch:
+        parser.error(f"unrecognized arguments: {' '.join(batch_args)}")
     
     # 檢查必要檔案是否存在
     required_files = [
@@ -93,14 +144,38 @@ def main():
     for dir_path in output_dirs:
         Path(dir_path).mkdir(parents=True, exist_ok=True)
     
-    if args.cli:
+    if args.batch:
+        from batch_cli import main as batch_main
+        from timing import Profiler
+        if args.profile:
+            # cProfile 只剖析本程序，多個工作程序時生成都在子程序中執行，剖析結果沒有意義
+            if any(arg.startswith('--workers') for arg in batch_args):
+                print("⚠️  --profile 時以單一程序生成，忽略 --workers / Profiling forces --workers 1",
+                      file=sys.stderr)
+            batch_args = batch_args + ['--workers', '1']
+        with Profiler('batch', enabled=args.profile):
+            exit_code = batch_main(batch_args)
+        sys.exit(exit_code)
+    
+    elif args.bench:
+        print("⏱️  執行效能測試 / Running benchmarks...")
+        print("=" * 50)
+        
+        from benchmark import main as bench_main
+        sys.exit(bench_main(args.baseline, args.save_baseline, args.threshold))
+    
+    elif args.cli:
         print("🏥 啟動命令列模式 / Starting CLI mode...")
         print("=" * 50)
         
         # 導入並執行命令列版本
         try:
             from generate_TW_patients import main as cli_main
-            cli_main()
+            from timing import Profiler
+            with Profiler('cli', enabled=args.profile) as profiler:
+                cli_main()
+            if profiler.stats_path:
+                print(f"\n🔬 效能剖析 / Profile: {profiler.stats_path} ({profiler.report_path})")
         except KeyboardInterrupt:
             print("\n\n👋 程式已停止 / Program stopped")
         except Exception as e:
@@ -120,6 +195,7 @@ def main():
         # 導入並執行Web版本
         try:
             import app
+            app.app.config['PROFILE_JOBS'] = args.profile
             app.app.run(
                 host=args.host,
                 port=args.port,
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+TW Core 術語庫模組
+將 IG 套件 (package/) 的 CodeSystem 建立為 SQLite 索引，第一次使用某個 CodeSystem 時才載入，
+之後的 code → display 查詢皆為記憶體內 O(1) 雜湊查找
+"""
+
+import json
+import sqlite3
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS concepts (
+    system TEXT NOT NULL,
+    code TEXT NOT NULL,
+    display TEXT,
+    parent TEXT,
+    properties TEXT,
+    PRIMARY KEY (system, code)
+) WITHOUT ROWID;
+"""
+
+
+class TerminologyStore:
+    """TW Core 術語庫"""
+
+    def __init__(self, package_dir: str = "package", index_path: str = "output/.terminology/terminology.db"):
+        """
+        初始化術語庫（只讀取套件的 .index.json，不解析任何 CodeSystem）
+
+        Args:
+            package_dir: FHIR IG 套件目錄
+            index_path: SQLite 索引檔案路徑
+        """
+        self.package_dir = Path(package_dir)
+        self.index_path = Path(index_path)
+        self._lock = threading.RLock()
+        self._connection = None
+        self._resources = self._read_package_index()
+        self._code_systems = {
+            entry["url"]: entry for entry in self._resources.get("CodeSystem", {}).values()
+        }
+        self._loaded: Dict[str, Dict[str, str]] = {}
+        self._json_cache: Dict[str, Dict[str, Any]] = {}
+
+    def _read_package_index(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """讀取套件索引，回傳 {resourceType: {url: 索引項目}}"""
+        index_file = self.package_dir / ".index.json"
+        if not index_file.exists():
+            raise FileNotFoundError(f"IG 套件索引不存在: {index_file}")
+        with open(index_file, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        resources: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for entry in index.get("files", []):
+            if "url" in entry:
+                resources.setdefault(entry["resourceType"], {})[entry["url"]] = entry
+        return resources
+
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(str(self.index_path), check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def list_resources(self, resource_type: str) -> List[Dict[str, Any]]:
+        """列出套件中指定類型的資源索引項目"""
+        return list(self._resources.get(resource_type, {}).values())
+
+    def has_code_system(self, system: str) -> bool:
+        """套件是否提供該 CodeSystem 的完整內容"""
+        entry = self._code_systems.get(system)
+        return entry is not None and (self.package_dir / entry["filename"]).exists()
+
+    def load_resource(self, resource_type: str, url: str) -> Optional[Dict[str, Any]]:
+        """
+        解析並快取套件中的單一資源（ValueSet、ConceptMap、StructureDefinition 等）
+
+        Args:
+            resource_type: 資源類型
+            url: 資源的 canonical URL（可帶 |version）
+
+        Returns:
+            資源內容，套件中不存在時為 None
+        """
+        url = url.split("|", 1)[0]
+        entry = self._resources.get(resource_type, {}).get(url)
+        if entry is None:
+            return None
+        with self._lock:
+            resource = self._json_cache.get(entry["filename"])
+            if resource is None:
+                path = self.package_dir / entry["filename"]
+                if not path.exists():
+                    return None
+                with open(path, 'r', encoding='utf-8') as f:
+                    resource = json.load(f)
+                self._json_cache[entry["filename"]] = resource
+            return resource
+
+    def _ensure_indexed(self, system: str) -> bool:
+        """確認 CodeSystem 已寫入 SQLite 索引（來源檔案有變動時重建）"""
+        entry = self._code_systems.get(system)
+        if entry is None:
+            return False
+        path = self.package_dir / entry["filename"]
+        if not path.exists():
+            return False
+        stat = path.stat()
+
+        db = self._db()
+        row = db.execute("SELECT mtime_ns, size FROM files WHERE filename = ?", (entry["filename"],)).fetchone()
+        if row == (stat.st_mtime_ns, stat.st_size):
+            return True
+
+        with open(path, 'r', encoding='utf-8') as f:
+            code_system = json.load(f)
+        rows = []
+
+        def collect(concepts, parent):
+            for concept in concepts:
+                properties = {
+                    prop["code"]: next((v for k, v in prop.items() if k.startswith("value")), None)
+                    for prop in concept.get("property", [])
+                }
+                rows.append((system, concept["code"], concept.get("display"), parent,
+                             json.dumps(properties, ensure_ascii=False) if properties else None))
+                collect(concept.get("concept", []), concept["code"])
+
+        collect(code_system.get("concept", []), None)
+        with db:
+            db.execute("DELETE FROM concepts WHERE system = ?", (system,))
+            db.executemany("INSERT OR REPLACE INTO concepts VALUES (?, ?, ?, ?, ?)", rows)
+            db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                       (entry["filename"], stat.st_mtime_ns, stat.st_size))
+        return True
+
+    def get_concepts(self, system: str) -> Dict[str, str]:
+        """
+        取得 CodeSystem 的所有概念（第一次呼叫時才載入）
+
+        Args:
+            system: CodeSystem URL
+
+        Returns:
+            {code: display}；套件未提供該 CodeSystem 時為空字典
+        """
+        concepts = self._loaded.get(system)
+        if concepts is not None:
+            return concepts
+        with self._lock:
+            concepts = self._loaded.get(system)
+            if concepts is None:
+                concepts = {}
+                if self._ensure_indexed(system):
+                    cursor = self._db().execute("SELECT code, display FROM concepts WHERE system = ?", (system,))
+                    concepts = {code: display for code, display in cursor}
+                self._loaded[system] = concepts
+        return concepts
+
+    def lookup(self, system: str, code: str) -> Optional[str]:
+        """查詢代碼的顯示名稱，找不到時為 None"""
+        return self.get_concepts(system).get(code)
+
+    def validate_code(self, system: str, code: str) -> bool:
+        """代碼是否存在於 CodeSystem"""
+        return code in self.get_concepts(system)
+
+    def get_concept_details(self, system: str) -> List[Dict[str, Any]]:
+        """
+        取得 CodeSystem 所有概念的完整資訊（含上層概念與屬性），供 ValueSet 篩選使用
+
+        Returns:
+            [{"code", "display", "parent", "properties"}]
+        """
+        with self._lock:
+            if not self._ensure_indexed(system):
+                return []
+            cursor = self._db().execute(
+                "SELECT code, display, parent, properties FROM concepts WHERE system = ?", (system,))
+            return [
+                {"code": code, "display": display, "parent": parent,
+                 "properties": json.loads(properties) if properties else {}}
+                for code, display, parent, properties in cursor
+            ]
+
+    def close(self):
+        """關閉 SQLite 連線"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+@lru_cache(maxsize=None)
+def get_terminology_store(package_dir: str = "package") -> TerminologyStore:
+    """取得共用的術語庫（同一程序內只建立一次）"""
+    return TerminologyStore(package_dir)
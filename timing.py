@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+階段計時模組
+記錄生成、序列化、寫檔與上傳等各階段（及各資源類型）的耗時，並提供 cProfile 效能剖析
+"""
+
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# 停用時共用的空 context manager，避免每次呼叫都建立物件
+_NULL_SPAN = nullcontext()
+
+# 剖析報告中列出的函式數
+PROFILE_REPORT_LINES = 40
+
+
+class _Span:
+    __slots__ = ("timer", "name", "start")
+
+    def __init__(self, timer: "StageTimer", name: str):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class StageTimer:
+    """累計各階段耗時的計時器（執行緒安全）"""
+
+    def __init__(self, enabled: bool = True):
+        """
+        Args:
+            enabled: 停用時 span() 不做任何事
+        """
+        self.enabled = enabled
+        self._totals: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def span(self, name: str):
+        """
+        計時區段
+
+        Args:
+            name: 階段名稱，例如 "generation" 或 "generate.Observation"
+
+        Returns:
+            context manager
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def add(self, name: str, seconds: float, count: int = 1):
+        """直接累加一段耗時"""
+        if not self.enabled:
+            return
+        with self._lock:
+            total = self._totals.get(name)
+            if total is None:
+                self._totals[name] = [seconds, count]
+            else:
+                total[0] += seconds
+                total[1] += count
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """
+        取得計時結果
+
+        Returns:
+            {階段名稱: {"seconds": 總秒數, "count": 次數, "mean_ms": 平均毫秒}}
+        """
+        with self._lock:
+            return {
+                name: {
+                    "seconds": round(seconds, 6),
+                    "count": count,
+                    "mean_ms": round(seconds / count * 1000, 4) if count else 0.0
+                }
+                for name, (seconds, count) in self._totals.items()
+            }
+
+    def format_summary(self) -> str:
+        """以文字表格輸出計時結果"""
+        lines = [f"{'階段':<32}{'秒':>10}{'次數':>8}{'平均 ms':>12}"]
+        for name, stats in self.summary().items():
+            lines.append(f"{name:<32}{stats['seconds']:>10.3f}{stats['count']:>8}{stats['mean_ms']:>12.3f}")
+        return "\n".join(lines)
+
+
+# 未啟用計時時使用的共用計時器
+NULL_TIMER = StageTimer(enabled=False)
+
+
+class Profiler:
+    """以 cProfile 剖析一段程式，結束時輸出 .prof 與文字報告"""
+
+    def __init__(self, label: str = "run", output_dir: str = "output/profiles", enabled: bool = True):
+        """
+        Args:
+            label: 檔名前綴
+            output_dir: 輸出目錄
+            enabled: 停用時不剖析
+        """
+        self.label = label
+        self.output_dir = Path(output_dir)
+        self.enabled = enabled
+        self.stats_path: Optional[Path] = None
+        self.report_path: Optional[Path] = None
+        self._profile = None
+
+    def __enter__(self):
+        if self.enabled:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self._profile is None:
+            return False
+        self._profile.disable()
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"{self.label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        self.stats_path = self.output_dir / f"{stem}.prof"
+        self.report_path = self.output_dir / f"{stem}.txt"
+        self._profile.dump_stats(str(self.stats_path))
+
+        report = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=report)
+        stats.sort_stats("cumulative").print_stats(PROFILE_REPORT_LINES)
+        with open(self.report_path, 'w', encoding='utf-8') as f:
+            f.write(report.getvalue())
+        self._profile = None
+        return False
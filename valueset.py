@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+ValueSet 展開模組
+依 compose.include / exclude 規則，以本地 CodeSystem 展開 TW Core ValueSet，
+展開結果依 (URL, 版本, 套件內容) 持久化，之後的展開、成員判斷與取樣都不需要重新計算
+"""
+
+import hashlib
+import json
+import re
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from generation_cache import package_version
+from population_model import AliasSampler
+from terminology import TerminologyStore, get_terminology_store
+
+# 持久化格式版本，變更展開邏輯時遞增以淘汰舊快取
+EXPANSION_FORMAT = 1
+
+
+class ValueSetExpansion:
+    """ValueSet 展開結果"""
+
+    def __init__(self, url: str, version: Optional[str], contains: List[Tuple[str, str, Optional[str]]],
+                 complete: bool = True, unresolved: Optional[List[str]] = None):
+        """
+        Args:
+            url: ValueSet URL
+            version: ValueSet 版本
+            contains: [(system, code, display)]
+            complete: 所有 include 規則是否都能以本地 CodeSystem 完整展開
+            unresolved: 無法展開的 CodeSystem 或 ValueSet
+        """
+        self.url = url
+        self.version = version
+        self.contains = contains
+        self.complete = complete
+        self.unresolved = unresolved or []
+        self._members = {(system, code) for system, code, _ in contains}
+        self._sampler = None
+
+    def __len__(self) -> int:
+        return len(self.contains)
+
+    def has_code(self, system: str, code: str) -> bool:
+        """代碼是否屬於此 ValueSet（O(1)）"""
+        return (system, code) in self._members
+
+    def codes(self, system: Optional[str] = None) -> Set[str]:
+        """取得所有代碼（可限定 CodeSystem）"""
+        return {code for s, code, _ in self.contains if system is None or s == system}
+
+    def sample(self) -> Tuple[str, str, Optional[str]]:
+        """均勻取樣一個概念，回傳 (system, code, display)"""
+        if not self.contains:
+            raise ValueError(f"ValueSet 展開結果為空: {self.url}")
+        if self._sampler is None:
+            self._sampler = AliasSampler(self.contains, [1] * len(self.contains))
+        return self._sampler.sample()
+
+    def weighted_sampler(self, weights: Dict[str, float], default_weight: float = 0.0) -> AliasSampler:
+        """
+        建立依代碼加權的取樣器
+
+        Args:
+            weights: {code: 權重}
+            default_weight: 未列出的代碼使用的權重
+
+        Returns:
+            取樣 (system, code, display) 的 AliasSampler
+        """
+        return AliasSampler(self.contains, [weights.get(code, default_weight) for _, code, _ in self.contains])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "format": EXPANSION_FORMAT,
+            "url": self.url,
+            "version": self.version,
+            "complete": self.complete,
+            "unresolved": self.unresolved,
+            "contains": [list(item) for item in self.contains]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ValueSetExpansion":
+        return cls(data["url"], data.get("version"), [tuple(item) for item in data["contains"]],
+                   data.get("complete", True), data.get("unresolved"))
+
+    def to_fhir(self) -> Dict[str, Any]:
+        """轉換為 FHIR ValueSet.expansion 結構"""
+        return {
+            "total": len(self.contains),
+            "contains": [
+                {"system": system, "code": code, **({"display": display} if display else {})}
+                for system, code, display in self.contains
+            ]
+        }
+
+
+class ValueSetExpander:
+    """ValueSet 展開引擎"""
+
+    def __init__(self, store: Optional[TerminologyStore] = None,
+                 cache_dir: str = "output/.terminology/expansions"):
+        """
+        初始化展開引擎
+
+        Args:
+            store: 術語庫，未指定時使用共用術語庫
+            cache_dir: 展開結果的持久化目錄
+        """
+        self.store = store or get_terminology_store()
+        self.cache_dir = Path(cache_dir)
+        self._expansions: Dict[Tuple[str, Optional[str]], ValueSetExpansion] = {}
+        self._lock = threading.RLock()
+        self._package_fingerprint: Optional[str] = None
+
+    def package_fingerprint(self) -> str:
+        """
+        術語套件內容的雜湊（第一次使用時計算）
+
+        本地建置的 IG 常在 CodeSystem 或被引用的 ValueSet 改變時不更新版本號，
+        磁碟快取的鍵因此包含套件內容，任一檔案改變時既有展開自動失效
+        """
+        if self._package_fingerprint is None:
+            self._package_fingerprint = str(package_version(str(self.store.package_dir)))
+        return self._package_fingerprint
+
+    def expand(self, url: str) -> Optional[ValueSetExpansion]:
+        """
+        展開 ValueSet（記憶體 → 磁碟快取 → 實際展開）
+
+        Args:
+            url: ValueSet canonical URL（可帶 |version）
+
+        Returns:
+            展開結果，套件中不存在該 ValueSet 時為 None
+        """
+        value_set = self.store.load_resource("ValueSet", url)
+        if value_set is None:
+            return None
+        key = (value_set["url"], value_set.get("version"))
+        expansion = self._expansions.get(key)
+        if expansion is not None:
+            return expansion
+
+        with self._lock:
+            expansion = self._expansions.get(key)
+            if expansion is None:
+                expansion = self._load_cached(*key)
+                if expansion is None:
+                    expansion = self._expand_compose(value_set, set())
+                    self._save_cached(expansion)
+                self._expansions[key] = expansion
+        return expansion
+
+    def validate_code(self, url: str, system: str, code: str) -> bool:
+        """代碼是否屬於指定 ValueSet"""
+        expansion = self.expand(url)
+        return expansion is not None and expansion.has_code(system, code)
+
+    def _cache_path(self, url: str, version: Optional[str]) -> Path:
+        digest = hashlib.sha1(f"{url}|{version}|{self.package_fingerprint()}".encode("utf-8")).hexdigest()
+        return self.cache_dir / f"{digest}.json"
+
+    def _load_cached(self, url: str, version: Optional[str]) -> Optional[ValueSetExpansion]:
+        path = self._cache_path(url, version)
+        if not path.exists():
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if data.get("format") != EXPANSION_FORMAT or data.get("url") != url or data.get("version") != version \
+                or data.get("package") != self.package_fingerprint():
+            return None
+        return ValueSetExpansion.from_dict(data)
+
+    def _save_cached(self, expansion: ValueSetExpansion):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._cache_path(expansion.url, expansion.version)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(expansion.to_dict(), package=self.package_fingerprint()), f, ensure_ascii=False)
+        tmp_path.replace(path)
+
+    def _expand_compose(self, value_set: Dict[str, Any], visiting: Set[str]) -> ValueSetExpansion:
+        """依 compose 規則展開；visiting 用於偵測 ValueSet 之間的循環引用"""
+        url = value_set["url"]
+        visiting = visiting | {url}
+        compose = value_set.get("compose", {})
+        unresolved: List[str] = []
+
+        included: Dict[Tuple[str, str], Optional[str]] = {}
+        for rule in compose.get("include", []):
+            included.update(self._evaluate_rule(rule, visiting, unresolved))
+        for rule in compose.get("exclude", []):
+            for key in self._evaluate_rule(rule, visiting, []):
+                included.pop(key, None)
+
+        contains = [(system, code, display) for (system, code), display in included.items()]
+        return ValueSetExpansion(url, value_set.get("version"), contains,
+                                 complete=not unresolved, unresolved=sorted(set(unresolved)))
+
+    def _evaluate_rule(self, rule: Dict[str, Any], visiting: Set[str],
+                       unresolved: List[str]) -> Dict[Tuple[str, str], Optional[str]]:
+        """計算單一 include/exclude 規則涵蓋的概念"""
+        result: Optional[Dict[Tuple[str, str], Optional[str]]] = None
+        system = rule.get("system")
+
+        if system:
+            if rule.get("concept"):
+                # 明確列出的概念不需要 CodeSystem 內容，顯示名稱優先使用本地 CodeSystem
+                concepts = self.store.get_concepts(system)
+                result = {
+                    (system, c["code"]): concepts.get(c["code"]) or c.get("display")
+                    for c in rule["concept"]
+                }
+            elif self.store.has_code_system(system):
+                details = self.store.get_concept_details(system)
+                for condition in rule.get("filter", []):
+                    details = self._apply_filter(details, condition)
+                result = {(system, c["code"]): c["display"] for c in details}
+            else:
+                unresolved.append(system)
+                result = {}
+
+        for value_set_url in rule.get("valueSet", []):
+            members = self._expand_nested(value_set_url, visiting, unresolved)
+            result = members if result is None else {k: v for k, v in result.items() if k in members}
+        return result or {}
+
+    def _expand_nested(self, url: str, visiting: Set[str],
+                       unresolved: List[str]) -> Dict[Tuple[str, str], Optional[str]]:
+        value_set = self.store.load_resource("ValueSet", url)
+        if value_set is None or value_set["url"] in visiting:
+            unresolved.append(url)
+            return {}
+        expansion = self._expand_compose(value_set, visiting)
+        unresolved.extend(expansion.unresolved)
+        return {(system, code): display for system, code, display in expansion.contains}
+
+    @staticmethod
+    def _apply_filter(details: List[Dict[str, Any]], condition: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """套用 ValueSet compose filter（支援 =、in、not-in、is-a、descendent-of、is-not-a、regex、exists）"""
+        prop, op, value = condition["property"], condition["op"], condition["value"]
+
+        if prop == "concept" and op in ("is-a", "descendent-of", "is-not-a"):
+            children: Dict[str, List[str]] = {}
+            for concept in details:
+                if concept["parent"]:
+                    children.setdefault(concept["parent"], []).append(concept["code"])
+            subtree = set()
+            stack = [value]
+            while stack:
+                code = stack.pop()
+                if code not in subtree:
+                    subtree.add(code)
+                    stack.extend(children.get(code, []))
+            if op == "descendent-of":
+                subtree.discard(value)
+            if op == "is-not-a":
+                return [c for c in details if c["code"] not in subtree]
+            return [c for c in details if c["code"] in subtree]
+
+        def get(concept):
+            if prop in ("code", "concept"):
+                return concept["code"]
+            if prop == "display":
+                return concept["display"]
+            found = concept["properties"].get(prop)
+            return None if found is None else str(found)
+
+        if op == "=":
+            return [c for c in details if get(c) == value]
+        if op == "in":
+            values = set(value.split(","))
+            return [c for c in details if get(c) in values]
+        if op == "not-in":
+            values = set(value.split(","))
+            return [c for c in details if get(c) not in values]
+        if op == "regex":
+            pattern = re.compile(value)
+            return [c for c in details if get(c) is not None and pattern.fullmatch(get(c))]
+        if op == "exists":
+            wanted = value.lower() == "true"
+            return [c for c in details if (get(c) is not None) == wanted]
+        raise ValueError(f"不支援的 ValueSet filter 運算子: {op}")
+
+
+@lru_cache(maxsize=None)
+def get_value_set_expander(package_dir: str = "package") -> ValueSetExpander:
+    """取得共用的 ValueSet 展開引擎（同一程序內只建立一次）"""
+    return ValueSetExpander(get_terminology_store(package_dir))